@@ -4,7 +4,13 @@ from import_export.admin import ImportExportModelAdmin
 from import_export.fields import Field
 from datetime import datetime, timedelta
 from .models import Restaurant, Product, Courier, Order, OrderItem
-from django.db.models import Q
+from .exports import dump_query
+from .search import search_products
+from .order_status import change_orders_status
+from .order_notifications import schedule_status_notifications
+from .tasks import export_data
+from django.db.models import Q, Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 # Monkey-patch для исправления совместимости unfold с Django 5.1
 from django.template import context as template_context
@@ -12,16 +18,20 @@ if not hasattr(template_context.RequestContext, '_processors_index'):
     template_context.RequestContext._processors_index = -1
 
 
+# Главная админки с карточками метрик (app/templates/admin/dashboard.html)
+admin.site.index_template = 'admin/dashboard.html'
+
+
 # Callback функции для Unfold
-def dashboard_callback(request):
-    from .models import Order, Product, Restaurant, Courier
+def dashboard_callback(request, context=None):
+    """Метрики дашборда из кеша (см. dashboard.py) и счетчики доставки писем"""
+    from .dashboard import get_dashboard_metrics
+    from .mail import get_mail_metrics
 
-    return {
-        "orders_count": Order.objects.count(),
-        "products_count": Product.objects.count(),
-        "restaurants_count": Restaurant.objects.count(),
-        "couriers_count": Courier.objects.count(),
-    }
+    context = context if context is not None else {}
+    context.update(get_dashboard_metrics())
+    context['mail_metrics'] = get_mail_metrics()
+    return context
 
 
 def command_search_callback(request, queryset, term):
@@ -29,12 +39,67 @@ def command_search_callback(request, queryset, term):
     if not term or not term.strip():
         return queryset
 
+    if queryset.model is Product:
+        # Продукты ищутся по полнотекстовому индексу, а не LIKE '%...%'
+        return queryset.filter(pk__in=[product_id for product_id, _ in search_products(term, limit=100, within=queryset)])
+
     return queryset.filter(
         Q(name__icontains=term)
         | Q(description__icontains=term)
     )
 
 
+def count_subquery(queryset, field: str) -> Coalesce:
+    """
+    Коррелированный COUNT для колонки списка в админке: считается только
+    для строк текущей страницы, без GROUP BY по всей таблице, и сортируется.
+    """
+    counts = (
+        queryset.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class CourierListFilter(admin.RelatedFieldListFilter):
+    """Фильтр по курьеру: имена берутся одним запросом, а не Courier.__str__ на каждого"""
+
+    def field_choices(self, field, request, model_admin):
+        return list(Courier.objects.order_by('user__username').values_list('pk', 'user__username'))
+
+
+class BackgroundExportMixin:
+    """Действия «выгрузить в фоне»: файл пишет Celery-задача export_data, ссылка на скачивание приходит на почту"""
+    export_kind = None
+    actions = ['export_csv_in_background', 'export_xlsx_in_background']
+
+    def queue_export(self, request, queryset, fmt: str) -> None:
+        export_data.delay(self.export_kind, fmt, dump_query(queryset), request.user.id)
+        self.message_user(request, f'Выгрузка {fmt.upper()} поставлена в очередь, о готовности придет письмо')
+
+    @admin.action(description='Выгрузить в CSV (в фоне)')
+    def export_csv_in_background(self, request, queryset):
+        self.queue_export(request, queryset, 'csv')
+
+    @admin.action(description='Выгрузить в XLSX (в фоне)')
+    def export_xlsx_in_background(self, request, queryset):
+        self.queue_export(request, queryset, 'xlsx')
+
+
+def status_action(new_status: str, label: str):
+    """Действие админки: перевести выбранные заказы в new_status одной пачкой (см. order_status.py)"""
+    @admin.action(description=f'Перевести в «{label}»')
+    def action(modeladmin, request, queryset):
+        result = change_orders_status(queryset, new_status, request.user)
+        schedule_status_notifications(order.id for order in result.changed)
+        message = f'Статус «{label}»: {len(result.changed)} заказов'
+        if result.skipped:
+            message += f', пропущено {len(result.skipped)} (переход недопустим или статус уже изменен)'
+        modeladmin.message_user(request, message)
+    action.__name__ = f'set_status_{new_status}'
+    return action
+
+
 # Ресурсы для экспорта
 class OrderItemInline(admin.TabularInline):
     """Инлайн для элементов заказа"""
@@ -120,27 +185,35 @@ class RestaurantAdmin(admin.ModelAdmin):
     list_display_links = ('name',)
     raw_id_fields = ('owner',)
     date_hierarchy = 'created_at'
+    list_select_related = ('owner',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(product_count=count_subquery(Product.objects, 'restaurant'))
 
-    @admin.display(description='Количество продуктов')
+    @admin.display(description='Количество продуктов', ordering='product_count')
     def get_product_count(self, obj):
-        return obj.product_set.count()
+        return obj.product_count
     get_product_count.short_description = 'Продуктов'
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(BackgroundExportMixin, admin.ModelAdmin):
     """Админ-панель для продуктов"""
+    export_kind = 'products'
     list_display = ('name', 'restaurant', 'price', 'get_order_count')
     list_filter = ('restaurant', 'price')
     search_fields = ('name', 'description')
     list_display_links = ('name',)
     raw_id_fields = ('restaurant',)
     exclude = ('created_at',)  # Явно исключаем created_at из формы
+    list_select_related = ('restaurant',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(order_count=count_subquery(OrderItem.objects, 'product'))
 
-    @admin.display(description='В заказах')
+    @admin.display(description='В заказах', ordering='order_count')
     def get_order_count(self, obj):
-        return obj.orderitem_set.count()
+        return obj.order_count
     get_order_count.short_description = 'Заказов'
 
 
@@ -153,19 +226,28 @@ class CourierAdmin(admin.ModelAdmin):
     list_display_links = ('user',)
     raw_id_fields = ('user',)
     readonly_fields = ('get_order_count',)
+    list_select_related = ('user',)
 
-    @admin.display(description='Активных заказов')
+    def get_queryset(self, request):
+        active_orders = Order.objects.filter(status__in=['preparing', 'ready', 'delivering'])
+        return super().get_queryset(request).annotate(active_order_count=count_subquery(active_orders, 'courier'))
+
+    @admin.display(description='Активных заказов', ordering='active_order_count')
     def get_order_count(self, obj):
-        return obj.order_set.filter(status__in=['preparing', 'ready', 'delivering']).count()
+        return obj.active_order_count
     get_order_count.short_description = 'Активных заказов'
 
 
 @admin.register(Order)
-class OrderAdmin(ImportExportModelAdmin):
+class OrderAdmin(BackgroundExportMixin, ImportExportModelAdmin):
     """Админ-панель для заказов"""
     resource_class = OrderResource
+    export_kind = 'orders'
+    actions = BackgroundExportMixin.actions + [
+        status_action(status, label) for status, label in Order.STATUS_CHOICES if status != 'pending'
+    ]
     list_display = ('id', 'customer', 'restaurant', 'courier', 'status', 'total_price', 'get_item_count', 'created_at')
-    list_filter = ('status', 'created_at', 'restaurant', 'courier')
+    list_filter = ('status', 'created_at', 'restaurant', ('courier', CourierListFilter))
     search_fields = ('customer__username', 'address', 'id')
     list_display_links = ('id',)
     raw_id_fields = ('customer', 'restaurant', 'courier')
@@ -173,6 +255,7 @@ class OrderAdmin(ImportExportModelAdmin):
     date_hierarchy = 'created_at'
     inlines = [OrderItemInline]
     filter_horizontal = ()
+    list_select_related = ('customer', 'restaurant', 'courier__user')
     fieldsets = (
         ('Основная информация', {
             'fields': ('customer', 'restaurant', 'courier', 'status')
@@ -188,9 +271,12 @@ class OrderAdmin(ImportExportModelAdmin):
         }),
     )
 
-    @admin.display(description='Позиций')
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(item_count=count_subquery(OrderItem.objects, 'order'))
+
+    @admin.display(description='Позиций', ordering='item_count')
     def get_item_count(self, obj):
-        return obj.items.count()
+        return obj.item_count
     get_item_count.short_description = 'Позиций в заказе'
 
 
@@ -203,6 +289,7 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_display_links = ('id',)
     raw_id_fields = ('order', 'product')
     readonly_fields = ('get_total',)
+    list_select_related = ('order__customer', 'product__restaurant')
 
     @admin.display(description='Итого')
     def get_total(self, obj):
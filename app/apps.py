@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AppConfig(AppConfig):
     name = 'app'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401 — регистрация проверок и обработчиков сигналов
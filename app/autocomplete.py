@@ -0,0 +1,195 @@
+"""
+Автодополнение названий ресторанов и продуктов из памяти процесса.
+
+Индекс строится из БД при первом запросе (два values_list) и дальше
+обновляется сигналами сохранения/удаления. Другие процессы узнают об
+изменениях по версии каталога (cache.get_catalogue_version) и
+перестраивают свой индекс, так что ввод по буквам не нагружает БД.
+
+Поиск: префикс слова (отсортированный словарь + bisect) и нечеткое
+совпадение по триграммам (сходство Жаккара), чтобы опечатки вроде
+«пица» находили «Пицца».
+"""
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from typing import Optional
+
+from .cache import get_catalogue_version
+from .models import Restaurant, Product
+
+WORD_RE = re.compile(r'\w+')
+MIN_SIMILARITY = 0.3
+
+
+def normalize(text: str) -> list[str]:
+    return WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def trigrams(word: str) -> set[str]:
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a: set[str], b: set[str]) -> float:
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared) if shared else 0.0
+
+
+@dataclass
+class Entry:
+    kind: str  # 'restaurant' | 'product'
+    id: int
+    name: str
+    restaurant_id: Optional[int]
+    words: list[str]
+
+
+class AutocompleteIndex:
+    """
+    Индекс по словарю слов названий: слово -> записи, отсортированный список
+    слов для префиксов и триграмма -> слова для нечеткого поиска. Сходство
+    считается по словарю (он много меньше числа записей), а не по записям.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple[str, int], Entry] = {}
+        self._vocabulary: dict[str, set[tuple[str, int]]] = {}  # слово -> ключи записей
+        self._sorted_words: list[str] = []
+        self._trigram_words: dict[str, set[str]] = {}
+        self._version = None
+        self._lock = threading.RLock()
+
+    # ---------- обновление ----------
+
+    def _add(self, kind: str, obj_id: int, name: str, restaurant_id: Optional[int] = None) -> None:
+        key = (kind, obj_id)
+        words = normalize(name)
+        self._entries[key] = Entry(kind, obj_id, name, restaurant_id, words)
+        for word in set(words):
+            keys = self._vocabulary.get(word)
+            if keys is None:
+                keys = self._vocabulary[word] = set()
+                insort(self._sorted_words, word)
+                for trigram in trigrams(word):
+                    self._trigram_words.setdefault(trigram, set()).add(word)
+            keys.add(key)
+
+    def _remove(self, kind: str, obj_id: int) -> None:
+        key = (kind, obj_id)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for word in set(entry.words):
+            keys = self._vocabulary.get(word, set())
+            keys.discard(key)
+            if keys:
+                continue
+            # Слово больше не встречается — убираем его из словаря
+            self._vocabulary.pop(word, None)
+            i = bisect_left(self._sorted_words, word)
+            if i < len(self._sorted_words) and self._sorted_words[i] == word:
+                del self._sorted_words[i]
+            for trigram in trigrams(word):
+                self._trigram_words.get(trigram, set()).discard(word)
+
+    def rebuild(self) -> None:
+        with self._lock:
+            version = get_catalogue_version()
+            self._entries.clear()
+            self._vocabulary.clear()
+            self._sorted_words.clear()
+            self._trigram_words.clear()
+            for restaurant_id, name in Restaurant.objects.values_list('id', 'name'):
+                self._add('restaurant', restaurant_id, name)
+            for product_id, name, restaurant_id in Product.objects.values_list('id', 'name', 'restaurant_id'):
+                self._add('product', product_id, name, restaurant_id)
+            self._version = version
+
+    def update(self, kind: str, obj_id: int, name: Optional[str] = None, restaurant_id: Optional[int] = None) -> None:
+        """Обновляет запись (name=None — удаление); вызывается из сигналов"""
+        with self._lock:
+            if self._version is None:
+                return  # индекс еще не строился — соберется при первом запросе
+            self._remove(kind, obj_id)
+            if name is not None:
+                self._add(kind, obj_id, name, restaurant_id)
+            # Сигнал приходит после bump_catalogue_version (+1). Если до этого изменения
+            # индекс был актуален, принимаем новую версию без перестройки; иначе были
+            # изменения в других процессах, и индекс перестроится при следующем поиске.
+            version = get_catalogue_version()
+            if self._version == version - 1:
+                self._version = version
+
+    # ---------- поиск ----------
+
+    def _ensure_fresh(self) -> None:
+        if self._version != get_catalogue_version():
+            self.rebuild()
+
+    def _match_words(self, query_word: str) -> dict[str, float]:
+        """
+        Слова словаря, подходящие к слову запроса: 1 — префикс, иначе триграммное
+        сходство со словом целиком или с его началом той же длины (слово еще не дописано)
+        """
+        matches = {}
+        i = bisect_left(self._sorted_words, query_word)
+        while i < len(self._sorted_words) and self._sorted_words[i].startswith(query_word):
+            matches[self._sorted_words[i]] = 1.0
+            i += 1
+
+        query_trigrams = trigrams(query_word)
+        candidates = set()
+        for trigram in query_trigrams:
+            candidates |= self._trigram_words.get(trigram, set())
+        for word in candidates - matches.keys():
+            score = max(
+                similarity(query_trigrams, trigrams(word)),
+                similarity(query_trigrams, trigrams(word[:len(query_word)])),
+            )
+            if score >= MIN_SIMILARITY:
+                matches[word] = score
+        return matches
+
+    def search(self, query: str, limit: int = 10, kind: Optional[str] = None) -> list[dict]:
+        query_words = normalize(query)
+        if not query_words:
+            return []
+        with self._lock:
+            self._ensure_fresh()
+            # Для каждой записи — лучший балл по каждому слову запроса; нужны все слова (AND)
+            scores: Optional[dict[tuple[str, int], float]] = None
+            for query_word in query_words:
+                word_scores: dict[tuple[str, int], float] = {}
+                for word, score in self._match_words(query_word).items():
+                    for key in self._vocabulary[word]:
+                        if score > word_scores.get(key, 0):
+                            word_scores[key] = score
+                scores = word_scores if scores is None else {
+                    key: total + word_scores[key] for key, total in scores.items() if key in word_scores
+                }
+
+            phrase = ' '.join(query_words)
+            results = []
+            for key, total in scores.items():
+                entry = self._entries[key]
+                if kind and entry.kind != kind:
+                    continue
+                score = total / len(query_words)
+                if ' '.join(entry.words).startswith(phrase):
+                    score += 0.5  # название начинается с запроса
+                results.append((score, entry))
+
+        top = heapq.nsmallest(limit, results, key=lambda item: (-item[0], len(item[1].name), item[1].name))
+        return [
+            {
+                'type': entry.kind, 'id': entry.id, 'name': entry.name,
+                'restaurant_id': entry.restaurant_id, 'score': round(score, 3),
+            }
+            for score, entry in top
+        ]
+
+
+autocomplete_index = AutocompleteIndex()
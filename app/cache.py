@@ -0,0 +1,87 @@
+"""
+Кеширование публичного каталога (рестораны, меню, список продуктов).
+
+Все ключи каталога включают номер версии. Любое изменение Restaurant или
+Product увеличивает версию (см. signals.py), и старые записи просто
+перестают читаться и вытесняются по таймауту.
+"""
+import time
+from functools import wraps
+from typing import Callable
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse, Http404
+
+from .models import Restaurant, Product
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+
+
+def get_catalogue_version() -> int:
+    """Текущая версия каталога"""
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        # Стартуем с метки времени, чтобы после вытеснения ключа
+        # не совпасть с версией старых записей
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def bump_catalogue_version() -> None:
+    """Инвалидирует весь кеш каталога"""
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), None)
+
+
+def catalogue_cache_key(name: str, *parts) -> str:
+    return ':'.join(['catalogue', name, str(get_catalogue_version()), *map(str, parts)])
+
+
+def catalogue_context() -> dict:
+    """Переменные для тега {% cache %} во фрагментах каталога"""
+    return {
+        'catalogue_version': get_catalogue_version(),
+        'catalogue_cache_timeout': settings.CATALOGUE_CACHE_TIMEOUT,
+    }
+
+
+def get_restaurant_menu(restaurant_id: int) -> tuple[Restaurant, list[Product]]:
+    """Ресторан и его меню из кеша (Http404, если ресторана нет)"""
+    key = catalogue_cache_key('menu', restaurant_id)
+    menu = cache.get(key)
+    if menu is None:
+        try:
+            restaurant = Restaurant.objects.get(id=restaurant_id)
+        except Restaurant.DoesNotExist:
+            raise Http404('Ресторан не найден')
+        menu = (restaurant, list(Product.objects.filter(restaurant=restaurant)))
+        cache.set(key, menu, settings.CATALOGUE_CACHE_TIMEOUT)
+    return menu
+
+
+def cache_catalogue_page(view: Callable) -> Callable:
+    """
+    Кеширует страницу каталога целиком для анонимных GET-запросов.
+    Страницы с flash-сообщениями и ответы не 200 не кешируются.
+    """
+    @wraps(view)
+    def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        if request.method != 'GET' or request.user.is_authenticated or len(get_messages(request)):
+            return view(request, *args, **kwargs)
+
+        key = catalogue_cache_key('page', request.get_full_path())
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            cache.set(key, (response.content, response['Content-Type']), settings.CATALOGUE_CACHE_TIMEOUT)
+        return response
+    return wrapper
@@ -0,0 +1,114 @@
+"""Расчёт стоимости корзины и оформление заказа из корзины"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, Restaurant, Order, OrderItem
+from .order_events import publish_order_status
+from .stats import record_product_sales
+
+
+@dataclass
+class CartLine:
+    """Строка корзины: продукт, количество и сумма по строке"""
+    product: Product
+    quantity: int
+
+    @property
+    def total(self) -> Decimal:
+        return self.product.price * self.quantity
+
+
+@dataclass
+class PricedCart:
+    """Результат расчёта корзины"""
+    lines: list[CartLine] = field(default_factory=list)
+    missing_product_ids: list[int] = field(default_factory=list)
+
+    @property
+    def total_price(self) -> Decimal:
+        return sum((line.total for line in self.lines), Decimal('0.00'))
+
+    @property
+    def items_count(self) -> int:
+        return sum(line.quantity for line in self.lines)
+
+    @property
+    def restaurant_ids(self) -> set[int]:
+        return {line.product.restaurant_id for line in self.lines}
+
+    def __bool__(self) -> bool:
+        return bool(self.lines)
+
+
+def price_cart(cart: dict, lock: bool = False) -> PricedCart:
+    """
+    Загружает все продукты корзины одним запросом (id__in) и считает итоги.
+
+    Args:
+        cart: Корзина в виде {product_id: quantity}
+        lock: Заблокировать строки продуктов (SELECT ... FOR UPDATE) одним запросом.
+            Строки блокируются в порядке id, чтобы параллельные оформления
+            не приводили к взаимоблокировкам. При блокировке отсутствующий
+            продукт считается ошибкой (Product.DoesNotExist).
+    """
+    quantities = {int(product_id): int(quantity) for product_id, quantity in cart.items()}
+    if not quantities:
+        return PricedCart()
+
+    if lock:
+        products = Product.objects.select_for_update().filter(id__in=quantities).order_by('id')
+    else:
+        products = Product.objects.filter(id__in=quantities).select_related('restaurant')
+    products_by_id = {product.id: product for product in products}
+
+    priced = PricedCart()
+    for product_id, quantity in quantities.items():  # порядок строк как в корзине
+        product = products_by_id.get(product_id)
+        if product is None:
+            priced.missing_product_ids.append(product_id)
+            continue
+        priced.lines.append(CartLine(product=product, quantity=quantity))
+
+    if lock and priced.missing_product_ids:
+        raise Product.DoesNotExist(f'Продукты не найдены: {priced.missing_product_ids}')
+    return priced
+
+
+def place_order(customer: User, restaurant: Restaurant, address: str, cart: dict) -> Order:
+    """
+    Оформляет заказ из корзины за фиксированное число запросов.
+
+    Итог считается до вставки, поэтому заказ записывается одним INSERT
+    (и одной строкой HistoricalOrder), а все позиции — одним bulk_create.
+    bulk_create не шлет сигналы, поэтому продажи в рейтинг популярности
+    записываются здесь же. Статус нового заказа публикуется подписчикам.
+
+    Args:
+        customer: Клиент
+        restaurant: Ресторан заказа
+        address: Адрес доставки
+        cart: Корзина в виде {product_id: quantity}
+    """
+    with transaction.atomic():
+        locked = price_cart(cart, lock=True)
+        order = Order.objects.create(
+            customer=customer,
+            restaurant=restaurant,
+            address=address,
+            status='pending',
+            total_price=locked.total_price,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=line.product, quantity=line.quantity, price=line.product.price)
+            for line in locked.lines
+        ])
+        record_product_sales(
+            timezone.localdate(order.created_at),
+            [(line.product.id, line.product.restaurant_id, line.quantity) for line in locked.lines],
+        )
+        publish_order_status([order])
+    return order
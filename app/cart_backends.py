@@ -0,0 +1,214 @@
+"""
+Хранилища корзины.
+
+Корзина хранится отдельно от сессии, построчно: изменение одной строки —
+одна запись, без пересериализации всей сессии. Бэкенд выбирается
+настройкой CART_BACKEND (путь к классу).
+"""
+import threading
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils.module_loading import import_string
+
+from .models import CartItem
+
+
+def count_cache_key(user_id: int) -> str:
+    return f'cart:count:{user_id}'
+
+
+def invalidates_count(method):
+    """
+    Сбрасывает закешированное количество товаров после изменения корзины.
+    Повторный сброс после коммита не даёт параллельному запросу закешировать
+    значение, прочитанное до фиксации транзакции.
+    """
+    @wraps(method)
+    def wrapper(self, user_id: int, *args, **kwargs):
+        result = method(self, user_id, *args, **kwargs)
+        key = count_cache_key(user_id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+        return result
+    return wrapper
+
+
+def check_quantity(quantity: int) -> None:
+    """add принимает только положительное количество (уменьшение — через set)"""
+    if quantity <= 0:
+        raise ValueError(f'Количество должно быть положительным: {quantity}')
+
+
+class CartBackend:
+    """Базовый интерфейс хранилища корзины. Корзина — {product_id: quantity}"""
+
+    def get(self, user_id: int) -> dict[int, int]:
+        raise NotImplementedError
+
+    def add(self, user_id: int, product_id: int, quantity: int = 1) -> None:
+        """Атомарно увеличивает количество товара в корзине; quantity > 0, иначе ValueError"""
+        raise NotImplementedError
+
+    def set(self, user_id: int, product_id: int, quantity: int) -> None:
+        """Устанавливает количество; quantity <= 0 удаляет строку"""
+        raise NotImplementedError
+
+    def remove(self, user_id: int, product_id: int) -> None:
+        raise NotImplementedError
+
+    def clear(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    def count(self, user_id: int) -> int:
+        """Общее количество товаров в корзине"""
+        return sum(self.get(user_id).values())
+
+    def cached_count(self, user_id: int) -> int:
+        """Количество товаров из кеша; сбрасывается при любом изменении корзины"""
+        key = count_cache_key(user_id)
+        count = cache.get(key)
+        if count is None:
+            count = self.count(user_id)
+            cache.set(key, count, settings.CART_COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class DatabaseCartBackend(CartBackend):
+    """Корзина в таблице CartItem (строка на пару пользователь/продукт)"""
+
+    def get(self, user_id: int) -> dict[int, int]:
+        return dict(CartItem.objects.filter(user_id=user_id).values_list('product_id', 'quantity'))
+
+    @invalidates_count
+    def add(self, user_id: int, product_id: int, quantity: int = 1) -> None:
+        check_quantity(quantity)
+        lines = CartItem.objects.filter(user_id=user_id, product_id=product_id)
+        if lines.update(quantity=F('quantity') + quantity):
+            return
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(user_id=user_id, product_id=product_id, quantity=quantity)
+        except IntegrityError:
+            # Строку уже вставил параллельный запрос — просто увеличиваем
+            lines.update(quantity=F('quantity') + quantity)
+
+    @invalidates_count
+    def set(self, user_id: int, product_id: int, quantity: int) -> None:
+        if quantity <= 0:
+            self.remove(user_id, product_id)
+            return
+        # Upsert одним запросом: INSERT ... ON CONFLICT DO UPDATE
+        CartItem.objects.bulk_create(
+            [CartItem(user_id=user_id, product_id=product_id, quantity=quantity)],
+            update_conflicts=True,
+            unique_fields=['user', 'product'],
+            update_fields=['quantity', 'updated_at'],
+        )
+
+    @invalidates_count
+    def remove(self, user_id: int, product_id: int) -> None:
+        CartItem.objects.filter(user_id=user_id, product_id=product_id).delete()
+
+    @invalidates_count
+    def clear(self, user_id: int) -> None:
+        CartItem.objects.filter(user_id=user_id).delete()
+
+    def count(self, user_id: int) -> int:
+        return CartItem.objects.filter(user_id=user_id).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+class RedisCartBackend(CartBackend):
+    """Корзина в Redis: hash cart:<user_id> с полями product_id -> quantity"""
+
+    def __init__(self) -> None:
+        import redis
+        self.client = redis.Redis.from_url(settings.CART_REDIS_URL, decode_responses=True)
+        self.ttl = settings.CART_REDIS_TTL
+
+    def _key(self, user_id: int) -> str:
+        return f'cart:{user_id}'
+
+    def get(self, user_id: int) -> dict[int, int]:
+        return {int(pid): int(qty) for pid, qty in self.client.hgetall(self._key(user_id)).items()}
+
+    @invalidates_count
+    def add(self, user_id: int, product_id: int, quantity: int = 1) -> None:
+        check_quantity(quantity)
+        key = self._key(user_id)
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, product_id, quantity)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    @invalidates_count
+    def set(self, user_id: int, product_id: int, quantity: int) -> None:
+        if quantity <= 0:
+            self.remove(user_id, product_id)
+            return
+        key = self._key(user_id)
+        pipe = self.client.pipeline()
+        pipe.hset(key, product_id, quantity)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    @invalidates_count
+    def remove(self, user_id: int, product_id: int) -> None:
+        self.client.hdel(self._key(user_id), product_id)
+
+    @invalidates_count
+    def clear(self, user_id: int) -> None:
+        self.client.delete(self._key(user_id))
+
+    def count(self, user_id: int) -> int:
+        return sum(int(qty) for qty in self.client.hvals(self._key(user_id)))
+
+
+class InMemoryCartBackend(CartBackend):
+    """Корзина в памяти процесса (для тестов и локальной отладки)"""
+
+    def __init__(self) -> None:
+        self._carts: dict[int, dict[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> dict[int, int]:
+        with self._lock:
+            return dict(self._carts.get(user_id, {}))
+
+    @invalidates_count
+    def add(self, user_id: int, product_id: int, quantity: int = 1) -> None:
+        check_quantity(quantity)
+        with self._lock:
+            cart = self._carts.setdefault(user_id, {})
+            cart[product_id] = cart.get(product_id, 0) + quantity
+
+    @invalidates_count
+    def set(self, user_id: int, product_id: int, quantity: int) -> None:
+        if quantity <= 0:
+            self.remove(user_id, product_id)
+            return
+        with self._lock:
+            self._carts.setdefault(user_id, {})[product_id] = quantity
+
+    @invalidates_count
+    def remove(self, user_id: int, product_id: int) -> None:
+        with self._lock:
+            self._carts.get(user_id, {}).pop(product_id, None)
+
+    @invalidates_count
+    def clear(self, user_id: int) -> None:
+        with self._lock:
+            self._carts.pop(user_id, None)
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path: str) -> CartBackend:
+    return import_string(path)()
+
+
+def get_cart_backend() -> CartBackend:
+    """Текущее хранилище корзины по настройке CART_BACKEND"""
+    return _load_backend(settings.CART_BACKEND)
@@ -0,0 +1,55 @@
+"""
+Проверки конфигурации при запуске.
+
+Веб-процессы и воркеры Celery обмениваются через кеш по умолчанию:
+beat кладет туда метрики дашборда, воркеры — счетчики доставки писем,
+админка их читает. С кешем в памяти процесса (LocMemCache) каждый процесс
+видит только свои данные. Веб-процессу и командам manage.py это не мешает
+работать, поэтому для них это предупреждение app.W001; воркер и beat
+с таким кешем не запускаются (кроме тестов и SHARED_CACHE_REQUIRED=False).
+"""
+from typing import Optional
+
+from celery.signals import beat_init, worker_init
+from django.conf import settings
+from django.core.checks import Warning, register
+from django.core.exceptions import ImproperlyConfigured
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+SHARED_CACHE_HINT = 'Задайте CACHE_REDIS_URL (или SHARED_CACHE_REQUIRED=False для запуска в одном процессе).'
+
+
+def process_local_cache() -> Optional[str]:
+    """Бэкенд кеша по умолчанию, если он не общий для процессов, а общий кеш требуется"""
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.SHARED_CACHE_REQUIRED and backend in PROCESS_LOCAL_CACHES:
+        return backend
+    return None
+
+
+@register('caches')
+def check_shared_cache(app_configs=None, **kwargs) -> list[Warning]:
+    backend = process_local_cache()
+    if backend is None:
+        return []
+    return [Warning(
+        f'Кеш по умолчанию ({backend}) не общий для процессов: админка не увидит метрики '
+        'дашборда и счетчики доставки писем из воркеров Celery.',
+        hint=SHARED_CACHE_HINT,
+        id='app.W001',
+    )]
+
+
+@worker_init.connect
+@beat_init.connect
+def check_shared_cache_on_celery_start(**kwargs) -> None:
+    """Воркер и beat без общего кеша не запускаются: их данные не дойдут до веб-процесса"""
+    backend = process_local_cache()
+    if backend is not None:
+        raise ImproperlyConfigured(
+            f'Кеш по умолчанию ({backend}) не общий для процессов, воркеры Celery требуют общий кеш. '
+            f'{SHARED_CACHE_HINT}'
+        )
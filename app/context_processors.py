@@ -0,0 +1,18 @@
+from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
+
+from .cart_backends import get_cart_backend
+
+
+def cart(request: HttpRequest) -> dict:
+    """
+    Количество товаров в корзине для шапки сайта.
+    Считается лениво — только если шаблон действительно выводит счетчик,
+    не более одного раза за запрос и берется из кеша хранилища корзины.
+    """
+    def count() -> int:
+        if not request.user.is_authenticated:
+            return 0
+        return get_cart_backend().cached_count(request.user.id)
+
+    return {'cart_items_count': SimpleLazyObject(count)}
@@ -0,0 +1,65 @@
+"""
+Метрики дашборда админки (Unfold).
+
+Метрики считаются периодической задачей refresh_dashboard_metrics и
+читаются из общего кеша (Redis, см. app/checks.py); при промахе кеша
+считаются синхронно. Выводятся на главной админки (admin/dashboard.html). Для больших
+таблиц на PostgreSQL можно включить приблизительные счетчики из
+статистики планировщика (DASHBOARD_APPROXIMATE_COUNTS).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Model, Sum
+from django.utils import timezone
+
+from .models import Restaurant, Product, Courier, Order, OrderDailyStats
+
+DASHBOARD_METRICS_KEY = 'dashboard:metrics'
+ACTIVE_ORDER_STATUSES = ('preparing', 'ready', 'delivering')
+
+
+def table_count(model: type[Model]) -> int:
+    """Число строк таблицы: оценка pg_class.reltuples или точный COUNT(*)"""
+    if settings.DASHBOARD_APPROXIMATE_COUNTS and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:  # -1 — таблица еще не анализировалась
+            return row[0]
+    return model.objects.count()
+
+
+def compute_dashboard_metrics() -> dict:
+    """Считает метрики дашборда по БД"""
+    today = OrderDailyStats.objects.filter(date=timezone.localdate()).exclude(status='cancelled').aggregate(
+        orders=Sum('order_count'), revenue=Sum('revenue'),
+    )
+    active_couriers = (
+        Order.objects.filter(status__in=ACTIVE_ORDER_STATUSES, courier__isnull=False)
+        .order_by().values('courier').distinct().count()
+    )
+    return {
+        'orders_count': table_count(Order),
+        'products_count': table_count(Product),
+        'restaurants_count': table_count(Restaurant),
+        'couriers_count': table_count(Courier),
+        'today_orders': today['orders'] or 0,
+        'today_revenue': today['revenue'] or 0,
+        'active_couriers': active_couriers,
+        'updated_at': timezone.now(),
+    }
+
+
+def refresh_dashboard_metrics() -> dict:
+    metrics = compute_dashboard_metrics()
+    cache.set(DASHBOARD_METRICS_KEY, metrics, settings.DASHBOARD_CACHE_TIMEOUT)
+    return metrics
+
+
+def get_dashboard_metrics() -> dict:
+    """Метрики из кеша (при промахе — пересчет)"""
+    metrics = cache.get(DASHBOARD_METRICS_KEY)
+    if metrics is None:
+        metrics = refresh_dashboard_metrics()
+    return metrics
@@ -0,0 +1,151 @@
+"""
+Фоновая выгрузка заказов и продуктов в CSV/XLSX.
+
+Строки читаются с сервера порциями (iterator(chunk_size=...)) через
+values_list с JOIN'ами — без создания моделей и без запросов на строку —
+и сразу дописываются в файл: CSV построчно, XLSX в режиме write_only.
+Память задачи не зависит от объема выгрузки.
+
+Выборка из админки передается в задачу как подписанный сериализованный
+queryset.query, поэтому выгружается ровно то, что выбрано (в том числе
+«все N записей» с фильтрами), без передачи списка id.
+
+Готовый файл скачивается по ссылке из письма (views.export_download,
+только для персонала); путь на сервере пользователю не показывается.
+"""
+import base64
+import csv
+import pickle
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Model, QuerySet
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Product, Order
+
+QUERY_SIGNING_SALT = 'app.exports.query'
+
+STATUS_DISPLAY = dict(Order.STATUS_CHOICES)
+
+
+@dataclass(frozen=True)
+class ExportSpec:
+    """Колонки выгрузки: поля values_list, заголовки и преобразование строки"""
+    model: type[Model]
+    fields: tuple[str, ...]
+    headers: tuple[str, ...]
+    format_row: Callable[[tuple], list]
+
+
+def format_order_row(row: tuple) -> list:
+    order_id, customer, restaurant, status, address, total, created_at = row
+    created_at = timezone.localtime(created_at)
+    return [
+        order_id, customer, restaurant, status, STATUS_DISPLAY.get(status, status), address,
+        total, f'{total} ₽', created_at.replace(tzinfo=None), created_at.strftime('%d-%m-%Y'),
+    ]
+
+
+def format_product_row(row: tuple) -> list:
+    product_id, name, description, restaurant, price, created_at = row
+    return [
+        product_id, name, description, restaurant, price, f'{price} ₽',
+        timezone.localtime(created_at).replace(tzinfo=None),
+    ]
+
+
+# Колонки совпадают с OrderResource / ProductResource из admin.py
+EXPORTS = {
+    'orders': ExportSpec(
+        model=Order,
+        fields=('id', 'customer__username', 'restaurant__name', 'status', 'address', 'total_price', 'created_at'),
+        headers=('id', 'Клиент', 'Ресторан', 'status', 'Статус (текст)', 'address', 'total_price',
+                 'Сумма (форматированная)', 'created_at', 'Дата создания (формат)'),
+        format_row=format_order_row,
+    ),
+    'products': ExportSpec(
+        model=Product,
+        fields=('id', 'name', 'description', 'restaurant__name', 'price', 'created_at'),
+        headers=('id', 'name', 'description', 'Ресторан', 'price', 'Цена (форматированная)', 'created_at'),
+        format_row=format_product_row,
+    ),
+}
+EXPORT_FORMATS = ('csv', 'xlsx')
+# Имя файла, которое пишет export_to_file: <kind>-<время>.<fmt>
+EXPORT_NAME_RE = re.compile(rf'({"|".join(EXPORTS)})-[\d-]+\.({"|".join(EXPORT_FORMATS)})')
+
+
+def dump_query(queryset: QuerySet) -> str:
+    """Сериализует выборку для передачи в задачу (подпись защищает от подмены при unpickle)"""
+    return signing.dumps(base64.b64encode(pickle.dumps(queryset.query)).decode(), salt=QUERY_SIGNING_SALT)
+
+
+def load_query(model: type[Model], token: str) -> QuerySet:
+    queryset = model.objects.all()
+    queryset.query = pickle.loads(base64.b64decode(signing.loads(token, salt=QUERY_SIGNING_SALT)))
+    return queryset
+
+
+def export_rows(spec: ExportSpec, queryset: QuerySet) -> Iterator[list]:
+    rows = queryset.order_by('pk').values_list(*spec.fields).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield spec.format_row(row)
+
+
+def write_csv(path: Path, headers: Iterable[str], rows: Iterable[list]) -> None:
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:  # BOM — для Excel
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+def write_xlsx(path: Path, headers: Iterable[str], rows: Iterable[list]) -> None:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)  # строки сразу сбрасываются на диск
+    sheet = workbook.create_sheet()
+    sheet.append(list(headers))
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def export_to_file(kind: str, fmt: str, queryset: QuerySet = None) -> Path:
+    """
+    Выгружает queryset (по умолчанию — все записи) в файл EXPORT_ROOT/<kind>-<время>.<fmt>.
+
+    Args:
+        kind: 'orders' или 'products'
+        fmt: 'csv' или 'xlsx'
+        queryset: Выборка модели из EXPORTS[kind]
+    """
+    spec = EXPORTS[kind]
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Неизвестный формат выгрузки: {fmt}')
+    if queryset is None:
+        queryset = spec.model.objects.all()
+
+    export_root = Path(settings.EXPORT_ROOT)
+    export_root.mkdir(parents=True, exist_ok=True)
+    path = export_root / f'{kind}-{timezone.localtime():%Y%m%d-%H%M%S-%f}.{fmt}'
+    writer = write_csv if fmt == 'csv' else write_xlsx
+    writer(path, spec.headers, export_rows(spec, queryset))
+    return path
+
+
+def export_path(name: str) -> Path:
+    """Путь к файлу выгрузки по имени из ссылки; ValueError — имя не выгрузки (в том числе ../)"""
+    if not EXPORT_NAME_RE.fullmatch(name):
+        raise ValueError(f'Некорректное имя выгрузки: {name}')
+    return Path(settings.EXPORT_ROOT) / name
+
+
+def export_url(path: Path) -> str:
+    """Абсолютная ссылка на скачивание выгрузки для письма"""
+    return settings.SITE_URL.rstrip('/') + reverse('export_download', args=[path.name])
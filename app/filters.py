@@ -1,4 +1,8 @@
+from datetime import date, datetime, time, timedelta
+
 import django_filters
+from django.utils import timezone
+
 from .models import Product, Order, Restaurant
 
 
@@ -28,6 +32,29 @@ class OrderFilter(django_filters.FilterSet):
         fields = ['status', 'restaurant', 'customer', 'courier', 'total_price']
 
 
+def start_of_day(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class OrderPageFilter(django_filters.FilterSet):
+    """
+    Фильтр HTML-страницы заказов. Даты переводятся в границы created_at,
+    а не в created_at__date, чтобы условие шло по индексу.
+    """
+    date_from = django_filters.DateFilter(method='filter_date_from', label='С даты')
+    date_to = django_filters.DateFilter(method='filter_date_to', label='По дату')
+
+    class Meta:
+        model = Order
+        fields = ['status', 'restaurant']
+
+    def filter_date_from(self, queryset, name, value):
+        return queryset.filter(created_at__gte=start_of_day(value))
+
+    def filter_date_to(self, queryset, name, value):
+        return queryset.filter(created_at__lt=start_of_day(value + timedelta(days=1)))
+
+
 class RestaurantFilter(django_filters.FilterSet):
     """Фильтр для ресторанов с использованием django_filters"""
     owner_username = django_filters.CharFilter(field_name='owner__username', lookup_expr='icontains')
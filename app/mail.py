@@ -0,0 +1,240 @@
+"""
+Доставка писем из задач Celery.
+
+send_mail открывает и закрывает SMTP-соединение на каждое письмо. Здесь
+письма копятся в буфере процесса-воркера (MailOutbox) и уходят пачками
+по постоянному соединению get_connection(), которое переиспользуется
+между пачками и задачами и переоткрывается после ошибки.
+
+- Пачка отправляется, когда в буфере MAIL_BATCH_SIZE писем, через
+  MAIL_FLUSH_INTERVAL секунд после первого письма (0 — сразу, как в
+  тестах) и при остановке процесса воркера.
+- При временной ошибке (разрыв соединения, ответы 4xx, сетевые ошибки)
+  соединение сразу переоткрывается один раз: постоянное соединение могло
+  быть закрыто сервером за время простоя. Если и это не помогло, письмо и
+  остаток буфера не теряются и не ждут в потоке воркера, а уходят в
+  задачу resend_emails (очередь Celery), которая повторяет отправку с
+  экспоненциальной задержкой до MAIL_MAX_RETRIES раз и после этого
+  завершается ошибкой. Постоянные ошибки (5xx) пишутся в лог без повторов.
+- Счетчики хранятся в общем кеше (Redis; с кешем в памяти процесса воркер
+  не запустится, см. checks.py) и суммируются по всем воркерам; админка читает
+  их через get_mail_metrics вместе с пропускной способностью.
+"""
+import atexit
+import logging
+import smtplib
+import threading
+import time
+from typing import Iterable, Optional
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('sent', 'failed', 'retries', 'batches', 'connections', 'send_ms')
+
+
+def metrics_key(name: str) -> str:
+    return f'mail:metrics:{name}'
+
+
+def record_metrics(**deltas: int) -> None:
+    """Атомарно увеличивает счетчики доставки (incr в кеше, общем для воркеров)"""
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        key = metrics_key(name)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, delta)
+        except ValueError:  # ключ вытеснен между add и incr
+            cache.set(key, delta, None)
+
+
+def get_mail_metrics() -> dict:
+    """Счетчики доставки и пропускная способность (писем в секунду отправки)"""
+    values = cache.get_many([metrics_key(name) for name in METRICS])
+    metrics = {name: values.get(metrics_key(name), 0) for name in METRICS}
+    metrics['throughput'] = round(metrics['sent'] / (metrics['send_ms'] / 1000), 2) if metrics['send_ms'] else 0
+    metrics['per_connection'] = round(metrics['sent'] / metrics['connections'], 2) if metrics['connections'] else 0
+    return metrics
+
+
+class MailDeliveryError(Exception):
+    """Временная ошибка доставки: messages не отправлены и могут быть повторены"""
+
+    def __init__(self, messages: list[EmailMessage], error, sent: int = 0) -> None:
+        super().__init__(f'Не отправлено писем: {len(messages)} ({error})')
+        self.messages = messages
+        self.error = str(error)
+        self.sent = sent
+
+    def __reduce__(self):
+        # Результат упавшей задачи сериализуется Celery
+        return self.__class__, (self.messages, self.error, self.sent)
+
+
+def dump_messages(messages: Iterable[EmailMessage]) -> list[list]:
+    """Письма -> аргументы задачи Celery (JSON)"""
+    return [[message.subject, message.body, message.from_email, message.to] for message in messages]
+
+
+def load_messages(data: list[list]) -> list[EmailMessage]:
+    return [EmailMessage(subject, body, from_email, to) for subject, body, from_email, to in data]
+
+
+def retry_later(messages: list[EmailMessage], error: Exception) -> None:
+    """Передает неотправленные письма задаче resend_emails с задержкой"""
+    from .tasks import resend_emails
+
+    logger.warning('Почтовый сервер недоступен (%s), %d писем будут отправлены повторно', error, len(messages))
+    record_metrics(retries=1)
+    resend_emails.apply_async(args=[dump_messages(messages)], countdown=settings.MAIL_RETRY_BACKOFF)
+
+
+def is_transient(error: Exception) -> bool:
+    """Можно ли повторить отправку: 4xx, разрыв соединения, сетевая ошибка"""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        # SMTPException наследует OSError, но остальные ошибки протокола
+        # (SMTPNotSupportedError и т.п.) повтором не исправить
+        return False
+    return isinstance(error, OSError)  # отказ в соединении, таймаут, сброс сокета
+
+
+class MailOutbox:
+    """Буфер писем процесса и постоянное соединение с почтовым сервером"""
+
+    def __init__(self) -> None:
+        self._buffer: list[EmailMessage] = []
+        self._lock = threading.Lock()  # буфер и таймер
+        self._send_lock = threading.Lock()  # соединение: одна отправка за раз
+        self._connection = None
+        self._timer: Optional[threading.Timer] = None
+
+    def add(self, messages: Iterable[EmailMessage]) -> None:
+        with self._lock:
+            self._buffer.extend(messages)
+            flush_now = settings.MAIL_FLUSH_INTERVAL <= 0 or len(self._buffer) >= settings.MAIL_BATCH_SIZE
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(settings.MAIL_FLUSH_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Отправляет все письма из буфера пачками; возвращает число отправленных.
+        Письма, не отправленные из-за временной ошибки, уходят в resend_emails.
+        """
+        with self._send_lock:
+            with self._lock:
+                messages, self._buffer = self._buffer, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            try:
+                return self._send(messages)
+            except MailDeliveryError as exc:
+                retry_later(exc.messages, exc)
+                return exc.sent
+
+    def send(self, messages: list[EmailMessage]) -> int:
+        """Отправляет письма сразу, минуя буфер; временная ошибка — MailDeliveryError"""
+        with self._send_lock:
+            return self._send(messages)
+
+    def close(self) -> None:
+        """Досылает буфер и закрывает соединение (остановка воркера)"""
+        self.flush()
+        with self._send_lock:
+            self._disconnect()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = get_connection()
+        if self._connection.open():  # True — открыто новое соединение, False — уже открыто
+            record_metrics(connections=1)
+        return self._connection
+
+    def _disconnect(self) -> None:
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:  # соединение уже разорвано сервером
+                pass
+
+    def _send(self, messages: list[EmailMessage]) -> int:
+        sent = 0
+        batch_size = settings.MAIL_BATCH_SIZE
+        for start in range(0, len(messages), batch_size):
+            try:
+                sent += self._send_batch(messages[start:start + batch_size])
+            except MailDeliveryError as exc:
+                exc.messages.extend(messages[start + batch_size:])
+                exc.sent += sent
+                raise
+        return sent
+
+    def _send_one(self, message: EmailMessage) -> int:
+        try:
+            return self._connect().send_messages([message]) or 0
+        except Exception as exc:
+            if not is_transient(exc):
+                raise
+        # Сервер мог закрыть простаивавшее соединение — одна попытка сразу по новому,
+        # дальнейшие повторы с задержкой идут через очередь Celery, а не sleep в воркере
+        self._disconnect()
+        record_metrics(retries=1)
+        return self._connect().send_messages([message]) or 0
+
+    def _send_batch(self, messages: list[EmailMessage]) -> int:
+        started = time.monotonic()
+        sent = failed = 0
+        try:
+            for index, message in enumerate(messages):
+                # Письма пачки идут по одному по общему соединению: при ошибке
+                # повторяется только текущее письмо, уже принятые не дублируются
+                try:
+                    sent += self._send_one(message)
+                except Exception as exc:
+                    if is_transient(exc):
+                        self._disconnect()
+                        raise MailDeliveryError(messages[index:], exc, sent) from exc
+                    failed += 1
+                    logger.error('Письмо %r не отправлено: %s', message.subject, exc)
+        finally:
+            record_metrics(
+                sent=sent, failed=failed, batches=1,
+                send_ms=round((time.monotonic() - started) * 1000),
+            )
+        return sent
+
+
+outbox = MailOutbox()
+atexit.register(outbox.close)
+
+
+@worker_process_shutdown.connect
+def flush_outbox_on_shutdown(**kwargs) -> None:
+    # Дочерние процессы prefork завершаются через os._exit, atexit в них не вызывается
+    outbox.close()
+
+
+def deliver(messages: Iterable[EmailMessage]) -> None:
+    """Передает письма в буфер доставки процесса"""
+    outbox.add(messages)
+
+
+def send_email(subject: str, body: str, recipients: list[str]) -> None:
+    """Замена send_mail для задач: письмо уходит пачкой по общему соединению"""
+    deliver([EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, recipients)])
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from app.stats import rebuild_restaurant_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает материализованную статистику ресторанов (RestaurantStats)'
+
+    def handle(self, *args, **options):
+        count = rebuild_restaurant_stats()
+        self.stdout.write(
+            self.style.SUCCESS(f'Статистика пересчитана для {count} ресторанов')
+        )
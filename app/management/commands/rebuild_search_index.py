@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from app.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс продуктов (SEARCH_BACKEND)'
+
+    def handle(self, *args, **options):
+        count = get_search_backend().rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Проиндексировано продуктов: {count}')
+        )
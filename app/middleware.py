@@ -0,0 +1,37 @@
+"""
+Ограничение времени SQL-запросов для HTTP-запросов (PostgreSQL).
+
+statement_timeout нельзя задать в OPTIONS соединения: он действовал бы и на
+migrate, management-команды rebuild_* и задачи Celery (выгрузки, сверки),
+которым на больших таблицах нужно больше времени. Middleware включает
+таймаут на время обработки запроса и сбрасывает его перед возвратом
+соединения (в том числе в пул).
+"""
+from typing import Callable
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection
+from django.http import HttpRequest, HttpResponse
+
+
+class StatementTimeoutMiddleware:
+    """SET statement_timeout на время запроса; отключается при DB_STATEMENT_TIMEOUT_MS=0 и не на PostgreSQL"""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        if connection.vendor != 'postgresql' or not settings.DB_STATEMENT_TIMEOUT_MS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with connection.cursor() as cursor:
+            cursor.execute('SET statement_timeout = %s', [settings.DB_STATEMENT_TIMEOUT_MS])
+        try:
+            return self.get_response(request)
+        finally:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('RESET statement_timeout')
+            except DatabaseError:
+                # Соединение в прерванной транзакции или разорвано — Django закроет его как непригодное
+                connection.close_if_unusable_or_obsolete()
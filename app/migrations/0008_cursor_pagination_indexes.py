@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0007_cartitem"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["-created_at", "id"], name="order_created_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["name", "id"], name="product_name_id_idx"),
+        ),
+    ]
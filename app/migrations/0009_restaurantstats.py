@@ -0,0 +1,89 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_restaurant_stats(apps, schema_editor):
+    """Заполняет статистику для уже существующих ресторанов"""
+    Restaurant = apps.get_model("app", "Restaurant")
+    Product = apps.get_model("app", "Product")
+    Order = apps.get_model("app", "Order")
+    RestaurantStats = apps.get_model("app", "RestaurantStats")
+
+    product_stats = {
+        row["restaurant"]: row
+        for row in Product.objects.order_by()
+        .values("restaurant")
+        .annotate(count=Count("id"), price_sum=Sum("price"))
+    }
+    order_counts = dict(
+        Order.objects.order_by()
+        .values("restaurant")
+        .annotate(count=Count("id"))
+        .values_list("restaurant", "count")
+    )
+    RestaurantStats.objects.bulk_create(
+        [
+            RestaurantStats(
+                restaurant_id=restaurant_id,
+                product_count=product_stats.get(restaurant_id, {}).get("count", 0),
+                product_price_sum=product_stats.get(restaurant_id, {}).get("price_sum") or 0,
+                order_count=order_counts.get(restaurant_id, 0),
+            )
+            for restaurant_id in Restaurant.objects.values_list("id", flat=True)
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0008_cursor_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RestaurantStats",
+            fields=[
+                (
+                    "restaurant",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="app.restaurant",
+                        verbose_name="Ресторан",
+                    ),
+                ),
+                (
+                    "product_count",
+                    models.IntegerField(default=0, verbose_name="Количество продуктов"),
+                ),
+                (
+                    "product_price_sum",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=0,
+                        max_digits=14,
+                        verbose_name="Сумма цен продуктов",
+                    ),
+                ),
+                (
+                    "order_count",
+                    models.IntegerField(default=0, verbose_name="Количество заказов"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+            ],
+            options={
+                "verbose_name": "Статистика ресторана",
+                "verbose_name_plural": "Статистика ресторанов",
+            },
+        ),
+        migrations.RunPython(populate_restaurant_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_order_daily_stats(apps, schema_editor):
+    """Заполняет дневные агрегаты по уже существующим заказам"""
+    Order = apps.get_model("app", "Order")
+    OrderDailyStats = apps.get_model("app", "OrderDailyStats")
+    rows = (
+        Order.objects.annotate(day=TruncDate("created_at"))
+        .order_by()
+        .values("day", "restaurant", "status")
+        .annotate(count=Count("id"), revenue=Sum("total_price"))
+    )
+    OrderDailyStats.objects.bulk_create(
+        [
+            OrderDailyStats(
+                date=row["day"],
+                restaurant_id=row["restaurant"],
+                status=row["status"],
+                order_count=row["count"],
+                revenue=row["revenue"] or 0,
+            )
+            for row in rows
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0009_restaurantstats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="Дата")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Ожидает"),
+                            ("preparing", "Готовится"),
+                            ("ready", "Готов"),
+                            ("delivering", "Доставляется"),
+                            ("completed", "Завершен"),
+                            ("cancelled", "Отменен"),
+                        ],
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "order_count",
+                    models.IntegerField(default=0, verbose_name="Количество заказов"),
+                ),
+                (
+                    "revenue",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=0,
+                        max_digits=14,
+                        verbose_name="Выручка",
+                    ),
+                ),
+                (
+                    "restaurant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="app.restaurant",
+                        verbose_name="Ресторан",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Статистика заказов за день",
+                "verbose_name_plural": "Статистика заказов по дням",
+                "ordering": ["-date"],
+                "indexes": [
+                    models.Index(
+                        fields=["restaurant", "date"],
+                        name="orderdailystats_rest_date_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date", "restaurant", "status"),
+                        name="orderdailystats_bucket_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_order_daily_stats, migrations.RunPython.noop),
+    ]
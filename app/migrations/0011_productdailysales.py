@@ -0,0 +1,95 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:27
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def populate_product_daily_sales(apps, schema_editor):
+    """Заполняет дневные продажи продуктов за последние 30 дней (самое длинное окно рейтинга)"""
+    OrderItem = apps.get_model("app", "OrderItem")
+    ProductDailySales = apps.get_model("app", "ProductDailySales")
+    date_from = timezone.localdate() - timedelta(days=29)
+    rows = (
+        OrderItem.objects.exclude(order__status="cancelled")
+        .annotate(day=TruncDate("order__created_at"))
+        .filter(day__gte=date_from)
+        .order_by()
+        .values("day", "product", "product__restaurant")
+        .annotate(quantity=Sum("quantity"))
+    )
+    ProductDailySales.objects.bulk_create(
+        [
+            ProductDailySales(
+                date=row["day"],
+                product_id=row["product"],
+                restaurant_id=row["product__restaurant"],
+                quantity=row["quantity"],
+            )
+            for row in rows
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0010_orderdailystats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductDailySales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="Дата")),
+                (
+                    "quantity",
+                    models.IntegerField(default=0, verbose_name="Продано, шт."),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="app.product",
+                        verbose_name="Продукт",
+                    ),
+                ),
+                (
+                    "restaurant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="app.restaurant",
+                        verbose_name="Ресторан",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Продажи продукта за день",
+                "verbose_name_plural": "Продажи продуктов по дням",
+                "indexes": [
+                    models.Index(
+                        fields=["restaurant", "date"], name="productsales_rest_date_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date", "product"), name="productdailysales_bucket_uniq"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_product_daily_sales, migrations.RunPython.noop),
+    ]
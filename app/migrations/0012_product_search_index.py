@@ -0,0 +1,79 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:46
+
+import re
+
+from django.db import migrations
+
+# Копия анализатора app.search на момент миграции: индекс, построенный при
+# повторном применении, не должен зависеть от будущих изменений app.search
+RUSSIAN_ENDINGS = sorted({
+    "иями", "ями", "ами", "иях", "ией", "ого", "его", "ому", "ему", "ими", "ыми",
+    "ях", "ах", "ой", "ей", "ий", "ый", "ое", "ее", "ие", "ые", "ая", "яя", "ую", "юю",
+    "ом", "ем", "ам", "ям", "ов", "ев", "ию", "ью", "ия", "ья",
+    "а", "я", "о", "е", "и", "ы", "у", "ю", "ь", "й",
+}, key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+WORD_RE = re.compile(r"\w+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+
+def stem(word):
+    if CYRILLIC_RE.search(word):
+        for ending in RUSSIAN_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+                return word[:-len(ending)]
+    return word
+
+
+def analyze(text):
+    return [stem(word) for word in WORD_RE.findall((text or "").lower().replace("ё", "е"))]
+
+
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('russian', name), 'A') || "
+    "setweight(to_tsvector('russian', description), 'B')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5-таблица на SQLite, GIN-индекс по tsvector на PostgreSQL"""
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        Product = apps.get_model("app", "Product")
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS app_product_fts "
+            "USING fts5(name, description, tokenize='unicode61')"
+        )
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO app_product_fts (rowid, name, description) VALUES (%s, %s, %s)",
+                [
+                    (product_id, " ".join(analyze(name)), " ".join(analyze(description)))
+                    for product_id, name, description in Product.objects.values_list(
+                        "id", "name", "description"
+                    )
+                ],
+            )
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS product_search_idx ON app_product USING gin (({POSTGRES_DOCUMENT}))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS app_product_fts")
+    elif vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS product_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0011_productdailysales"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:52
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# Анализатор, которым 0012 заполнил FTS-таблицу (копия на момент миграции)
+analyze = import_module("app.migrations.0012_product_search_index").analyze
+
+
+def unique_name(name, product_id, taken, max_length):
+    """Название с суффиксом id, не совпадающее ни с одним из taken"""
+    attempt = 1
+    while True:
+        suffix = f" ({product_id})" if attempt == 1 else f" ({product_id}-{attempt})"
+        candidate = name[:max_length - len(suffix)] + suffix
+        if candidate not in taken:
+            return candidate
+        attempt += 1
+
+
+def rename_duplicate_products(apps, schema_editor):
+    """
+    До уникального ограничения форма и админка допускали одинаковые названия
+    в ресторане. Первый по id продукт сохраняет название, остальные получают
+    суффикс с id — позиции заказов и корзины продолжают ссылаться на них.
+    Новое название проверяется на совпадение с уже существующими в ресторане.
+
+    Индекс PostgreSQL построен по выражению и обновляется сам; в FTS-таблице
+    SQLite строки переименованных продуктов переписываются здесь. Индекс в
+    памяти процесса строится при первом поиске после запуска.
+    """
+    Product = apps.get_model("app", "Product")
+    duplicates = (
+        Product.objects.values("restaurant_id", "name")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    max_length = Product._meta.get_field("name").max_length
+    renamed = []
+    for row in duplicates:
+        taken = set(Product.objects.filter(restaurant_id=row["restaurant_id"]).values_list("name", flat=True))
+        products = Product.objects.filter(restaurant_id=row["restaurant_id"], name=row["name"]).order_by("id")
+        for product in products[1:]:
+            product.name = unique_name(product.name, product.id, taken, max_length)
+            taken.add(product.name)
+            product.save(update_fields=["name"])
+            renamed.append(product)
+
+    if renamed and schema_editor.connection.vendor == "sqlite":
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                "UPDATE app_product_fts SET name = %s WHERE rowid = %s",
+                [(" ".join(analyze(product.name)), product.id) for product in renamed],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0012_product_search_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_products, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="product",
+            name="product_restaurant_name_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="product",
+            constraint=models.UniqueConstraint(
+                fields=("restaurant", "name"), name="product_restaurant_name_uniq"
+            ),
+        ),
+    ]
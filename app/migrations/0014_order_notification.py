@@ -0,0 +1,52 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0013_product_restaurant_name_unique"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderNotification",
+            fields=[
+                (
+                    "order",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="notification",
+                        serialize=False,
+                        to="app.order",
+                        verbose_name="Заказ",
+                    ),
+                ),
+                (
+                    "scheduled_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Задача поставлена"
+                    ),
+                ),
+                (
+                    "claim",
+                    models.UUIDField(
+                        blank=True, null=True, verbose_name="Метка постановки"
+                    ),
+                ),
+                (
+                    "sent_status",
+                    models.CharField(
+                        blank=True, max_length=20, verbose_name="Отправленный статус"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Уведомление о статусе заказа",
+                "verbose_name_plural": "Уведомления о статусах заказов",
+            },
+        ),
+    ]
@@ -41,14 +41,23 @@ class Product(models.Model):
         verbose_name = "Продукт"
         verbose_name_plural = "Продукты"
         ordering = ['name']
+        constraints = [
+            # Уникальный индекс (restaurant, name) — цель upsert в bulk_upsert (см. app/product_import.py)
+            models.UniqueConstraint(fields=['restaurant', 'name'], name='product_restaurant_name_uniq'),
+        ]
         indexes = [
-            models.Index(fields=['restaurant', 'name'], name='product_restaurant_name_idx'),
             models.Index(fields=['price'], name='product_price_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),  # курсорная пагинация
         ]
 
     def __str__(self):
         return f"{self.name} - {self.restaurant.name}"
 
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        from .signals import refresh_stats_state
+        refresh_stats_state(self, fields)
+
 
 class Courier(models.Model):
     """Модель курьера"""
@@ -78,6 +87,15 @@ class Order(models.Model):
         ('completed', 'Завершен'),
         ('cancelled', 'Отменен'),
     ]
+    # Допустимые переходы статусов; применяются через app/order_status.py
+    STATUS_TRANSITIONS = {
+        'pending': ('preparing', 'cancelled'),
+        'preparing': ('ready', 'cancelled'),
+        'ready': ('delivering', 'completed', 'cancelled'),
+        'delivering': ('completed', 'cancelled'),
+        'completed': (),
+        'cancelled': (),
+    }
 
     customer = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Клиент")
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, verbose_name="Ресторан")
@@ -97,11 +115,22 @@ class Order(models.Model):
             models.Index(fields=['status'], name='order_status_idx'),
             models.Index(fields=['customer', 'created_at'], name='order_customer_created_idx'),
             models.Index(fields=['restaurant', 'status'], name='order_restaurant_status_idx'),
+            models.Index(fields=['-created_at', 'id'], name='order_created_id_idx'),  # курсорная пагинация
         ]
 
     def __str__(self):
         return f"Заказ #{self.id} - {self.customer.username}"
 
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        from .signals import refresh_stats_state
+        refresh_stats_state(self, fields)
+
+    @classmethod
+    def can_transition(cls, old_status: str, new_status: str) -> bool:
+        """Разрешен ли переход old_status -> new_status"""
+        return new_status in cls.STATUS_TRANSITIONS.get(old_status, ())
+
 
 class OrderItem(models.Model):
     """Модель элемента заказа"""
@@ -121,3 +150,110 @@ class OrderItem(models.Model):
     def get_total(self):
         """Возвращает общую стоимость элемента заказа"""
         return self.price * self.quantity
+
+
+class CartItem(models.Model):
+    """Модель строки корзины (серверное хранилище корзины)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items', verbose_name="Пользователь")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Продукт")
+    quantity = models.PositiveIntegerField(default=1, verbose_name="Количество")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Строка корзины"
+        verbose_name_plural = "Строки корзины"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='cartitem_user_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} x{self.quantity} у {self.user_id}"
+
+
+class RestaurantStats(models.Model):
+    """Сводная статистика ресторана, поддерживается инкрементально (см. app/stats.py)"""
+    restaurant = models.OneToOneField(
+        Restaurant, on_delete=models.CASCADE, primary_key=True, related_name='stats', verbose_name="Ресторан"
+    )
+    product_count = models.IntegerField(default=0, verbose_name="Количество продуктов")
+    product_price_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Сумма цен продуктов")
+    order_count = models.IntegerField(default=0, verbose_name="Количество заказов")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Статистика ресторана"
+        verbose_name_plural = "Статистика ресторанов"
+
+    def __str__(self):
+        return f"Статистика: {self.restaurant_id}"
+
+    @property
+    def avg_product_price(self):
+        """Средняя цена продукта"""
+        if not self.product_count:
+            return 0
+        return round(self.product_price_sum / self.product_count, 2)
+
+
+class OrderDailyStats(models.Model):
+    """Агрегат заказов за день по ресторану и статусу, поддерживается инкрементально"""
+    date = models.DateField(verbose_name="Дата")
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, verbose_name="Ресторан")
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name="Статус")
+    order_count = models.IntegerField(default=0, verbose_name="Количество заказов")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Выручка")
+
+    class Meta:
+        verbose_name = "Статистика заказов за день"
+        verbose_name_plural = "Статистика заказов по дням"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'restaurant', 'status'], name='orderdailystats_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['restaurant', 'date'], name='orderdailystats_rest_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.restaurant_id} {self.status}: {self.order_count}"
+
+
+class ProductDailySales(models.Model):
+    """Продажи продукта за день (для рейтинга популярности), поддерживается инкрементально"""
+    date = models.DateField(verbose_name="Дата")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Продукт")
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, verbose_name="Ресторан")
+    quantity = models.IntegerField(default=0, verbose_name="Продано, шт.")
+
+    class Meta:
+        verbose_name = "Продажи продукта за день"
+        verbose_name_plural = "Продажи продуктов по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='productdailysales_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['restaurant', 'date'], name='productsales_rest_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.product_id}: {self.quantity}"
+
+
+class OrderNotification(models.Model):
+    """
+    Состояние отложенного уведомления о статусе заказа (см. app/order_notifications.py).
+    Хранится в БД, а не в кеше: метку ставит веб-процесс, снимает воркер Celery.
+    """
+    order = models.OneToOneField(
+        Order, on_delete=models.CASCADE, primary_key=True, related_name='notification', verbose_name="Заказ"
+    )
+    scheduled_at = models.DateTimeField(null=True, blank=True, verbose_name="Задача поставлена")
+    claim = models.UUIDField(null=True, blank=True, verbose_name="Метка постановки")
+    sent_status = models.CharField(max_length=20, blank=True, verbose_name="Отправленный статус")
+
+    class Meta:
+        verbose_name = "Уведомление о статусе заказа"
+        verbose_name_plural = "Уведомления о статусах заказов"
+
+    def __str__(self):
+        return f"Заказ #{self.order_id}: {self.sent_status or '—'}"
@@ -0,0 +1,288 @@
+"""
+Поток изменений статусов заказов (SSE и WebSocket через ASGI).
+
+Экран заказа держит одно соединение и получает легкое событие
+{type, order_id, status, ...} при каждой смене статуса вместо опроса
+/api/orders/ с полной сериализацией заказов.
+
+- OrderEventBroker — pub/sub в памяти процесса: подписки (asyncio.Queue)
+  по ключам order:<id> и user:<id>. dispatch потокобезопасен
+  (call_soon_threadsafe), поэтому публиковать можно из синхронного кода.
+- Доставка между процессами выбирается настройкой ORDER_EVENTS_BACKEND:
+  InProcessEventBackend — только текущий процесс (один ASGI-воркер, тесты);
+  RedisEventBackend — канал Redis и поток-слушатель в каждом процессе,
+  так что события доходят из всех воркеров и задач Celery.
+
+Статусы публикуются после коммита транзакции (publish_order_status):
+оформление заказа и смены статуса в order_status.py.
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import suppress
+from functools import lru_cache
+from typing import AsyncIterator, Iterable, Optional
+
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+from django.http.request import split_domain_port, validate_host
+from django.utils.module_loading import import_string
+
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+STATUS_DISPLAY = dict(Order.STATUS_CHOICES)
+FINAL_STATUSES = ('completed', 'cancelled')
+QUEUE_SIZE = 100
+WEBSOCKET_PATH_RE = re.compile(r'/ws/orders/(?:(?P<order_id>\d+)/)?')
+
+
+def order_event(order: Order) -> dict:
+    return {
+        'type': 'status',
+        'order_id': order.id,
+        'customer_id': order.customer_id,
+        'status': order.status,
+        'status_display': STATUS_DISPLAY.get(order.status, order.status),
+        'updated_at': order.updated_at.isoformat() if order.updated_at else None,
+    }
+
+
+def event_keys(event: dict) -> tuple[str, str]:
+    return f'order:{event["order_id"]}', f'user:{event["customer_id"]}'
+
+
+class Subscription:
+    """Очередь событий одного соединения; создается внутри цикла событий подписчика"""
+
+    def __init__(self, keys: Iterable[str]) -> None:
+        self.keys = tuple(keys)
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def deliver(self, event: dict) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()  # медленный клиент: самое старое событие уже неактуально
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Следующее событие или None, если за timeout секунд событий не было"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class OrderEventBroker:
+    """Подписки текущего процесса по ключам order:<id> / user:<id>"""
+
+    def __init__(self) -> None:
+        self._subscriptions: dict[str, set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, keys: Iterable[str]) -> Subscription:
+        subscription = Subscription(keys)
+        with self._lock:
+            for key in subscription.keys:
+                self._subscriptions.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for key in subscription.keys:
+                subscriptions = self._subscriptions.get(key, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(key, None)
+
+    def dispatch(self, event: dict) -> int:
+        """Передает событие подписчикам (из любого потока); возвращает число получателей"""
+        with self._lock:
+            targets = set().union(*(self._subscriptions.get(key, ()) for key in event_keys(event)))
+        for subscription in targets:
+            with suppress(RuntimeError):  # цикл событий уже закрыт
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+        return len(targets)
+
+
+broker = OrderEventBroker()
+
+
+class InProcessEventBackend:
+    """События доходят только до подписчиков текущего процесса"""
+
+    def publish(self, events: list[dict]) -> None:
+        for event in events:
+            broker.dispatch(event)
+
+    def start(self) -> None:
+        pass
+
+
+class RedisEventBackend:
+    """Публикация в канал Redis; поток-слушатель раздает события подписчикам процесса"""
+    channel = 'order-events'
+
+    def __init__(self) -> None:
+        import redis
+        self.client = redis.Redis.from_url(settings.ORDER_EVENTS_REDIS_URL)
+        self._listener: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def publish(self, events: list[dict]) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        for event in events:
+            pipeline.publish(self.channel, json.dumps(event))
+        pipeline.execute()
+
+    def start(self) -> None:
+        """Запускает слушателя при первой подписке в процессе"""
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='order-events', daemon=True)
+                self._listener.start()
+
+    def _listen(self) -> None:
+        import redis
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    broker.dispatch(json.loads(message['data']))
+            except redis.ConnectionError:
+                logger.warning('Потеряно соединение с Redis для событий заказов, переподключение')
+                time.sleep(1)
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path: str):
+    return import_string(path)()
+
+
+def get_event_backend():
+    """Текущий бэкенд событий по настройке ORDER_EVENTS_BACKEND"""
+    return _load_backend(settings.ORDER_EVENTS_BACKEND)
+
+
+def publish_order_status(orders: Iterable[Order]) -> None:
+    """Публикует текущие статусы заказов после коммита транзакции"""
+    events = [order_event(order) for order in orders]
+    if events:
+        transaction.on_commit(lambda: get_event_backend().publish(events))
+
+
+# ========================================
+# Потоки для клиентов
+# ========================================
+
+def stream_target(user, order_id: Optional[int] = None) -> tuple[str, QuerySet]:
+    """Ключ подписки и заказы с текущим статусом: один заказ или активные заказы пользователя"""
+    orders = Order.objects.all()
+    if not (user.is_superuser or user.is_staff):
+        orders = orders.filter(customer=user)
+    if order_id is not None:
+        return f'order:{order_id}', orders.filter(id=order_id)
+    return f'user:{user.id}', orders.filter(customer=user).exclude(status__in=FINAL_STATUSES)[:50]
+
+
+async def event_stream(key: str, orders: QuerySet) -> AsyncIterator[Optional[dict]]:
+    """
+    Текущие статусы заказов, затем новые события; None — пора отправить heartbeat.
+    Подписка оформляется до чтения статусов, чтобы не потерять смену между ними.
+    """
+    get_event_backend().start()
+    subscription = broker.subscribe([key])
+    try:
+        async for order in orders:
+            yield order_event(order)
+        while True:
+            yield await subscription.get(settings.ORDER_EVENTS_HEARTBEAT)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def sse_stream(key: str, orders: QuerySet) -> AsyncIterator[str]:
+    """Server-Sent Events: event: status / data: JSON; комментарий-пинг держит соединение открытым"""
+    async for event in event_stream(key, orders):
+        if event is None:
+            yield ': ping\n\n'
+        else:
+            yield f'event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'
+
+
+async def websocket_user(scope: dict):
+    """Пользователь WebSocket-соединения по сессионной cookie"""
+    from importlib import import_module
+
+    headers = dict(scope.get('headers', []))
+    cookies = parse_cookie(headers.get(b'cookie', b'').decode('latin-1'))
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+        cookies.get(settings.SESSION_COOKIE_NAME)
+    )
+    return await aget_user(request)
+
+
+def is_allowed_origin(scope: dict) -> bool:
+    """Защита от cross-site WebSocket: Origin (если передан) должен быть из ALLOWED_HOSTS"""
+    origin = dict(scope.get('headers', [])).get(b'origin')
+    if not origin:
+        return True
+    host = origin.decode('latin-1').split('://', 1)[-1]
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+
+async def websocket_application(scope: dict, receive, send) -> None:
+    """
+    ASGI-приложение для /ws/orders/ (активные заказы пользователя) и
+    /ws/orders/<id>/ (один заказ). Сообщения — те же JSON-события, что и в SSE,
+    heartbeat — {"type": "ping"}. Входящие сообщения клиента игнорируются.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    match = WEBSOCKET_PATH_RE.fullmatch(scope['path'])
+    user = await websocket_user(scope)
+    if match is None or not user.is_authenticated or not is_allowed_origin(scope):
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+    order_id = match['order_id']
+    key, orders = stream_target(user, int(order_id) if order_id else None)
+    if order_id and not await orders.aexists():
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await send({'type': 'websocket.accept'})
+
+    events = event_stream(key, orders)
+    next_event: Optional[asyncio.Future] = None
+    incoming = asyncio.ensure_future(receive())
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(anext(events))
+            done, _ = await asyncio.wait({next_event, incoming}, return_when=asyncio.FIRST_COMPLETED)
+            if incoming in done:
+                if incoming.result()['type'] == 'websocket.disconnect':
+                    break
+                incoming = asyncio.ensure_future(receive())
+            if next_event in done:
+                event = next_event.result() or {'type': 'ping'}
+                next_event = None
+                await send({'type': 'websocket.send', 'text': json.dumps(event, ensure_ascii=False)})
+    finally:
+        for task in (next_event, incoming):
+            if task is not None and not task.done():
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        await events.aclose()
@@ -0,0 +1,74 @@
+"""
+Уведомления о смене статуса заказа с объединением (debounce) по заказу.
+
+Заказ за несколько минут проходит pending → preparing → ready → delivering,
+и раньше на каждый переход уходила своя задача с запросом к БД и письмом.
+Теперь первая смена статуса ставит отложенную на ORDER_NOTIFY_WINDOW
+секунд задачу flush_order_status_notifications и метку scheduled_at в
+OrderNotification; следующие смены в пределах окна видят метку и новых
+задач не ставят. Задача снимает метки, читает текущие статусы и шлет по
+одному письму на заказ — только о последнем статусе.
+
+Метки хранятся в БД, а не в кеше: ставит их веб-процесс, а снимает
+воркер Celery, и кеш в памяти процесса они бы не разделяли. Если метка
+снята до чтения статусов, параллельная смена поставит новую задачу;
+повторное письмо о том же статусе отсекается по sent_status.
+"""
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from typing import Iterable
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order, OrderNotification
+
+# Метка живет дольше окна: задача могла задержаться в очереди. Потерянная
+# задача (падение воркера) не блокирует уведомления дольше этого срока.
+PENDING_GRACE = 60 * 5
+
+
+def schedule_status_notifications(order_ids: Iterable[int]) -> None:
+    """Планирует уведомления о новых статусах заказов после коммита транзакции"""
+    order_ids = list(order_ids)
+    if order_ids:
+        transaction.on_commit(lambda: _schedule(order_ids))
+
+
+def _schedule(order_ids: list[int]) -> list[int]:
+    from .tasks import flush_order_status_notifications
+
+    window = settings.ORDER_NOTIFY_WINDOW
+    now = timezone.now()
+    OrderNotification.objects.bulk_create(
+        [OrderNotification(order_id=order_id) for order_id in order_ids], ignore_conflicts=True
+    )
+    # Условный UPDATE атомарен: из параллельных смен одного заказа метку ставит только первая.
+    # Своя метка claim позволяет узнать, какие заказы достались этому вызову.
+    claim = uuid.uuid4()
+    free = Q(scheduled_at__isnull=True) | Q(scheduled_at__lt=now - timedelta(seconds=window + PENDING_GRACE))
+    OrderNotification.objects.filter(free, order_id__in=order_ids).update(scheduled_at=now, claim=claim)
+    scheduled = list(OrderNotification.objects.filter(claim=claim).values_list('order_id', flat=True))
+    if scheduled:
+        flush_order_status_notifications.apply_async(args=[scheduled], countdown=window)
+    return scheduled
+
+
+def take_status_changes(order_ids: list[int]) -> list[tuple[int, str]]:
+    """
+    Снимает метки и возвращает пары (order_id, текущий статус) для заказов,
+    о статусе которых еще не уведомляли; отмечает эти статусы отправленными.
+    """
+    OrderNotification.objects.filter(order_id__in=order_ids).update(scheduled_at=None, claim=None)
+    rows = Order.objects.filter(id__in=order_ids).values_list('id', 'status', 'notification__sent_status')
+    changes = [(order_id, order_status) for order_id, order_status, sent in rows if sent != order_status]
+
+    by_status = defaultdict(list)
+    for order_id, order_status in changes:
+        by_status[order_status].append(order_id)
+    for order_status, ids in by_status.items():
+        OrderNotification.objects.filter(order_id__in=ids).update(sent_status=order_status)
+    return changes
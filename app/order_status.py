@@ -0,0 +1,151 @@
+"""
+Машина состояний заказа.
+
+Переход применяется условным UPDATE ... WHERE id = %s AND status = %s
+только по полям status и updated_at. Если статус успел измениться
+параллельно (кухня и курьер меняют один заказ), UPDATE не затронет
+строк и вызывающий получит TransitionConflict вместо потерянного
+обновления — без блокировок строк и без перезаписи остальных колонок.
+
+UPDATE не отправляет сигналов, поэтому дневные агрегаты заказов,
+рейтинг популярности и история заказа обновляются здесь явно, а новый
+статус публикуется подписчикам (order_events.py).
+
+change_orders_status переводит пачку заказов: по одному UPDATE на
+каждый исходный статус, агрегаты сдвигаются по корзинам, история
+пишется одним bulk_history_create.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Optional
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .models import Order
+from .order_events import publish_order_status
+from .signals import order_state
+from .stats import adjust_order_stats, record_order_sales, record_orders_sales
+
+MAX_BULK_ORDERS = 500
+
+
+class TransitionError(Exception):
+    """Переход из текущего статуса в запрошенный не разрешен"""
+
+
+class TransitionConflict(TransitionError):
+    """Статус заказа изменился параллельно, переход не применен"""
+
+    def __init__(self, message: str, current_status: Optional[str]) -> None:
+        super().__init__(message)
+        self.current_status = current_status
+
+
+def apply_status_side_effects(order: Order, old_status: str) -> None:
+    """Переносит заказ между корзинами агрегатов и учитывает отмену в рейтинге популярности"""
+    restaurant_id, new_status, total, day = order_state(order)
+    adjust_order_stats(day, restaurant_id, old_status, -1, -total)
+    adjust_order_stats(day, restaurant_id, new_status, 1, total)
+    if (old_status == 'cancelled') != (new_status == 'cancelled'):
+        record_order_sales(order, sign=-1 if new_status == 'cancelled' else 1)
+    order._stats_state = order_state(order)  # для сигналов при последующем save()
+
+
+@transaction.atomic
+def change_order_status(order: Order, new_status: str, user: Optional[User] = None,
+                        expected_status: Optional[str] = None) -> Order:
+    """
+    Переводит заказ в new_status (compare-and-set).
+
+    Args:
+        order: Заказ; его status — ожидаемый текущий статус
+        new_status: Новый статус
+        user: Автор изменения (для истории)
+        expected_status: Статус, который видел клиент (по умолчанию order.status)
+
+    Raises:
+        TransitionError: Переход не разрешен STATUS_TRANSITIONS
+        TransitionConflict: Статус в БД уже не равен ожидаемому
+    """
+    old_status = expected_status or order.status
+    if not Order.can_transition(old_status, new_status):
+        raise TransitionError(f'Переход {old_status} -> {new_status} не разрешен')
+
+    now = timezone.now()
+    updated = Order.objects.filter(id=order.id, status=old_status).update(status=new_status, updated_at=now)
+    if not updated:
+        current = Order.objects.filter(id=order.id).values_list('status', flat=True).first()
+        raise TransitionConflict(f'Статус заказа #{order.id} уже изменен: {current}', current)
+
+    order.status, order.updated_at = new_status, now
+    apply_status_side_effects(order, old_status)
+    Order.history.bulk_history_create([order], update=True, default_user=user)
+    publish_order_status([order])
+    return order
+
+
+@dataclass
+class BulkTransitionResult:
+    changed: list[Order] = field(default_factory=list)  # заказы уже в новом статусе
+    skipped: dict[int, Optional[str]] = field(default_factory=dict)  # id -> текущий статус
+
+
+@transaction.atomic
+def change_orders_status(queryset: QuerySet, new_status: str, user: Optional[User] = None) -> BulkTransitionResult:
+    """
+    Переводит заказы выборки в new_status. Заказы, для которых переход
+    не разрешен или статус изменился параллельно, пропускаются.
+
+    Args:
+        queryset: Выборка заказов
+        new_status: Новый статус
+        user: Автор изменения (для истории)
+    """
+    result = BulkTransitionResult()
+    by_status: dict[str, list[int]] = {}
+    for order_id, status in queryset.order_by().values_list('id', 'status'):
+        if Order.can_transition(status, new_status):
+            by_status.setdefault(status, []).append(order_id)
+        else:
+            result.skipped[order_id] = status
+
+    now = timezone.now()
+    old_statuses: dict[int, str] = {}
+    conflicts: set[int] = set()
+    for old_status, ids in by_status.items():
+        updated = Order.objects.filter(id__in=ids, status=old_status).update(status=new_status, updated_at=now)
+        if updated < len(ids):
+            # Часть заказов изменилась параллельно; наши — те, что получили именно этот updated_at
+            ours = set(Order.objects.filter(id__in=ids, status=new_status, updated_at=now).values_list('id', flat=True))
+            conflicts.update(set(ids) - ours)
+            ids = ours
+        old_statuses.update(dict.fromkeys(ids, old_status))
+    if conflicts:
+        result.skipped.update(Order.objects.filter(id__in=conflicts).values_list('id', 'status'))
+    if not old_statuses:
+        return result
+
+    result.changed = list(Order.objects.filter(id__in=old_statuses).order_by('id'))
+    # Сдвиг дневных агрегатов: одна корректировка на корзину (день, ресторан, статус)
+    deltas: dict[tuple, list] = {}
+    for order in result.changed:
+        day = timezone.localdate(order.created_at)
+        for status, sign in ((old_statuses[order.id], -1), (new_status, 1)):
+            delta = deltas.setdefault((day, order.restaurant_id, status), [0, Decimal('0')])
+            delta[0] += sign
+            delta[1] += sign * order.total_price
+    for (day, restaurant_id, status), (orders, revenue) in deltas.items():
+        adjust_order_stats(day, restaurant_id, status, orders, revenue)
+
+    flipped = [
+        order_id for order_id, old_status in old_statuses.items()
+        if (old_status == 'cancelled') != (new_status == 'cancelled')
+    ]
+    if flipped:
+        record_orders_sales(flipped, sign=-1 if new_status == 'cancelled' else 1)
+    Order.history.bulk_history_create(result.changed, update=True, default_user=user)
+    publish_order_status(result.changed)
+    return result
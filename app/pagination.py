@@ -0,0 +1,61 @@
+"""Пагинация API"""
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация: без COUNT(*) и без OFFSET-сканирования,
+    стоимость страницы не зависит от ее глубины.
+    Сортировка всегда фиксированная, чтобы запрос шел по индексу.
+    """
+    page_size = 10
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    """Лента заказов: новые сверху, индекс order_created_id_idx"""
+    ordering = ('-created_at', 'id')
+
+
+class OrderPageCursorPagination(OrderCursorPagination):
+    """HTML-страница заказов (views.orders)"""
+    page_size = 50
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    """Каталог продуктов по названию, индекс product_name_id_idx"""
+    ordering = ('name', 'id')
+
+
+class SelectablePaginationMixin:
+    """
+    Позволяет клиенту выбрать курсорную пагинацию параметром ?pagination=cursor.
+    По умолчанию остается постраничная пагинация из настроек DRF.
+    """
+    cursor_pagination_class = None
+    pagination_query_param = 'pagination'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            mode = self.request.query_params.get(self.pagination_query_param)
+            if mode == 'cursor' and self.cursor_pagination_class is not None:
+                self._paginator = self.cursor_pagination_class()
+        return super().paginator
+
+
+class ListActionMixin:
+    """
+    Для собственных @action-списков ViewSet'а: тот же путь, что у list —
+    фильтры, пагинация и сериализация поверх queryset'а из get_queryset().
+    """
+
+    def list_response(self, queryset) -> Response:
+        queryset = self.filter_queryset(queryset)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
@@ -0,0 +1,126 @@
+"""
+Массовое изменение цен продуктов.
+
+PriceChange описывает правило (процент, сумма, округление до шага) и
+строит по нему выражение БД. Одно и то же выражение используется для
+предпросмотра (annotate) и для применения (один UPDATE по выборке),
+поэтому предпросмотр совпадает с результатом до копейки.
+
+Цена не обрезается молча до границ: продукты, у которых новая цена
+выходит за MIN_PRICE..MAX_PRICE, пропускаются и перечисляются в
+предпросмотре и результате.
+
+UPDATE не создает записей simple_history и не отправляет сигналов:
+история пишется одним bulk_history_create, статистика ресторанов и
+версия каталога обновляются явно.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Optional
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, QuerySet, Sum, Value
+from django.db.models.functions import Round
+
+from .cache import bump_catalogue_version
+from .models import Product
+from .stats import rebuild_restaurant_stats
+
+PRICE_MODES = ('percent', 'absolute', 'round')
+# Границы цены — как в ProductSerializer.validate_price
+MIN_PRICE = Decimal('0.01')
+MAX_PRICE = Decimal('100000')
+PREVIEW_SIZE = 20
+# Новая цена (аннотация new_price) в допустимых границах
+IN_BOUNDS = Q(new_price__gte=MIN_PRICE, new_price__lte=MAX_PRICE)
+
+
+@dataclass(frozen=True)
+class PriceChange:
+    """
+    Правило изменения цены.
+
+    mode: 'percent' — на value процентов (-10 — скидка 10%), 'absolute' — на value рублей,
+          'round' — только округление
+    round_to: шаг округления результата (например, 10 или 0.5); None — до копеек
+    """
+    mode: str
+    value: Decimal = Decimal('0')
+    round_to: Optional[Decimal] = None
+
+    def expression(self) -> ExpressionWrapper:
+        price = F('price')
+        if self.mode == 'percent':
+            price = price * Value(1 + self.value / 100)
+        elif self.mode == 'absolute':
+            price = price + Value(self.value)
+        if self.round_to:
+            price = Round(price / Value(self.round_to)) * Value(self.round_to)
+        # DecimalField без ограничения разрядов: цена за границами должна прочитаться для отчета
+        return ExpressionWrapper(Round(price, 2), output_field=DecimalField(decimal_places=2))
+
+    def describe(self) -> str:
+        """Причина изменения для истории"""
+        text = {'percent': f'{self.value:+}%', 'absolute': f'{self.value:+} ₽', 'round': 'округление'}[self.mode]
+        if self.round_to:
+            text += f', шаг {self.round_to}'
+        return f'Массовое изменение цен: {text}'
+
+
+@dataclass
+class PriceChangeResult:
+    updated: int = 0
+    skipped: list[int] = field(default_factory=list)  # новая цена вне MIN_PRICE..MAX_PRICE
+
+
+def preview_price_change(queryset: QuerySet, change: PriceChange) -> dict:
+    """
+    Предпросмотр (dry-run): число изменяемых продуктов, суммы их цен до/после,
+    первые PREVIEW_SIZE изменяемых и пропускаемых (цена вне границ) продуктов
+    """
+    annotated = queryset.annotate(new_price=change.expression())
+    totals = annotated.order_by().aggregate(
+        count=Count('id', filter=IN_BOUNDS),
+        skipped_count=Count('id', filter=~IN_BOUNDS),
+        total_before=Sum('price', filter=IN_BOUNDS),
+        total_after=Sum('new_price', filter=IN_BOUNDS),
+    )
+    fields = ('id', 'name', 'price', 'new_price')
+    return {
+        'count': totals['count'],
+        'total_before': totals['total_before'] or Decimal('0'),
+        'total_after': totals['total_after'] or Decimal('0'),
+        'products': list(annotated.filter(IN_BOUNDS).values(*fields)[:PREVIEW_SIZE]),
+        'skipped_count': totals['skipped_count'],
+        'skipped': list(annotated.exclude(IN_BOUNDS).values(*fields)[:PREVIEW_SIZE]),
+    }
+
+
+@transaction.atomic
+def apply_price_change(queryset: QuerySet, change: PriceChange, user: Optional[User] = None) -> PriceChangeResult:
+    """
+    Применяет правило к выборке одним UPDATE и пишет историю пачкой.
+    Продукты, новая цена которых вне границ, не меняются и возвращаются в skipped.
+    Изменяемые строки блокируются (SELECT ... FOR UPDATE) до конца транзакции.
+    """
+    # Фиксируем выборку до UPDATE: фильтр может зависеть от цены (min_price, max_price).
+    # Строки блокируются до конца транзакции, чтобы параллельное изменение цены не
+    # вклинилось между проверкой границ и UPDATE (на SQLite транзакция IMMEDIATE
+    # и так держит блокировку записи с BEGIN)
+    result = PriceChangeResult()
+    ids = []
+    locked = queryset.select_for_update(of=('self',)).order_by()
+    for product_id, new_price in locked.annotate(new_price=change.expression()).values_list('id', 'new_price'):
+        (ids if MIN_PRICE <= new_price <= MAX_PRICE else result.skipped).append(product_id)
+    if not ids:
+        return result
+    result.updated = Product.objects.filter(id__in=ids).update(price=change.expression())
+
+    products = list(Product.objects.filter(id__in=ids).order_by())
+    Product.history.bulk_history_create(
+        products, update=True, default_user=user, default_change_reason=change.describe()
+    )
+    rebuild_restaurant_stats({product.restaurant_id for product in products})
+    transaction.on_commit(bump_catalogue_version)
+    return result
@@ -0,0 +1,114 @@
+"""
+Массовая загрузка меню: upsert продуктов пачкой.
+
+Строки проверяются сериализатором без обращений к БД, а рестораны и
+уже существующие продукты читаются двумя запросами на всю пачку.
+Запись — один bulk_create(update_conflicts=True) по ограничению
+product_restaurant_name_uniq, история simple_history — по одному
+bulk_history_create для созданных и для обновленных продуктов.
+
+bulk_create не отправляет сигналов, поэтому кеш каталога, статистика
+ресторанов и поисковый индекс обновляются здесь явно.
+"""
+from dataclasses import dataclass, field
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .cache import bump_catalogue_version
+from .models import Restaurant, Product
+from .search import get_search_backend
+from .serializers import ProductImportRowSerializer
+from .stats import rebuild_restaurant_stats
+
+MAX_IMPORT_ROWS = 1000
+
+
+@dataclass
+class ImportResult:
+    created: list[Product] = field(default_factory=list)
+    updated: list[Product] = field(default_factory=list)
+    errors: list[dict] = field(default_factory=list)  # [{'index': номер строки, 'errors': {поле: [...]}}]
+
+
+def validate_rows(rows: list, user: User, result: ImportResult) -> dict[tuple[int, str], dict]:
+    """Проверяет строки; возвращает {(restaurant_id, name): данные} для корректных, ошибки — в result"""
+    valid: dict[tuple[int, str], tuple[int, dict]] = {}
+    for index, row in enumerate(rows):
+        serializer = ProductImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            result.errors.append({'index': index, 'errors': serializer.errors})
+            continue
+        data = serializer.validated_data
+        key = (data['restaurant'], data['name'])
+        if key in valid:
+            result.errors.append({'index': index, 'errors': {
+                'name': [f'Продукт с таким названием уже есть в загрузке (строка {valid[key][0]})'],
+            }})
+            continue
+        valid[key] = (index, data)
+
+    # Рестораны, в которые пользователь может загружать меню, — один запрос
+    restaurants = Restaurant.objects.filter(id__in={restaurant_id for restaurant_id, _ in valid})
+    if not user.is_superuser:
+        restaurants = restaurants.filter(owner=user)
+    allowed = set(restaurants.values_list('id', flat=True))
+    for (restaurant_id, name), (index, data) in list(valid.items()):
+        if restaurant_id not in allowed:
+            result.errors.append({'index': index, 'errors': {'restaurant': ['Ресторан не найден']}})
+            del valid[(restaurant_id, name)]
+
+    result.errors.sort(key=lambda error: error['index'])
+    return {key: data for key, (_, data) in valid.items()}
+
+
+@transaction.atomic
+def upsert_products(rows: list, user: User) -> ImportResult:
+    """
+    Создает новые продукты и обновляет описание и цену существующих (по ресторану и названию).
+    Ошибочные строки пропускаются и попадают в ImportResult.errors.
+
+    Args:
+        rows: Строки {restaurant, name, description, price}
+        user: Автор изменений (для истории и проверки владельца ресторана)
+    """
+    result = ImportResult()
+    valid = validate_rows(rows, user, result)
+    if not valid:
+        return result
+
+    # Уже существующие продукты — один запрос: отличаем создание от обновления для истории
+    existing = {
+        (restaurant_id, name): (product_id, created_at)
+        for product_id, restaurant_id, name, created_at in Product.objects.filter(
+            restaurant_id__in={restaurant_id for restaurant_id, _ in valid},
+            name__in={name for _, name in valid},
+        ).values_list('id', 'restaurant_id', 'name', 'created_at')
+    }
+
+    products = [
+        Product(restaurant_id=restaurant_id, name=name, description=data['description'], price=data['price'])
+        for (restaurant_id, name), data in valid.items()
+    ]
+    Product.objects.bulk_create(
+        products,
+        update_conflicts=True,
+        unique_fields=['restaurant', 'name'],
+        update_fields=['description', 'price'],
+    )
+    for product in products:
+        key = (product.restaurant_id, product.name)
+        if key in existing:
+            # created_at не обновляется при конфликте — в историю пишем значение из БД
+            product.pk, product.created_at = existing[key]
+            result.updated.append(product)
+        else:
+            result.created.append(product)
+
+    Product.history.bulk_history_create(result.created, default_user=user)
+    Product.history.bulk_history_create(result.updated, update=True, default_user=user)
+
+    rebuild_restaurant_stats({product.restaurant_id for product in products})
+    get_search_backend().index_many(products)
+    transaction.on_commit(bump_catalogue_version)
+    return result
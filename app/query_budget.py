@@ -0,0 +1,122 @@
+"""
+Бюджет SQL-запросов для представлений.
+
+@query_budget(n) объявляет, сколько запросов к БД допускает view или action
+ViewSet'а за весь HTTP-запрос (включая сессию и пользователя). Для
+унаследованных действий ViewSet'а (list, retrieve) бюджет задается
+атрибутом класса query_budgets = {'list': n}.
+
+QueryBudgetMiddleware считает запросы через connection.execute_wrapper и
+при превышении пишет в лог отчет с повторяющимися запросами — типичный
+признак N+1. При QUERY_BUDGET_RAISE (по умолчанию в тестах) вместо записи
+в лог бросается QueryBudgetExceeded.
+"""
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Представление выполнило больше запросов, чем объявлено в бюджете"""
+
+
+IGNORED_PREFIXES = ('EXPLAIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryRecorder:
+    """
+    Обертка execute_wrapper: запоминает SQL запросов приложения.
+    Не считаются управление точками сохранения и служебные запросы
+    Django Silk (EXPLAIN и запись в таблицы silk_*).
+    """
+
+    def __init__(self) -> None:
+        self.queries: list[str] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.startswith(IGNORED_PREFIXES) and '"silk_' not in sql:
+            self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    def duplicates(self) -> list[tuple[str, int]]:
+        """Запросы, выполненные больше одного раза (SQL с плейсхолдерами, без параметров)"""
+        return [(sql, n) for sql, n in Counter(self.queries).most_common() if n > 1]
+
+    def report(self, budget: int, label: str) -> str:
+        lines = [f'{label}: {self.count} SQL-запросов при бюджете {budget}']
+        for sql, n in self.duplicates():
+            lines.append(f'  x{n}: {sql[:300]}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def record_queries() -> Iterator[QueryRecorder]:
+    """Считает запросы к БД внутри блока"""
+    recorder = QueryRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder
+
+
+@contextmanager
+def assert_query_budget(budget: int, label: str = 'Блок') -> Iterator[QueryRecorder]:
+    """Как record_queries, но бросает QueryBudgetExceeded, если запросов больше budget"""
+    with record_queries() as recorder:
+        yield recorder
+    if recorder.count > budget:
+        raise QueryBudgetExceeded(recorder.report(budget, label))
+
+
+def query_budget(max_queries: int) -> Callable:
+    """Объявляет бюджет запросов view или action'а ViewSet'а"""
+    def decorator(view: Callable) -> Callable:
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def get_view_budget(request: HttpRequest, view_func: Callable) -> Optional[int]:
+    """Бюджет для view: атрибут функции или, для ViewSet, метода действия / query_budgets класса"""
+    budget = getattr(view_func, 'query_budget', None)
+    viewset = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None)
+    if budget is None and viewset is not None and actions:
+        action = actions.get(request.method.lower())
+        budget = getattr(getattr(viewset, action, None), 'query_budget', None)
+        if budget is None:
+            budget = getattr(viewset, 'query_budgets', {}).get(action)
+    return budget
+
+
+class QueryBudgetMiddleware:
+    """Проверяет бюджет запросов view; в DEBUG добавляет заголовок X-Query-Count"""
+
+    def __init__(self, get_response: Callable) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and recorder.count > budget:
+            report = recorder.report(budget, f'{request.method} {request.path}')
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(report)
+            logger.warning(report)
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(recorder.count)
+        return response
+
+    def process_view(self, request: HttpRequest, view_func: Callable, view_args, view_kwargs) -> None:
+        request.query_budget = get_view_budget(request, view_func)
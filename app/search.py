@@ -0,0 +1,246 @@
+"""
+Полнотекстовый поиск продуктов.
+
+Бэкенд выбирается настройкой SEARCH_BACKEND (путь к классу):
+- SQLiteFTSBackend — виртуальная таблица FTS5 app_product_fts (rowid = id продукта);
+- PostgresSearchBackend — GIN-индекс по tsvector с конфигурацией russian;
+- InMemorySearchBackend — инвертированный индекс в памяти процесса (тесты, отладка).
+
+Для SQLite и индекса в памяти текст проходит через analyze(): нижний
+регистр, ё -> е и легкий стеммер окончаний русских слов, поэтому «пиццы»
+находит «Пицца». PostgreSQL стеммит сам (to_tsvector('russian', ...)).
+Индекс обновляется сигналами post_save/post_delete продукта.
+
+Параметр within (queryset продуктов) ограничивает поиск видимыми
+пользователю продуктами внутри запроса к индексу, до LIMIT: иначе limit
+лучших совпадений по всем ресторанам мог не содержать ни одного своего.
+"""
+import re
+import threading
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import QuerySet
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+# Окончания русских слов, от длинных к коротким
+RUSSIAN_ENDINGS = sorted({
+    'иями', 'ями', 'ами', 'иях', 'ией', 'ого', 'его', 'ому', 'ему', 'ими', 'ыми',
+    'ях', 'ах', 'ой', 'ей', 'ий', 'ый', 'ое', 'ее', 'ие', 'ые', 'ая', 'яя', 'ую', 'юю',
+    'ом', 'ем', 'ам', 'ям', 'ов', 'ев', 'ию', 'ью', 'ия', 'ья',
+    'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й',
+}, key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+
+def stem(word: str) -> str:
+    """Отрезает одно окончание у русского слова, оставляя основу не короче MIN_STEM_LENGTH"""
+    if CYRILLIC_RE.search(word):
+        for ending in RUSSIAN_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+                return word[:-len(ending)]
+    return word
+
+
+def analyze(text: str) -> list[str]:
+    """Текст -> список нормализованных основ слов"""
+    return [stem(word) for word in WORD_RE.findall((text or '').lower().replace('ё', 'е'))]
+
+
+def within_sql(within: QuerySet) -> tuple[str, tuple]:
+    """SQL подзапроса id продуктов из queryset для условия IN"""
+    return within.order_by().values('pk').query.sql_with_params()
+
+
+class SearchBackend:
+    """
+    Базовый интерфейс поиска. search возвращает [(product_id, score)] по убыванию score;
+    within — queryset продуктов, среди которых ищем (None — все продукты)
+    """
+
+    def index(self, product: Product) -> None:
+        pass
+
+    def index_many(self, products: Iterable[Product]) -> None:
+        """Индексирует пачку продуктов (массовые операции не отправляют сигналов)"""
+        for product in products:
+            self.index(product)
+
+    def remove(self, product_id: int) -> None:
+        pass
+
+    def rebuild(self) -> int:
+        """Перестраивает индекс по всем продуктам"""
+        return 0
+
+    def search(self, query: str, limit: int = 20, within: Optional[QuerySet] = None) -> list[tuple[int, float]]:
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """FTS5: в таблицу пишутся уже нормализованные основы, ранжирование — bm25 (название весит больше)"""
+    table = 'app_product_fts'
+
+    def index(self, product: Product) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.pk, ' '.join(analyze(product.name)), ' '.join(analyze(product.description))],
+            )
+
+    def index_many(self, products: Iterable[Product]) -> None:
+        rows = [(p.pk, ' '.join(analyze(p.name)), ' '.join(analyze(p.description))) for p in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+    def remove(self, product_id: int) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product_id])
+
+    def rebuild(self) -> int:
+        rows = [
+            (product_id, ' '.join(analyze(name)), ' '.join(analyze(description)))
+            for product_id, name, description in Product.objects.values_list('id', 'name', 'description')
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)', rows)
+        return len(rows)
+
+    def search(self, query: str, limit: int = 20, within: Optional[QuerySet] = None) -> list[tuple[int, float]]:
+        terms = analyze(query)
+        if not terms:
+            return []
+        # Последнее слово — префикс (поиск по мере ввода)
+        match = ' '.join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+        where, params = f'{self.table} MATCH %s', [match.strip()]
+        if within is not None:
+            sql, within_params = within_sql(within)
+            where += f' AND rowid IN ({sql})'
+            params.extend(within_params)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, bm25({self.table}, 10.0, 1.0) AS rank FROM {self.table} '
+                f'WHERE {where} ORDER BY rank LIMIT %s',
+                [*params, limit],
+            )
+            return [(product_id, -rank) for product_id, rank in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """tsvector по названию (вес A) и описанию (вес B); индекс product_search_idx покрывает это выражение"""
+    document = (
+        "setweight(to_tsvector('russian', name), 'A') || "
+        "setweight(to_tsvector('russian', description), 'B')"
+    )
+
+    def search(self, query: str, limit: int = 20, within: Optional[QuerySet] = None) -> list[tuple[int, float]]:
+        where, params = f'{self.document} @@ q', [query]
+        if within is not None:
+            sql, within_params = within_sql(within)
+            where += f' AND id IN ({sql})'
+            params.extend(within_params)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id, ts_rank({self.document}, q) AS rank "
+                f"FROM app_product, websearch_to_tsquery('russian', %s) q "
+                f"WHERE {where} ORDER BY rank DESC, id LIMIT %s",
+                [*params, limit],
+            )
+            return cursor.fetchall()
+
+
+class InMemorySearchBackend(SearchBackend):
+    """Инвертированный индекс основа -> {product_id: вес}; строится из БД при первом поиске"""
+    name_weight = 3.0
+    description_weight = 1.0
+
+    def __init__(self) -> None:
+        self._postings: dict[str, dict[int, float]] = {}
+        self._documents: dict[int, set[str]] = {}
+        self._built = False
+        self._lock = threading.Lock()
+
+    def _add(self, product_id: int, name: str, description: str) -> None:
+        weights: dict[str, float] = {}
+        for term in analyze(name):
+            weights[term] = weights.get(term, 0) + self.name_weight
+        for term in analyze(description):
+            weights[term] = weights.get(term, 0) + self.description_weight
+        for term, weight in weights.items():
+            self._postings.setdefault(term, {})[product_id] = weight
+        self._documents[product_id] = set(weights)
+
+    def _remove(self, product_id: int) -> None:
+        for term in self._documents.pop(product_id, ()):
+            postings = self._postings.get(term, {})
+            postings.pop(product_id, None)
+            if not postings:
+                self._postings.pop(term, None)
+
+    def index(self, product: Product) -> None:
+        with self._lock:
+            if self._built:
+                self._remove(product.pk)
+                self._add(product.pk, product.name, product.description)
+
+    def remove(self, product_id: int) -> None:
+        with self._lock:
+            self._remove(product_id)
+
+    def rebuild(self) -> int:
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            for product_id, name, description in Product.objects.values_list('id', 'name', 'description'):
+                self._add(product_id, name, description)
+            self._built = True
+            return len(self._documents)
+
+    def search(self, query: str, limit: int = 20, within: Optional[QuerySet] = None) -> list[tuple[int, float]]:
+        terms = analyze(query)
+        if not terms:
+            return []
+        if not self._built:
+            self.rebuild()
+        allowed = set(within.values_list('pk', flat=True)) if within is not None else None
+        with self._lock:
+            scores: dict[int, float] = {}
+            for i, term in enumerate(terms):
+                if i == len(terms) - 1:  # последнее слово — префикс
+                    matched = [p for key, p in self._postings.items() if key.startswith(term)]
+                else:
+                    matched = [self._postings.get(term, {})]
+                term_scores: dict[int, float] = {}
+                for postings in matched:
+                    for product_id, weight in postings.items():
+                        term_scores[product_id] = max(term_scores.get(product_id, 0), weight)
+                # Все слова запроса должны встретиться (AND)
+                scores = term_scores if i == 0 else {
+                    pid: score + term_scores[pid] for pid, score in scores.items() if pid in term_scores
+                }
+        if allowed is not None:
+            scores = {pid: score for pid, score in scores.items() if pid in allowed}
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path: str) -> SearchBackend:
+    return import_string(path)()
+
+
+def get_search_backend() -> SearchBackend:
+    """Текущий бэкенд поиска по настройке SEARCH_BACKEND"""
+    return _load_backend(settings.SEARCH_BACKEND)
+
+
+def search_products(query: str, limit: int = 20, within: Optional[QuerySet] = None) -> list[tuple[int, float]]:
+    return get_search_backend().search(query, limit, within)
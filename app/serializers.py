@@ -1,6 +1,9 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Restaurant, Product, Order, OrderItem, Courier
+from .pricing import PRICE_MODES, PriceChange
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -43,6 +46,7 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'name', 'description', 'price', 'restaurant', 'restaurant_name', 'created_at', 'is_in_cart']
         read_only_fields = ['created_at']
+        validators = []  # уникальность (restaurant, name) проверяет validate_name
 
     def get_is_in_cart(self, obj: Product) -> bool:
         """
@@ -66,14 +70,56 @@ class ProductSerializer(serializers.ModelSerializer):
     def validate_name(self, value):
         """Валидация: название продукта должно быть уникальным в рамках ресторана"""
         restaurant = self.initial_data.get('restaurant')
+        if not restaurant and self.instance:
+            restaurant = self.instance.restaurant_id  # PATCH без ресторана — проверяем в текущем
         if restaurant:
-            if self.instance and self.instance.restaurant_id == restaurant and self.instance.name == value:
-                return value
-            if Product.objects.filter(restaurant_id=restaurant, name=value).exists():
+            duplicates = Product.objects.filter(restaurant_id=restaurant, name=value)
+            if self.instance:
+                duplicates = duplicates.exclude(pk=self.instance.pk)
+            if duplicates.exists():
                 raise serializers.ValidationError("Продукт с таким названием уже существует в этом ресторане")
         return value
 
 
+class ProductImportRowSerializer(serializers.Serializer):
+    """
+    Строка массовой загрузки меню (bulk_upsert).
+    Проверки без запросов к БД: рестораны и уникальность названий
+    проверяются для всей пачки сразу (см. app/product_import.py).
+    """
+    restaurant = serializers.IntegerField(min_value=1)
+    name = serializers.CharField(max_length=200)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+    validate_price = ProductSerializer.validate_price
+
+
+class PriceChangeSerializer(serializers.Serializer):
+    """Правило массового изменения цен (см. app/pricing.py)"""
+    mode = serializers.ChoiceField(choices=PRICE_MODES)
+    value = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, default=Decimal('0'))
+    round_to = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False, allow_null=True, min_value=Decimal('0.01')
+    )
+    restaurant = serializers.IntegerField(required=False, min_value=1)
+    dry_run = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        """Валидация: процент не меньше -100, для округления нужен шаг"""
+        if data['mode'] == 'percent' and data['value'] <= -100:
+            raise serializers.ValidationError({'value': 'Скидка должна быть меньше 100%'})
+        if data['mode'] == 'round' and not data.get('round_to'):
+            raise serializers.ValidationError({'round_to': 'Для округления укажите шаг'})
+        if data['mode'] != 'round' and not data['value']:
+            raise serializers.ValidationError({'value': 'Укажите изменение цены'})
+        return data
+
+    def to_change(self) -> PriceChange:
+        data = self.validated_data
+        return PriceChange(mode=data['mode'], value=data['value'], round_to=data.get('round_to'))
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     """Сериализатор для элемента заказа"""
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -0,0 +1,185 @@
+"""Сигналы приложения"""
+from decimal import Decimal
+
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_catalogue_version
+from .search import get_search_backend
+from .autocomplete import autocomplete_index
+from .models import Restaurant, Product, Order, OrderItem, RestaurantStats
+from .stats import (
+    adjust_restaurant_stats, rebuild_restaurant_stats, adjust_order_stats, rebuild_order_stats,
+    record_product_sales, record_order_sales,
+)
+
+
+@receiver([post_save, post_delete], sender=Restaurant)
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalogue_cache(sender, **kwargs) -> None:
+    """Изменение ресторана или продукта сбрасывает кеш каталога"""
+    bump_catalogue_version()
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance: Product, **kwargs) -> None:
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance: Product, **kwargs) -> None:
+    get_search_backend().remove(instance.pk)
+
+
+# Регистрируются после invalidate_catalogue_cache: индекс автодополнения сверяется с новой версией каталога
+@receiver(post_save, sender=Restaurant)
+def update_restaurant_autocomplete(sender, instance: Restaurant, **kwargs) -> None:
+    autocomplete_index.update('restaurant', instance.pk, instance.name)
+
+
+@receiver(post_save, sender=Product)
+def update_product_autocomplete(sender, instance: Product, **kwargs) -> None:
+    autocomplete_index.update('product', instance.pk, instance.name, instance.restaurant_id)
+
+
+@receiver(post_delete, sender=Restaurant)
+def remove_restaurant_autocomplete(sender, instance: Restaurant, **kwargs) -> None:
+    autocomplete_index.update('restaurant', instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_autocomplete(sender, instance: Product, **kwargs) -> None:
+    autocomplete_index.update('product', instance.pk)
+
+
+# ========================================
+# Материализованная статистика
+# ========================================
+
+# Поля снимков состояния — в порядке элементов product_state / order_state
+PRODUCT_STATE_FIELDS = ('restaurant_id', 'price')
+ORDER_STATE_FIELDS = ('restaurant_id', 'status', 'total_price', 'created_at')
+
+
+@receiver(post_init, sender=Product)
+def remember_product_state(sender, instance: Product, **kwargs) -> None:
+    """Запоминаем исходные значения, чтобы при сохранении применить только дельту"""
+    instance._stats_state = product_state(instance)
+
+
+@receiver(post_init, sender=Order)
+def remember_order_state(sender, instance: Order, **kwargs) -> None:
+    instance._stats_state = order_state(instance)
+
+
+def product_state(product: Product) -> tuple:
+    """(restaurant_id, price) — ключ и вес продукта в статистике ресторана"""
+    # __dict__ вместо атрибутов: не подгружаем отложенные (deferred) поля
+    return product.__dict__.get('restaurant_id'), product.__dict__.get('price')
+
+
+def order_state(order: Order) -> tuple:
+    """(restaurant_id, status, total_price, день создания) — ключ и вес заказа в агрегатах"""
+    created_at = order.__dict__.get('created_at')
+    return (
+        order.__dict__.get('restaurant_id'),
+        order.__dict__.get('status'),
+        order.__dict__.get('total_price'),
+        timezone.localdate(created_at) if created_at else None,
+    )
+
+
+def refresh_stats_state(instance, fields=None) -> None:
+    """
+    Обновляет снимок после refresh_from_db: иначе следующий save() применит дельту
+    от состояния на момент загрузки, а не от текущего в БД (например, после
+    change_order_status через другой экземпляр). При частичном обновлении (fields)
+    меняются только перечитанные поля.
+    """
+    if isinstance(instance, Order):
+        names, state = ORDER_STATE_FIELDS, order_state(instance)
+    else:
+        names, state = PRODUCT_STATE_FIELDS, product_state(instance)
+    old = getattr(instance, '_stats_state', None)
+    if fields is not None and old is not None:
+        refreshed = set(fields) | {f'{field}_id' for field in fields}
+        state = tuple(new if name in refreshed else previous for name, new, previous in zip(names, state, old))
+    instance._stats_state = state
+
+
+def as_decimal(value) -> Decimal:
+    # цена может быть присвоена как float (update_price) — приводим через str
+    return Decimal(str(value))
+
+
+@receiver(post_save, sender=Restaurant)
+def create_restaurant_stats(sender, instance: Restaurant, created: bool, **kwargs) -> None:
+    if created:
+        RestaurantStats.objects.bulk_create([RestaurantStats(restaurant=instance)], ignore_conflicts=True)
+
+
+@receiver(post_save, sender=Product)
+def update_stats_on_product_save(sender, instance: Product, created: bool, **kwargs) -> None:
+    price = as_decimal(instance.price)
+    old_restaurant_id, old_price = getattr(instance, '_stats_state', (None, None))  # нет после unpickle
+    if created:
+        adjust_restaurant_stats(instance.restaurant_id, products=1, price_sum=price)
+    elif old_restaurant_id is None or old_price is None:
+        # Исходное состояние неизвестно (отложенные поля) — пересчитываем ресторан
+        rebuild_restaurant_stats({instance.restaurant_id, old_restaurant_id} - {None})
+    elif old_restaurant_id != instance.restaurant_id:
+        adjust_restaurant_stats(old_restaurant_id, products=-1, price_sum=-as_decimal(old_price))
+        adjust_restaurant_stats(instance.restaurant_id, products=1, price_sum=price)
+    elif as_decimal(old_price) != price:
+        adjust_restaurant_stats(instance.restaurant_id, price_sum=price - as_decimal(old_price))
+    instance._stats_state = product_state(instance)
+
+
+@receiver(post_delete, sender=Product)
+def update_stats_on_product_delete(sender, instance: Product, **kwargs) -> None:
+    adjust_restaurant_stats(instance.restaurant_id, products=-1, price_sum=-as_decimal(instance.price))
+
+
+@receiver(post_save, sender=Order)
+def update_stats_on_order_save(sender, instance: Order, created: bool, **kwargs) -> None:
+    old = getattr(instance, '_stats_state', None)  # нет после unpickle
+    new = order_state(instance)
+    old_restaurant_id, old_status, old_total, old_day = old or (None, None, None, None)
+
+    if created:
+        adjust_restaurant_stats(instance.restaurant_id, orders=1)
+        adjust_order_stats(new[3], new[0], new[1], 1, as_decimal(new[2]))
+    elif None in (old_restaurant_id, old_status, old_total, old_day):
+        # Исходное состояние неизвестно — сверяем агрегаты за день заказа
+        rebuild_restaurant_stats({instance.restaurant_id, old_restaurant_id} - {None})
+        rebuild_order_stats(new[3], new[3])
+    elif old != new:
+        if old_restaurant_id != instance.restaurant_id:
+            adjust_restaurant_stats(old_restaurant_id, orders=-1)
+            adjust_restaurant_stats(instance.restaurant_id, orders=1)
+        # Перенос заказа из старой корзины агрегата (день/ресторан/статус) в новую
+        adjust_order_stats(old_day, old_restaurant_id, old_status, -1, -as_decimal(old_total))
+        adjust_order_stats(new[3], new[0], new[1], 1, as_decimal(new[2]))
+        if (old_status == 'cancelled') != (instance.status == 'cancelled'):
+            # Отмененные заказы не учитываются в рейтинге популярности
+            record_order_sales(instance, sign=-1 if instance.status == 'cancelled' else 1)
+    instance._stats_state = new
+
+
+@receiver(post_delete, sender=Order)
+def update_stats_on_order_delete(sender, instance: Order, **kwargs) -> None:
+    adjust_restaurant_stats(instance.restaurant_id, orders=-1)
+    restaurant_id, status, total, day = order_state(instance)
+    adjust_order_stats(day, restaurant_id, status, -1, -as_decimal(total))
+
+
+@receiver(post_save, sender=OrderItem)
+def record_sales_on_item_create(sender, instance: OrderItem, created: bool, **kwargs) -> None:
+    """Позиция, добавленная поштучно (админка, API); place_order пишет продажи сам"""
+    order = instance.order
+    if created and order.status != 'cancelled':
+        record_product_sales(
+            timezone.localdate(order.created_at),
+            [(instance.product_id, instance.product.restaurant_id, instance.quantity)],
+        )
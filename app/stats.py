@@ -0,0 +1,243 @@
+"""
+Инкрементальные агрегаты (материализованная статистика).
+
+Счетчики обновляются атомарными UPDATE ... SET x = x + delta из сигналов
+моделей, поэтому чтение статистики не сканирует продукты и заказы.
+Полный пересчет — rebuild_* (management-команды и периодические задачи).
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Restaurant, Product, Order, OrderItem, RestaurantStats, OrderDailyStats, ProductDailySales
+
+# Окна рейтинга популярных продуктов: параметр window -> число дней
+POPULARITY_WINDOWS = {'1d': 1, '7d': 7, '30d': 30}
+
+
+def adjust_restaurant_stats(restaurant_id: int, products: int = 0,
+                            price_sum: Decimal = Decimal('0'), orders: int = 0) -> None:
+    """Атомарно сдвигает счетчики ресторана на заданные дельты"""
+    RestaurantStats.objects.filter(restaurant_id=restaurant_id).update(
+        product_count=F('product_count') + products,
+        product_price_sum=F('product_price_sum') + price_sum,
+        order_count=F('order_count') + orders,
+    )
+
+
+def rebuild_restaurant_stats(restaurant_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Пересчитывает статистику ресторанов с нуля.
+    Продукты и заказы агрегируются отдельными запросами — без размножения
+    строк при JOIN продуктов с заказами.
+
+    Args:
+        restaurant_ids: Рестораны для пересчета (по умолчанию — все)
+    """
+    restaurants = Restaurant.objects.all()
+    products = Product.objects.all()
+    orders = Order.objects.all()
+    if restaurant_ids is not None:
+        restaurant_ids = list(restaurant_ids)
+        restaurants = restaurants.filter(id__in=restaurant_ids)
+        products = products.filter(restaurant_id__in=restaurant_ids)
+        orders = orders.filter(restaurant_id__in=restaurant_ids)
+
+    with transaction.atomic():
+        lock_for_rebuild(RestaurantStats)
+        product_stats = {
+            row['restaurant']: row
+            for row in products.order_by().values('restaurant').annotate(count=Count('id'), price_sum=Sum('price'))
+        }
+        order_counts = dict(
+            orders.order_by().values('restaurant').annotate(count=Count('id')).values_list('restaurant', 'count')
+        )
+
+        rows = []
+        for restaurant_id in restaurants.values_list('id', flat=True):
+            product_row = product_stats.get(restaurant_id, {})
+            rows.append(RestaurantStats(
+                restaurant_id=restaurant_id,
+                product_count=product_row.get('count', 0),
+                product_price_sum=product_row.get('price_sum') or 0,
+                order_count=order_counts.get(restaurant_id, 0),
+            ))
+        RestaurantStats.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['restaurant'],
+            update_fields=['product_count', 'product_price_sum', 'order_count', 'updated_at'],
+        )
+    return len(rows)
+
+
+def adjust_order_stats(day: date, restaurant_id: int, status: str, orders: int, revenue: Decimal) -> None:
+    """Атомарно сдвигает агрегат заказов за день (upsert: UPDATE, при отсутствии строки — INSERT)"""
+    bucket = OrderDailyStats.objects.filter(date=day, restaurant_id=restaurant_id, status=status)
+    delta = {'order_count': F('order_count') + orders, 'revenue': F('revenue') + revenue}
+    if bucket.update(**delta) or orders < 0:
+        # Уменьшение отсутствующей строки не создаем: она могла быть удалена
+        # каскадно вместе с рестораном; расхождения исправит сверка
+        return
+    try:
+        with transaction.atomic():
+            OrderDailyStats.objects.create(
+                date=day, restaurant_id=restaurant_id, status=status, order_count=orders, revenue=revenue
+            )
+    except IntegrityError:
+        # Строку уже создала параллельная транзакция
+        bucket.update(**delta)
+
+
+def lock_for_rebuild(model) -> None:
+    """
+    Блокирует запись в таблицу агрегатов до конца транзакции пересчета, чтобы
+    инкременты, пришедшие между агрегацией и заменой строк, не потерялись:
+    они дождутся коммита и применятся к новым строкам. Чтение не блокируется.
+    На SQLite транзакция (IMMEDIATE) и так держит блокировку записи.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {connection.ops.quote_name(model._meta.db_table)} IN EXCLUSIVE MODE')
+
+
+def rebuild_order_stats(date_from: Optional[date] = None, date_to: Optional[date] = None) -> int:
+    """
+    Пересчитывает дневные агрегаты заказов за период (включительно) из таблицы заказов.
+    Используется для сверки инкрементальных счетчиков (задача reconcile_order_stats).
+    """
+    orders = Order.objects.annotate(day=TruncDate('created_at'))
+    buckets = OrderDailyStats.objects.all()
+    if date_from:
+        orders = orders.filter(day__gte=date_from)
+        buckets = buckets.filter(date__gte=date_from)
+    if date_to:
+        orders = orders.filter(day__lte=date_to)
+        buckets = buckets.filter(date__lte=date_to)
+
+    with transaction.atomic():
+        lock_for_rebuild(OrderDailyStats)
+        rows = [
+            OrderDailyStats(
+                date=row['day'], restaurant_id=row['restaurant'], status=row['status'],
+                order_count=row['count'], revenue=row['revenue'] or 0,
+            )
+            for row in orders.order_by().values('day', 'restaurant', 'status').annotate(
+                count=Count('id'), revenue=Sum('total_price')
+            )
+        ]
+        buckets.delete()
+        OrderDailyStats.objects.bulk_create(rows)
+    return len(rows)
+
+
+# ========================================
+# Рейтинг популярных продуктов
+# ========================================
+
+def record_product_sales(day: date, lines: Iterable[tuple[int, int, int]], sign: int = 1) -> None:
+    """
+    Добавляет продажи заказа в дневные корзины продуктов за два запроса
+    независимо от числа позиций: INSERT недостающих строк и один UPDATE
+    с CASE по продуктам.
+
+    Args:
+        day: День создания заказа
+        lines: Позиции (product_id, restaurant_id продукта, quantity)
+        sign: 1 — заказ засчитывается, -1 — снимается (отмена)
+    """
+    quantities: dict[int, int] = {}
+    restaurants: dict[int, int] = {}
+    for product_id, restaurant_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        restaurants[product_id] = restaurant_id
+    if not quantities:
+        return
+    if sign > 0:
+        ProductDailySales.objects.bulk_create(
+            [ProductDailySales(date=day, product_id=pid, restaurant_id=restaurants[pid]) for pid in quantities],
+            ignore_conflicts=True,
+        )
+    delta = Case(
+        *[When(product_id=pid, then=Value(sign * qty)) for pid, qty in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    ProductDailySales.objects.filter(date=day, product_id__in=quantities).update(quantity=F('quantity') + delta)
+
+
+def record_order_sales(order: Order, sign: int = 1) -> None:
+    """Засчитывает (или снимает) все позиции заказа в рейтинге популярности"""
+    lines = order.items.values_list('product_id', 'product__restaurant_id', 'quantity')
+    record_product_sales(timezone.localdate(order.created_at), lines, sign)
+
+
+def record_orders_sales(order_ids: Iterable[int], sign: int = 1) -> None:
+    """Как record_order_sales, но для пачки заказов: позиции читаются одним запросом"""
+    lines_by_day: dict[date, list[tuple[int, int, int]]] = {}
+    items = OrderItem.objects.filter(order_id__in=list(order_ids)).values_list(
+        'order__created_at', 'product_id', 'product__restaurant_id', 'quantity'
+    )
+    for created_at, product_id, restaurant_id, quantity in items:
+        lines_by_day.setdefault(timezone.localdate(created_at), []).append((product_id, restaurant_id, quantity))
+    for day, lines in lines_by_day.items():
+        record_product_sales(day, lines, sign)
+
+
+def top_products(window: str = '30d', restaurant_id: Optional[int] = None,
+                 limit: int = 10) -> list[tuple[int, int]]:
+    """
+    Топ продуктов по количеству продаж за окно — [(product_id, quantity), ...].
+    Результат кешируется на POPULAR_PRODUCTS_CACHE_TIMEOUT: рейтинг допускает
+    небольшое отставание, а сумма по дневным корзинам читается по индексу.
+    """
+    key = f'popular:{window}:{restaurant_id or "all"}:{limit}'
+    top = cache.get(key)
+    if top is None:
+        date_from = timezone.localdate() - timedelta(days=POPULARITY_WINDOWS[window] - 1)
+        buckets = ProductDailySales.objects.filter(date__gte=date_from)
+        if restaurant_id is not None:
+            buckets = buckets.filter(restaurant_id=restaurant_id)
+        top = list(
+            buckets.values('product').annotate(total=Sum('quantity')).filter(total__gt=0)
+            .order_by('-total', 'product').values_list('product', 'total')[:limit]
+        )
+        cache.set(key, top, settings.POPULAR_PRODUCTS_CACHE_TIMEOUT)
+    return top
+
+
+def rebuild_product_sales(days: int = max(POPULARITY_WINDOWS.values())) -> int:
+    """
+    Пересчитывает дневные корзины продаж за последние days дней из позиций
+    заказов (без отмененных) и удаляет корзины старше самого длинного окна.
+    Исправляет расхождения после правки позиций заказов вручную.
+    """
+    date_from = timezone.localdate() - timedelta(days=days - 1)
+    items = (
+        OrderItem.objects.exclude(order__status='cancelled')
+        .annotate(day=TruncDate('order__created_at'))
+        .filter(day__gte=date_from)
+    )
+    oldest = timezone.localdate() - timedelta(days=max(POPULARITY_WINDOWS.values()) - 1)
+    with transaction.atomic():
+        lock_for_rebuild(ProductDailySales)
+        rows = [
+            ProductDailySales(
+                date=row['day'], product_id=row['product'],
+                restaurant_id=row['product__restaurant'], quantity=row['quantity'],
+            )
+            for row in items.order_by().values('day', 'product', 'product__restaurant').annotate(
+                quantity=Sum('quantity')
+            )
+        ]
+        ProductDailySales.objects.filter(date__gte=date_from).delete()
+        ProductDailySales.objects.filter(date__lt=oldest).delete()
+        ProductDailySales.objects.bulk_create(rows)
+    return len(rows)
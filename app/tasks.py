@@ -1,21 +1,45 @@
 """Celery задачи для приложения"""
 from celery import shared_task
-from django.core.mail import send_mail
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 
+from app.mail import deliver, send_email
+
 
 @shared_task
 def send_order_confirmation_email(order_id: int, email: str, username: str) -> str:
     """Асинхронная отправка письма подтверждения заказа (Mailhog)"""
-    send_mail(
+    send_email(
         subject=f'Заказ #{order_id} оформлен!',
-        message=f'Здравствуйте, {username}! Ваш заказ #{order_id} успешно оформлен и принят в обработку.',
-        from_email='noreply@timqwees.com',
-        recipient_list=[email],
-        fail_silently=False,
+        body=f'Здравствуйте, {username}! Ваш заказ #{order_id} успешно оформлен и принят в обработку.',
+        recipients=[email],
     )
-    return f'Письмо отправлено для заказа #{order_id}'
+    return f'Письмо передано на отправку для заказа #{order_id}'
+
+
+@shared_task(bind=True)
+def resend_emails(self, messages: list) -> str:
+    """
+    Повторная отправка писем после временной ошибки почтового сервера (см. mail.py):
+    задержка удваивается с каждой попыткой, после MAIL_MAX_RETRIES задача падает.
+
+    Args:
+        messages: Письма в виде [subject, body, from_email, to] (mail.dump_messages)
+    """
+    from app.mail import MailDeliveryError, dump_messages, load_messages, outbox, record_metrics
+    try:
+        sent = outbox.send(load_messages(messages))
+    except MailDeliveryError as exc:
+        if self.request.retries >= settings.MAIL_MAX_RETRIES:
+            record_metrics(failed=len(exc.messages))
+            raise
+        record_metrics(retries=1)
+        raise self.retry(
+            args=[dump_messages(exc.messages)], exc=exc, max_retries=settings.MAIL_MAX_RETRIES,
+            countdown=settings.MAIL_RETRY_BACKOFF * 2 ** (self.request.retries + 1),
+        )
+    return f'Повторно отправлено {sent} писем'
 
 
 @shared_task
@@ -32,20 +56,104 @@ def cleanup_old_orders(days: int = 90) -> str:
     return f'Удалено {count} старых отмененных заказов'
 
 
+def status_change_email(order_id: int, new_status: str) -> tuple[str, str]:
+    """Тема и текст письма о смене статуса заказа"""
+    from app.models import Order
+    status_display = dict(Order.STATUS_CHOICES).get(new_status, new_status)
+    return f'Статус заказа #{order_id} изменен', f'Статус вашего заказа #{order_id} изменен на: {status_display}'
+
+
+# Устарела: смены статуса уведомляются через flush_order_status_notifications
+# (order_notifications.py). Задача оставлена только для сообщений, поставленных
+# в очередь до выкладки объединения уведомлений; удалить в следующем релизе,
+# когда в очередях Celery не останется задач notify_order_status_change.
 @shared_task
 def notify_order_status_change(order_id: int, new_status: str) -> str:
-    """Уведомление об изменении статуса заказа"""
+    """Уведомление об изменении статуса заказа (устарела, см. комментарий выше)"""
     from app.models import Order
     try:
         order = Order.objects.select_related('customer').get(id=order_id)
-        status_display = dict(Order.STATUS_CHOICES).get(new_status, new_status)
-        send_mail(
-            subject=f'Статус заказа #{order_id} изменен',
-            message=f'Статус вашего заказа #{order_id} изменен на: {status_display}',
-            from_email='noreply@timqwees.com',
-            recipient_list=[order.customer.email] if order.customer.email else [],
-            fail_silently=True,
-        )
+        if order.customer.email:
+            subject, message = status_change_email(order_id, new_status)
+            send_email(subject, message, [order.customer.email])
         return f'Уведомление отправлено для заказа #{order_id}'
     except Order.DoesNotExist:
         return f'Заказ #{order_id} не найден'
+
+
+@shared_task
+def notify_order_status_changes(changes: list) -> str:
+    """
+    Пакетное уведомление о смене статуса нескольких заказов (массовые переходы):
+    адреса читаются одним запросом, письма уходят пачкой через буфер доставки.
+
+    Args:
+        changes: Пары [order_id, new_status]
+    """
+    from django.core.mail import EmailMessage
+    from app.models import Order
+    statuses = {order_id: new_status for order_id, new_status in changes}
+    recipients = Order.objects.filter(id__in=statuses).exclude(customer__email='').values_list('id', 'customer__email')
+    messages = [
+        EmailMessage(*status_change_email(order_id, statuses[order_id]), to=[email])
+        for order_id, email in recipients
+    ]
+    deliver(messages)
+    return f'Передано на отправку {len(messages)} уведомлений о смене статуса'
+
+
+@shared_task
+def flush_order_status_notifications(order_ids: list) -> str:
+    """
+    Отложенное уведомление о смене статуса (см. order_notifications.py): по одному
+    письму на заказ о его текущем статусе, промежуточные статусы окна не отправляются.
+    """
+    from app.order_notifications import take_status_changes
+    changes = take_status_changes(order_ids)
+    if not changes:
+        return 'Новых статусов для уведомления нет'
+    return notify_order_status_changes(changes)
+
+
+@shared_task
+def reconcile_order_stats(days: int = 2) -> str:
+    """Периодическая задача: сверка дневных агрегатов заказов за последние дни"""
+    from app.stats import rebuild_order_stats
+    date_from = timezone.localdate() - timedelta(days=days - 1)
+    count = rebuild_order_stats(date_from=date_from)
+    return f'Пересчитано {count} дневных агрегатов заказов начиная с {date_from}'
+
+
+@shared_task
+def reconcile_product_sales() -> str:
+    """Периодическая задача: пересчет дневных продаж продуктов для рейтинга популярности"""
+    from app.stats import rebuild_product_sales
+    count = rebuild_product_sales()
+    return f'Пересчитано {count} дневных корзин продаж продуктов'
+
+
+@shared_task
+def refresh_dashboard_metrics() -> str:
+    """Периодическая задача: пересчет метрик дашборда админки в кеш"""
+    from app.dashboard import refresh_dashboard_metrics as refresh
+    metrics = refresh()
+    return f'Метрики дашборда обновлены: {metrics["orders_count"]} заказов'
+
+
+@shared_task
+def export_data(kind: str, fmt: str, query_token: str = None, user_id: int = None) -> str:
+    """Фоновая выгрузка заказов/продуктов в CSV или XLSX; по готовности — письмо пользователю"""
+    from django.contrib.auth.models import User
+    from app.exports import EXPORTS, export_to_file, export_url, load_query
+
+    queryset = load_query(EXPORTS[kind].model, query_token) if query_token else None
+    path = export_to_file(kind, fmt, queryset)
+
+    user = User.objects.filter(id=user_id).first() if user_id else None
+    if user and user.email:
+        send_email(
+            subject=f'Выгрузка {path.name} готова',
+            body=f'Здравствуйте, {user.username}! Выгрузка готова, скачать: {export_url(path)}',
+            recipients=[user.email],
+        )
+    return str(path)
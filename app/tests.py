@@ -2,21 +2,67 @@
 Тесты для приложения доставки еды.
 Минимум 10 тестов для проверки основных функций.
 """
+import asyncio
+import csv
+import json
+import shutil
+import smtplib
+import socketserver
+import tempfile
+import threading
+from pathlib import Path
+from datetime import timedelta
 from decimal import Decimal
+from unittest import mock
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
-from django.urls import reverse
+from django.core import mail, signing
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, Client, RequestFactory, AsyncClient
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.urls import resolve, reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from .models import Restaurant, Product, Order, OrderItem, Courier
+from .models import (
+    Restaurant, Product, Order, OrderItem, Courier, RestaurantStats, OrderDailyStats, ProductDailySales
+)
+from .cart import price_cart, place_order
+from .query_budget import record_queries, get_view_budget, query_budget, QueryBudgetMiddleware, QueryBudgetExceeded
+from .cart_backends import get_cart_backend, DatabaseCartBackend, InMemoryCartBackend
+from .context_processors import cart as cart_context
+from .stats import rebuild_restaurant_stats, rebuild_order_stats, rebuild_product_sales
+from .dashboard import get_dashboard_metrics
+from .tasks import (
+    refresh_dashboard_metrics, export_data, notify_order_status_changes, flush_order_status_notifications,
+    resend_emails,
+)
+from .exports import dump_query, load_query, export_to_file
+from .search import analyze, get_search_backend, search_products, SQLiteFTSBackend
+from .autocomplete import autocomplete_index
+from .mail import MailDeliveryError, MailOutbox, dump_messages, get_mail_metrics, is_transient
+from .order_notifications import schedule_status_notifications
+from .product_import import MAX_IMPORT_ROWS
+from .pricing import PriceChange, apply_price_change
+from .order_status import change_order_status, change_orders_status, TransitionError, TransitionConflict
+from .order_events import broker, order_event, websocket_application, InProcessEventBackend
+from .cache import bump_catalogue_version
 from .serializers import (
     RestaurantSerializer, ProductSerializer,
     OrderSerializer, OrderItemSerializer
 )
 
 
+def app_queries(context: CaptureQueriesContext) -> list[str]:
+    """SQL-запросы приложения без служебных EXPLAIN, которые добавляет Django Silk"""
+    return [q['sql'] for q in context.captured_queries if not q['sql'].startswith('EXPLAIN')]
+
+
 # ==========================================
 # 1. Тестирование моделей
 # ==========================================
@@ -301,8 +347,23 @@ class CartAddTest(TestCase):
             {'quantity': 2}
         )
         self.assertEqual(response.status_code, 302)  # редирект
-        cart = self.client.session.get('cart', {})
-        self.assertEqual(cart.get(str(self.product.id)), 2)
+        cart = get_cart_backend().get(self.user.id)
+        self.assertEqual(cart.get(self.product.id), 2)
+
+    def test_add_invalid_quantity(self) -> None:
+        """Нулевое, отрицательное и нечисловое количество — 400 без записи в корзину"""
+        for quantity in (0, -3, 'abc'):
+            response = self.client.post(reverse('add_to_cart', args=[self.product.id]), {'quantity': quantity})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(get_cart_backend().get(self.user.id), {})
+        with self.assertRaises(ValueError):
+            DatabaseCartBackend().add(self.user.id, self.product.id, 0)
+
+    def test_update_missing_product(self) -> None:
+        """Обновление несуществующего товара — 404 без записи в корзину"""
+        response = self.client.post(reverse('update_cart', args=[999999]), {'quantity': 2})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(get_cart_backend().get(self.user.id), {})
 
 
 # ==========================================
@@ -372,10 +433,8 @@ class SerializerContextTest(APITestCase):
     def test_product_serializer_context(self) -> None:
         """is_in_cart передается через контекст"""
         self.client.force_authenticate(user=self.user)
-        # Добавляем продукт в корзину через сессию
-        session = self.client.session
-        session['cart'] = {str(self.product.id): 1}
-        session.save()
+        # Добавляем продукт в корзину пользователя
+        get_cart_backend().set(self.user.id, self.product.id, 1)
 
         response = self.client.get('/api/products/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -383,3 +442,1458 @@ class SerializerContextTest(APITestCase):
         for product_data in response.data['results']:
             if product_data['id'] == self.product.id:
                 self.assertTrue(product_data['is_in_cart'])
+
+
+# ==========================================
+# 5. Корзина и оформление заказа
+# ==========================================
+
+class CartPricingTest(TestCase):
+    """Тест 14: Расчет корзины одним запросом"""
+
+    def setUp(self) -> None:
+        self.owner = User.objects.create_user(username='rest_owner7', password='pass123')
+        self.restaurant = Restaurant.objects.create(
+            name='Ресторан', address='адрес', phone='+79990000000', owner=self.owner
+        )
+        self.products = [
+            Product.objects.create(
+                name=f'Блюдо {i}', description='Блюдо',
+                price=Decimal('100.00') * i, restaurant=self.restaurant
+            )
+            for i in range(1, 4)
+        ]
+
+    def test_price_cart_single_query(self) -> None:
+        """Вся корзина загружается одним запросом, отсутствующие продукты пропускаются"""
+        cart = {str(p.id): 2 for p in self.products}
+        cart['999999'] = 1
+        with CaptureQueriesContext(connection) as ctx:
+            priced = price_cart(cart)
+            self.assertEqual(priced.total_price, Decimal('1200.00'))
+            self.assertEqual(priced.restaurant_ids, {self.restaurant.id})
+        self.assertEqual(len(app_queries(ctx)), 1)
+        self.assertEqual(priced.items_count, 6)
+        self.assertEqual(priced.missing_product_ids, [999999])
+
+    @mock.patch('app.views.send_order_confirmation_email.delay')
+    def test_checkout_creates_order(self, send_email) -> None:
+        """Оформление заказа сохраняет позиции и итоговую сумму"""
+        customer = User.objects.create_user(username='buyer5', password='pass123')
+        self.client.login(username='buyer5', password='pass123')
+        get_cart_backend().set(customer.id, self.products[0].id, 1)
+        get_cart_backend().set(customer.id, self.products[2].id, 2)
+
+        response = self.client.post(reverse('checkout'), {'address': 'ул. Тестовая, д. 1, кв. 1'})
+        order = Order.objects.get(customer=customer)
+        self.assertRedirects(response, reverse('order_detail', args=[order.id]), fetch_redirect_response=False)
+        self.assertEqual(order.total_price, Decimal('700.00'))
+        self.assertEqual(order.items.count(), 2)
+        send_email.assert_called_once_with(order.id, customer.email, customer.username)
+        self.assertEqual(get_cart_backend().get(customer.id), {})
+
+    def test_place_order_single_write(self) -> None:
+        """Заказ пишется одним INSERT с одной записью истории, позиции — одним bulk_create"""
+        customer = User.objects.create_user(username='buyer6', password='pass123')
+        cart = {str(p.id): 1 for p in self.products}
+        with CaptureQueriesContext(connection) as ctx:
+            order = place_order(customer, self.restaurant, 'ул. Тестовая, д. 1, кв. 1', cart)
+        inserts = [sql.split('"')[1] for sql in app_queries(ctx) if sql.startswith('INSERT')]
+        for table in ('app_order', 'app_historicalorder', 'app_orderitem'):
+            self.assertEqual(inserts.count(table), 1)
+        self.assertEqual(order.history.count(), 1)
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.total_price, Decimal('600.00'))
+
+
+class CartBackendTest(TestCase):
+    """Тест 15: Хранилища корзины (БД и in-memory) ведут себя одинаково"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='cart_user', password='pass123')
+        self.owner = User.objects.create_user(username='rest_owner8', password='pass123')
+        restaurant = Restaurant.objects.create(
+            name='Ресторан', address='адрес', phone='+79990000000', owner=self.owner
+        )
+        self.product_ids = [
+            Product.objects.create(
+                name=f'Блюдо {i}', description='Блюдо', price=Decimal('100.00'), restaurant=restaurant
+            ).id
+            for i in range(2)
+        ]
+
+    def check_backend(self, backend) -> None:
+        first, second = self.product_ids
+        backend.add(self.user.id, first, 2)
+        backend.add(self.user.id, first, 3)  # атомарное увеличение
+        backend.set(self.user.id, second, 4)
+        self.assertEqual(backend.get(self.user.id), {first: 5, second: 4})
+        self.assertEqual(backend.count(self.user.id), 9)
+
+        backend.set(self.user.id, second, 1)  # повторный upsert
+        backend.set(self.user.id, first, 0)  # 0 удаляет строку
+        self.assertEqual(backend.get(self.user.id), {second: 1})
+
+        backend.clear(self.user.id)
+        self.assertEqual(backend.count(self.user.id), 0)
+
+    def test_database_backend(self) -> None:
+        self.check_backend(DatabaseCartBackend())
+
+    def test_in_memory_backend(self) -> None:
+        self.check_backend(InMemoryCartBackend())
+
+
+class CartCountContextProcessorTest(TestCase):
+    """Тест 16: Счетчик корзины считается лениво и кешируется до изменения корзины"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='badge_user', password='pass123')
+        self.owner = User.objects.create_user(username='rest_owner9', password='pass123')
+        restaurant = Restaurant.objects.create(
+            name='Ресторан', address='адрес', phone='+79990000000', owner=self.owner
+        )
+        self.product = Product.objects.create(
+            name='Суп', description='Суп', price=Decimal('200.00'), restaurant=restaurant
+        )
+        get_cart_backend().set(self.user.id, self.product.id, 2)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+
+    def test_count_is_lazy_and_cached(self) -> None:
+        with CaptureQueriesContext(connection) as ctx:
+            context = cart_context(self.request)
+        self.assertEqual(app_queries(ctx), [])  # ничего не считаем, пока шаблон не выведет счетчик
+
+        self.assertEqual(str(context['cart_items_count']), '2')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(str(cart_context(self.request)['cart_items_count']), '2')
+        self.assertEqual(app_queries(ctx), [])  # значение из кеша
+
+        get_cart_backend().add(self.user.id, self.product.id, 1)  # сбрасывает кеш
+        self.assertTrue(cart_context(self.request)['cart_items_count'] > 2)
+
+
+# ==========================================
+# 6. Кеширование каталога
+# ==========================================
+
+class CatalogueCacheTest(TestCase):
+    """Тест 17: Каталог отдается из кеша и сбрасывается при изменении продуктов"""
+
+    def setUp(self) -> None:
+        self.owner = User.objects.create_user(username='rest_owner10', password='pass123')
+        self.restaurant = Restaurant.objects.create(
+            name='Кешируемый ресторан', address='адрес', phone='+79990000000', owner=self.owner
+        )
+        self.product = Product.objects.create(
+            name='Пельмени', description='Домашние', price=Decimal('300.00'), restaurant=self.restaurant
+        )
+        self.url = reverse('restaurant_detail', args=[self.restaurant.id])
+
+    def test_menu_served_from_cache_until_product_changes(self) -> None:
+        self.client.get(self.url)  # прогрев кеша
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Пельмени')
+        self.assertFalse([sql for sql in app_queries(ctx) if 'app_' in sql])
+
+        self.product.name = 'Вареники'
+        self.product.save()  # post_save увеличивает версию каталога
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Вареники')
+        self.assertNotContains(response, 'Пельмени')
+
+    def test_menu_cache_shared_with_authenticated_users(self) -> None:
+        User.objects.create_user(username='menu_user', password='pass123')
+        self.client.login(username='menu_user', password='pass123')
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Пельмени')
+        self.assertContains(response, 'csrfmiddlewaretoken')  # формы корзины не кешируются
+        self.assertFalse([sql for sql in app_queries(ctx) if 'app_product' in sql])
+
+
+# ==========================================
+# 7. Пагинация API
+# ==========================================
+
+class OrderCursorPaginationTest(APITestCase):
+    """Тест 18: Курсорная пагинация заказов без COUNT(*)"""
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser(username='cursor_admin', password='admin123')
+        self.owner = User.objects.create_user(username='rest_owner11', password='pass123')
+        restaurant = Restaurant.objects.create(
+            name='Ресторан', address='адрес', phone='+79990000000', owner=self.owner
+        )
+        self.orders = [
+            Order.objects.create(
+                customer=self.admin, restaurant=restaurant, address='ул. Тестовая, д. 1, кв. 1'
+            )
+            for _ in range(12)
+        ]
+        self.client.force_authenticate(user=self.admin)
+
+    def test_cursor_pages_cover_all_orders(self) -> None:
+        seen = []
+        url = '/api/orders/?pagination=cursor'
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            self.assertFalse([sql for sql in app_queries(ctx) if 'COUNT(' in sql])
+            seen.extend(order['id'] for order in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(seen), sorted(order.id for order in self.orders))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_page_number_pagination_is_default(self) -> None:
+        response = self.client.get('/api/orders/')
+        self.assertEqual(response.data['count'], 12)
+
+
+# ==========================================
+# 8. Материализованная статистика
+# ==========================================
+
+class RestaurantStatsTest(APITestCase):
+    """Тест 19: Статистика ресторанов поддерживается инкрементально и совпадает с пересчетом"""
+
+    def setUp(self) -> None:
+        self.owner = User.objects.create_user(username='rest_owner12', password='pass123')
+        self.customer = User.objects.create_user(username='buyer7', password='pass123')
+        self.restaurant = Restaurant.objects.create(
+            name='Статистика', address='адрес', phone='+79990000000', owner=self.owner
+        )
+        self.products = [
+            Product.objects.create(
+                name=f'Блюдо {i}', description='Блюдо', price=Decimal('100.00'), restaurant=self.restaurant
+            )
+            for i in range(3)
+        ]
+        for _ in range(2):
+            order = Order.objects.create(
+                customer=self.customer, restaurant=self.restaurant, address='ул. Тестовая, д. 1, кв. 1'
+            )
+            OrderItem.objects.create(order=order, product=self.products[0], quantity=1, price=Decimal('100.00'))
+
+    def test_incremental_stats_match_rebuild(self) -> None:
+        self.products[1].price = Decimal('400.00')
+        self.products[1].save()
+        self.products[2].delete()
+
+        stats = RestaurantStats.objects.get(restaurant=self.restaurant)
+        # 2 заказа, а не 2 x 3 строки от JOIN продуктов с заказами
+        self.assertEqual((stats.product_count, stats.order_count), (2, 2))
+        self.assertEqual(stats.avg_product_price, Decimal('250.00'))
+
+        rebuild_restaurant_stats()
+        rebuilt = RestaurantStats.objects.get(restaurant=self.restaurant)
+        self.assertEqual(
+            (rebuilt.product_count, rebuilt.product_price_sum, rebuilt.order_count),
+            (stats.product_count, stats.product_price_sum, stats.order_count),
+        )
+
+    def test_stats_endpoint(self) -> None:
+        response = self.client.get('/api/restaurants/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        row = next(r for r in response.data if r['id'] == self.restaurant.id)
+        self.assertEqual(row['product_count'], 3)
+        self.assertEqual(row['order_count'], 2)
+        self.assertEqual(row['avg_product_price'], Decimal('100.00'))
+
+
+class OrderStatsTest(APITestCase):
+    """Тест 20: order_stats читается из дневных агрегатов, которые совпадают с пересчетом"""
+
+    def setUp(self) -> None:
+        self.owner = User.objects.create_user(username='rest_owner13', password='pass123')
+        self.customer = User.objects.create_user(username='buyer8', password='pass123')
+        self.restaurants = [
+            Restaurant.objects.create(name=f'Ресторан {i}', address='адрес', phone='+79990000000', owner=self.owner)
+            for i in range(2)
+        ]
+        self.orders = [
+            Order.objects.create(
+                customer=self.customer, restaurant=self.restaurants[i % 2],
+                address='ул. Тестовая, д. 1, кв. 1', total_price=Decimal('100.00') * (i + 1)
+            )
+            for i in range(4)
+        ]
+
+    def bucket_values(self) -> list:
+        return sorted(
+            OrderDailyStats.objects.filter(order_count__gt=0)
+            .values_list('date', 'restaurant_id', 'status', 'order_count', 'revenue')
+        )
+
+    def test_status_change_moves_order_between_buckets(self) -> None:
+        order = Order.objects.get(id=self.orders[0].id)
+        order.status = 'completed'
+        order.save()
+        self.orders[1].delete()
+
+        incremental = self.bucket_values()
+        rebuild_order_stats()
+        self.assertEqual(incremental, self.bucket_values())
+
+    def test_order_stats_filters(self) -> None:
+        today = timezone.localdate().isoformat()
+        response = self.client.get('/api/orders/order_stats/', {
+            'date_from': today, 'date_to': today, 'restaurant': self.restaurants[0].id,
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_orders'], 2)
+        self.assertEqual(response.data['total_revenue'], Decimal('400.00'))
+        self.assertEqual(response.data['by_status'][0]['status'], 'pending')
+
+        response = self.client.get('/api/orders/order_stats/', {'date_from': '2024-13-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PopularProductsTest(APITestCase):
+    """Тест 21: Рейтинг популярных продуктов по окнам без отмененных заказов"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.owner = User.objects.create_user(username='rest_owner14', password='pass123')
+        self.customer = User.objects.create_user(username='buyer9', password='pass123')
+        self.restaurants = [
+            Restaurant.objects.create(name=f'Ресторан {i}', address='адрес', phone='+79990000000', owner=self.owner)
+            for i in range(2)
+        ]
+        self.pizza = Product.objects.create(restaurant=self.restaurants[0], name='Пицца', price=Decimal('500.00'))
+        self.soup = Product.objects.create(restaurant=self.restaurants[0], name='Суп', price=Decimal('200.00'))
+        self.roll = Product.objects.create(restaurant=self.restaurants[1], name='Ролл', price=Decimal('300.00'))
+        address = 'ул. Тестовая, д. 1, кв. 1'
+        place_order(self.customer, self.restaurants[0], address, {self.pizza.id: 1, self.soup.id: 3})
+        self.cancelled = place_order(self.customer, self.restaurants[0], address, {self.pizza.id: 5})
+        place_order(self.customer, self.restaurants[1], address, {self.roll.id: 2})
+
+    def sales_values(self) -> list:
+        return sorted(
+            ProductDailySales.objects.filter(quantity__gt=0).values_list('date', 'product_id', 'restaurant_id', 'quantity')
+        )
+
+    def test_cancellation_removes_sales(self) -> None:
+        order = Order.objects.get(id=self.cancelled.id)
+        order.status = 'cancelled'
+        order.save()
+
+        response = self.client.get('/api/products/popular_products/', {'window': '7d'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['name'] for item in response.data], ['Суп', 'Ролл', 'Пицца'])
+        self.assertEqual(response.data[0]['total_ordered'], 3)
+
+        incremental = self.sales_values()
+        rebuild_product_sales()
+        self.assertEqual(incremental, self.sales_values())
+
+    def test_restaurant_filter_and_window(self) -> None:
+        response = self.client.get('/api/products/popular_products/', {'restaurant': self.restaurants[1].id})
+        self.assertEqual([item['name'] for item in response.data], ['Ролл'])
+
+        ProductDailySales.objects.update(date=timezone.localdate() - timedelta(days=3))
+        cache.clear()
+        response = self.client.get('/api/products/popular_products/', {'window': '1d'})
+        self.assertEqual(response.data, [])
+
+        response = self.client.get('/api/products/popular_products/', {'window': '1y'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# ==========================================
+# 9. Страница заказов
+# ==========================================
+
+class OrdersPageTest(TestCase):
+    """Тест 22: Страница заказов — пагинация без N+1, фильтры и потоковый CSV"""
+
+    def setUp(self) -> None:
+        self.staff = User.objects.create_user(username='manager', password='pass123', is_staff=True)
+        owner = User.objects.create_user(username='rest_owner15', password='pass123')
+        self.restaurants = [
+            Restaurant.objects.create(name=f'Ресторан {i}', address='адрес', phone='+79990000000', owner=owner)
+            for i in range(2)
+        ]
+        customers = [User.objects.create_user(username=f'buyer_page{i}', password='pass123') for i in range(3)]
+        for i in range(60):
+            Order.objects.create(
+                customer=customers[i % 3], restaurant=self.restaurants[i % 2],
+                address='ул. Тестовая, д. 1, кв. 1', total_price=Decimal('100.00'),
+                status='completed' if i % 4 == 0 else 'pending',
+            )
+        self.client.force_login(self.staff)
+
+    def test_page_is_paginated_without_per_row_queries(self) -> None:
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('orders'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['orders']), 50)
+        self.assertIsNotNone(response.context['next_page'])
+        order_queries = [sql for sql in app_queries(ctx) if sql.startswith('SELECT') and 'FROM "app_order"' in sql]
+        self.assertEqual(len(order_queries), 1)
+
+        response = self.client.get(response.context['next_page'])
+        self.assertEqual(len(response.context['orders']), 10)
+
+        response = self.client.get(reverse('orders'), {'cursor': 'испорчен'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_filters(self) -> None:
+        today = timezone.localdate().isoformat()
+        response = self.client.get(reverse('orders'), {
+            'status': 'completed', 'restaurant': self.restaurants[0].id, 'date_from': today, 'date_to': today,
+        })
+        self.assertEqual(len(response.context['orders']), 15)
+
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        response = self.client.get(reverse('orders'), {'date_from': tomorrow})
+        self.assertEqual(len(response.context['orders']), 0)
+
+    def test_csv_streams_filtered_range(self) -> None:
+        response = self.client.get(reverse('orders'), {'format': 'csv', 'restaurant': self.restaurants[1].id})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 31)  # заголовок + 30 заказов
+        self.assertIn('Ресторан 1', lines[1])
+
+
+# ==========================================
+# 10. Бюджет SQL-запросов
+# ==========================================
+
+class QueryBudgetTest(APITestCase):
+    """Тест 23: Страницы и API укладываются в объявленный бюджет SQL-запросов"""
+
+    ENDPOINTS = [
+        '/',
+        '/restaurant/{restaurant}/',
+        '/products/',
+        '/orders/',
+        '/order/{order}/',
+        '/cart/',
+        '/api/restaurants/',
+        '/api/products/',
+        '/api/products/popular_products/',
+        '/api/orders/',
+        '/api/orders/{order}/',
+        '/api/orders/order_stats/',
+        '/api/orders/recent_orders/',
+        '/api/orders/my_orders/',
+        '/api/restaurants/stats/',
+        '/api/restaurants/{restaurant}/my_restaurants/',
+    ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='budget_admin', password='pass123')
+        self.restaurants = [
+            Restaurant.objects.create(name=f'Ресторан {i}', address='адрес', phone='+79990000000', owner=self.admin)
+            for i in range(3)
+        ]
+        products = [
+            Product.objects.create(restaurant=restaurant, name=f'Блюдо {i}', price=Decimal('100.00') + i)
+            for restaurant in self.restaurants for i in range(5)
+        ]
+        for i in range(12):
+            place_order(self.admin, self.restaurants[i % 3], 'ул. Тестовая, д. 1, кв. 1', {
+                product.id: 1 for product in products if product.restaurant_id == self.restaurants[i % 3].id
+            })
+        self.order = Order.objects.first()
+        backend = get_cart_backend()
+        for product in products[:5]:
+            backend.add(self.admin.id, product.id)
+        self.client.force_login(self.admin)
+
+    def test_endpoints_within_declared_budget(self) -> None:
+        """Запросы считаются на каждый URL; повторяющийся SQL попадает в сообщение об ошибке"""
+        factory = RequestFactory()
+        for url in self.ENDPOINTS:
+            url = url.format(restaurant=self.restaurants[0].id, order=self.order.id)
+            with self.subTest(url=url):
+                budget = get_view_budget(factory.get(url), resolve(url).func)
+                self.assertIsNotNone(budget, f'{url}: не объявлен @query_budget')
+                cache.clear()  # худший случай: холодный кеш каталога и счетчика корзины
+                with record_queries() as recorder:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(recorder.count, budget, recorder.report(budget, url))
+                self.assertEqual(recorder.duplicates(), [], recorder.report(budget, url))
+
+    def test_custom_list_actions_are_paginated_and_filtered(self) -> None:
+        response = self.client.get('/api/orders/my_orders/', {'restaurant': self.restaurants[1].id})
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(response.data['results']), 4)
+
+        response = self.client.get('/api/orders/recent_orders/')
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_middleware_reports_duplicated_sql(self) -> None:
+        @query_budget(1)
+        def n_plus_one(request):
+            for order in Order.objects.all()[:3]:
+                order.restaurant.name
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        middleware = QueryBudgetMiddleware(
+            lambda req: middleware.process_view(req, n_plus_one, (), {}) or n_plus_one(req)
+        )
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            middleware(request)
+        self.assertIn('x3: SELECT', str(raised.exception))
+
+
+# ==========================================
+# 11. Админ-панель
+# ==========================================
+
+class AdminChangelistQueriesTest(TestCase):
+    """Тест 24: Списки в админке строятся за постоянное число запросов, счетчики сортируются"""
+
+    CHANGELISTS = ['restaurant', 'product', 'courier', 'order', 'orderitem']
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser(username='changelist_admin', password='pass123')
+        self.client.force_login(self.admin)
+
+    def add_rows(self, n: int) -> None:
+        start = Restaurant.objects.count()
+        for i in range(start, start + n):
+            restaurant = Restaurant.objects.create(
+                name=f'Ресторан {i}', address='адрес', phone='+79990000000', owner=self.admin
+            )
+            product = Product.objects.create(restaurant=restaurant, name=f'Блюдо {i}', price=Decimal('100.00'))
+            courier_user = User.objects.create_user(username=f'courier{i}', password='pass123')
+            courier = Courier.objects.create(user=courier_user, phone='+79990000000')
+            order = place_order(self.admin, restaurant, 'ул. Тестовая, д. 1, кв. 1', {product.id: 2})
+            Order.objects.filter(id=order.id).update(courier=courier, status='delivering')
+
+    def changelist_queries(self) -> dict:
+        counts = {}
+        for model in self.CHANGELISTS:
+            with record_queries() as recorder:
+                response = self.client.get(f'/admin/app/{model}/')
+            self.assertEqual(response.status_code, 200)
+            counts[model] = recorder.count
+        return counts
+
+    def test_query_count_does_not_grow_with_rows(self) -> None:
+        self.add_rows(3)
+        few = self.changelist_queries()
+        self.add_rows(12)
+        self.assertEqual(few, self.changelist_queries())
+
+    def test_count_columns_are_sortable(self) -> None:
+        self.add_rows(2)
+        product = Product.objects.first()
+        OrderItem.objects.create(order=Order.objects.first(), product=product, quantity=1, price=product.price)
+        # колонка get_order_count — 4-я в list_display ProductAdmin
+        response = self.client.get('/admin/app/product/', {'o': '-4'})
+        self.assertEqual(response.context['cl'].result_list[0], product)
+        self.assertEqual(response.context['cl'].result_list[0].order_count, 2)
+
+
+class DashboardMetricsTest(TestCase):
+    """Тест 25: Метрики дашборда читаются из кеша и обновляются задачей"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='dashboard_admin', password='pass123')
+        self.restaurant = Restaurant.objects.create(
+            name='Ресторан', address='адрес', phone='+79990000000', owner=self.admin
+        )
+        Order.objects.create(
+            customer=self.admin, restaurant=self.restaurant,
+            address='ул. Тестовая, д. 1, кв. 1', total_price=Decimal('700.00')
+        )
+
+    def test_metrics_served_from_cache_and_refreshed_by_task(self) -> None:
+        metrics = get_dashboard_metrics()
+        self.assertEqual(metrics['orders_count'], 1)
+        self.assertEqual(metrics['today_revenue'], Decimal('700.00'))
+
+        Order.objects.create(
+            customer=self.admin, restaurant=self.restaurant,
+            address='ул. Тестовая, д. 1, кв. 1', total_price=Decimal('300.00')
+        )
+        with record_queries() as recorder:
+            self.assertEqual(get_dashboard_metrics()['orders_count'], 1)
+        self.assertEqual(recorder.count, 0)
+
+        refresh_dashboard_metrics.apply()
+        metrics = get_dashboard_metrics()
+        self.assertEqual(metrics['orders_count'], 2)
+        self.assertEqual(metrics['today_orders'], 2)
+        self.assertEqual(metrics['today_revenue'], Decimal('1000.00'))
+
+    def test_admin_index_uses_cached_metrics(self) -> None:
+        self.client.force_login(self.admin)
+        get_dashboard_metrics()
+        response = self.client.get('/admin/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['orders_count'], 1)
+        self.assertContains(response, 'Заказы сегодня')
+        self.assertContains(response, '700,00 ₽')
+
+    def test_process_local_cache_warns_web_and_stops_celery(self) -> None:
+        from .checks import check_shared_cache, check_shared_cache_on_celery_start
+        self.assertEqual(check_shared_cache(), [])  # в тестах не требуется
+        check_shared_cache_on_celery_start()
+        with self.settings(SHARED_CACHE_REQUIRED=True):
+            warnings = check_shared_cache()
+            self.assertEqual([warning.id for warning in warnings], ['app.W001'])
+            self.assertFalse(warnings[0].is_serious())  # manage.py и runserver работают
+            with self.assertRaises(ImproperlyConfigured):
+                check_shared_cache_on_celery_start()
+            redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                 'LOCATION': 'redis://localhost:6379/2'}}
+            with self.settings(CACHES=redis):
+                self.assertEqual(check_shared_cache(), [])
+                check_shared_cache_on_celery_start()
+
+
+class BackgroundExportTest(TestCase):
+    """Тест 26: Фоновая выгрузка пишет файл порциями одним запросом на порцию"""
+
+    def setUp(self) -> None:
+        self.export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_root)
+        self.admin = User.objects.create_superuser(username='export_admin', password='pass123', email='a@a.ru')
+        self.restaurant = Restaurant.objects.create(
+            name='Выгрузочный', address='адрес', phone='+79990000000', owner=self.admin
+        )
+        for i in range(7):
+            Order.objects.create(
+                customer=self.admin, restaurant=self.restaurant, address='ул. Тестовая, д. 1, кв. 1',
+                total_price=Decimal('100.00') + i, status='completed' if i % 2 else 'pending',
+            )
+
+    def test_task_exports_selected_queryset_to_csv(self) -> None:
+        token = dump_query(Order.objects.filter(status='completed'))
+        with self.settings(EXPORT_ROOT=self.export_root, EXPORT_CHUNK_SIZE=2):
+            with record_queries() as recorder:
+                path = export_data.apply(args=('orders', 'csv', token)).get()
+        self.assertEqual(recorder.count, 1)  # SQLite читает курсор порциями в рамках одного запроса
+
+        with open(path, encoding='utf-8-sig') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0][:3], ['id', 'Клиент', 'Ресторан'])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][1:5], ['export_admin', 'Выгрузочный', 'completed', 'Завершен'])
+
+    def test_xlsx_export(self) -> None:
+        from openpyxl import load_workbook
+
+        with self.settings(EXPORT_ROOT=self.export_root):
+            path = export_to_file('orders', 'xlsx')
+        sheet = load_workbook(path).active
+        self.assertEqual(sheet.max_row, 8)
+        self.assertEqual(sheet.cell(row=2, column=8).value, '100.00 ₽')
+
+    def test_tampered_query_is_rejected(self) -> None:
+        with self.assertRaises(signing.BadSignature):
+            load_query(Order, dump_query(Order.objects.all()) + 'x')
+
+    def test_admin_action_queues_export(self) -> None:
+        self.client.force_login(self.admin)
+        with mock.patch('app.admin.export_data.delay') as delay:
+            self.client.post('/admin/app/order/', {
+                'action': 'export_xlsx_in_background',
+                '_selected_action': [order.id for order in Order.objects.all()[:2]],
+            })
+        kind, fmt, token, user_id = delay.call_args.args
+        self.assertEqual((kind, fmt, user_id), ('orders', 'xlsx', self.admin.id))
+        self.assertEqual(load_query(Order, token).count(), 2)
+
+    def test_email_links_to_staff_download(self) -> None:
+        """Письмо содержит ссылку на скачивание, а не путь на сервере; скачать может только персонал"""
+        with self.settings(EXPORT_ROOT=self.export_root, SITE_URL='https://shop.example'):
+            path = Path(export_data.apply(args=('orders', 'csv', None, self.admin.id)).get())
+            url = f'/exports/{path.name}/'
+            self.assertIn(f'https://shop.example{url}', mail.outbox[0].body)
+            self.assertNotIn(self.export_root, mail.outbox[0].body)
+
+            customer = User.objects.create_user(username='export_customer', password='pass123')
+            self.client.force_login(customer)
+            self.assertEqual(self.client.get(url).status_code, 302)  # на вход в админку
+
+            self.client.force_login(self.admin)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('attachment', response['Content-Disposition'])
+            self.assertTrue(b''.join(response.streaming_content).startswith('\ufeffid'.encode()))
+            self.assertEqual(self.client.get('/exports/..%2Fsecret.csv/').status_code, 404)
+            self.assertEqual(self.client.get('/exports/orders-1.csv/').status_code, 404)
+
+
+# ==========================================
+# 12. Поиск
+# ==========================================
+
+class ProductSearchTest(APITestCase):
+    """Тест 27: Полнотекстовый поиск продуктов со стеммингом и ранжированием"""
+
+    def setUp(self) -> None:
+        owner = User.objects.create_user(username='search_owner', password='pass123')
+        restaurant = Restaurant.objects.create(name='Поисковый', address='адрес', phone='+79990000000', owner=owner)
+        self.margherita = Product.objects.create(
+            restaurant=restaurant, name='Пицца Маргарита', description='Томаты и моцарелла', price=Decimal('500.00')
+        )
+        self.calzone = Product.objects.create(
+            restaurant=restaurant, name='Кальцоне', description='Закрытая пицца с ветчиной', price=Decimal('600.00')
+        )
+        Product.objects.create(restaurant=restaurant, name='Борщ', description='Со сметаной', price=Decimal('300.00'))
+        get_search_backend().rebuild()
+
+    def assert_backend_ranks(self, backend) -> None:
+        ids = [product_id for product_id, _ in backend.search('пиццы')]
+        self.assertEqual(ids, [self.margherita.id, self.calzone.id])  # совпадение в названии выше
+        self.assertEqual([pid for pid, _ in backend.search('пицца ветчин')], [self.calzone.id])
+        self.assertEqual([pid for pid, _ in backend.search('марг')], [self.margherita.id])  # префикс
+        self.assertEqual(backend.search('суши'), [])
+
+    def test_analyzer_stems_russian_endings(self) -> None:
+        self.assertEqual(analyze('Пиццы с Ветчиной, ёжик'), ['пицц', 'с', 'ветчин', 'ежик'])
+
+    def test_in_memory_backend(self) -> None:
+        self.assert_backend_ranks(get_search_backend())
+
+    def test_sqlite_fts_backend_follows_changes(self) -> None:
+        backend = SQLiteFTSBackend()
+        backend.rebuild()
+        self.assert_backend_ranks(backend)
+
+        self.calzone.name = 'Кальцоне с грибами'
+        self.calzone.save()
+        backend.index(self.calzone)
+        self.assertEqual([pid for pid, _ in backend.search('грибы')], [self.calzone.id])
+        backend.remove(self.calzone.id)
+        self.assertEqual(backend.search('грибы'), [])
+
+    def test_signals_keep_index_in_sync(self) -> None:
+        product = Product.objects.create(
+            restaurant=self.margherita.restaurant, name='Суши', description='Рис', price=Decimal('400.00')
+        )
+        self.assertEqual([pid for pid, _ in search_products('суши')], [product.id])
+        product.delete()
+        self.assertEqual(search_products('суши'), [])
+
+    def test_search_action(self) -> None:
+        response = self.client.get('/api/products/search/', {'q': 'пицца'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['name'] for item in response.data], ['Пицца Маргарита', 'Кальцоне'])
+        self.assertGreater(response.data[0]['score'], response.data[1]['score'])
+
+        response = self.client.get('/api/products/search/', {'q': ' '})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_limit_applies_to_visible_products(self) -> None:
+        """limit считается среди продуктов владельца, а не всех ресторанов"""
+        for i in range(3):
+            other = User.objects.create_user(username=f'search_rival{i}', password='pass123')
+            rival = Restaurant.objects.create(name=f'Конкурент {i}', address='адрес', phone='+79990000000', owner=other)
+            Product.objects.create(restaurant=rival, name='Пицца пицца', description='Пицца', price=Decimal('450.00'))
+        self.client.force_authenticate(self.calzone.restaurant.owner)
+
+        for backend in (get_search_backend(), SQLiteFTSBackend()):
+            backend.rebuild()
+            within = Product.objects.filter(restaurant=self.calzone.restaurant)
+            self.assertEqual([pid for pid, _ in backend.search('пицца', 1, within)], [self.margherita.id])
+        response = self.client.get('/api/products/search/', {'q': 'пицца', 'limit': 1})
+        self.assertEqual([item['name'] for item in response.data], ['Пицца Маргарита'])
+
+
+class AutocompleteTest(APITestCase):
+    """Тест 28: Автодополнение по префиксу и с опечатками без запросов к БД"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        owner = User.objects.create_user(username='autocomplete_owner', password='pass123')
+        self.pizzeria = Restaurant.objects.create(
+            name='Пиццерия Наполи', address='адрес', phone='+79990000000', owner=owner
+        )
+        self.pizza = Product.objects.create(restaurant=self.pizzeria, name='Пицца Пепперони', price=Decimal('500'))
+        Product.objects.create(restaurant=self.pizzeria, name='Паста Карбонара', price=Decimal('400'))
+        autocomplete_index.rebuild()
+
+    def names(self, query: str, **params) -> list:
+        return [item['name'] for item in autocomplete_index.search(query, **params)]
+
+    def test_prefix_and_typos(self) -> None:
+        self.assertEqual(self.names('пиц'), ['Пицца Пепперони', 'Пиццерия Наполи'])
+        self.assertEqual(self.names('пица'), ['Пицца Пепперони', 'Пиццерия Наполи'])  # опечатка
+        self.assertEqual(self.names('карбанара'), ['Паста Карбонара'])
+        self.assertEqual(self.names('пиц', kind='restaurant'), ['Пиццерия Наполи'])
+        self.assertEqual(self.names('суши'), [])
+
+    def test_signals_update_index_without_rebuild(self) -> None:
+        self.pizza.name = 'Кальцоне'
+        self.pizza.save()
+        with record_queries() as recorder:
+            self.assertEqual(self.names('кальц'), ['Кальцоне'])
+            self.assertEqual(self.names('пепперони'), [])
+        self.assertEqual(recorder.count, 0)
+
+        self.pizzeria.delete()
+        self.assertEqual(self.names('кальц'), [])
+
+    def test_rebuilds_after_change_in_another_process(self) -> None:
+        Product.objects.filter(id=self.pizza.id).update(name='Лазанья')  # без сигналов
+        bump_catalogue_version()
+        self.assertEqual(self.names('лазан'), ['Лазанья'])
+
+    def test_endpoint(self) -> None:
+        response = self.client.get('/api/autocomplete/', {'q': 'пеперони', 'limit': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['type'], 'product')
+        self.assertEqual(response.data[0]['id'], self.pizza.id)
+
+        response = self.client.get('/api/autocomplete/', {'q': 'пиц', 'type': 'courier'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# ==========================================
+# 13. Массовая загрузка меню
+# ==========================================
+
+class ProductBulkUpsertTest(APITestCase):
+    """Тест 29: Загрузка меню пачкой — постоянное число запросов, история и ошибки по строкам"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.owner = User.objects.create_user(username='menu_owner', password='pass123')
+        other = User.objects.create_user(username='other_owner', password='pass123')
+        self.restaurant = Restaurant.objects.create(name='Меню', address='адрес', phone='+79990000000', owner=self.owner)
+        self.foreign = Restaurant.objects.create(name='Чужой', address='адрес', phone='+79990000001', owner=other)
+        self.soup = Product.objects.create(
+            restaurant=self.restaurant, name='Суп', description='Старый', price=Decimal('100.00')
+        )
+        self.client.force_authenticate(user=self.owner)
+
+    def test_patch_rename_to_existing_name(self) -> None:
+        salad = Product.objects.create(restaurant=self.restaurant, name='Салат', price=Decimal('90.00'))
+        response = self.client.patch(f'/api/products/{salad.id}/', {'name': 'Суп'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)  # без ресторана в теле — не 500
+        self.assertIn('name', response.data)
+        response = self.client.patch(f'/api/products/{salad.id}/', {'name': 'Салат'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)  # свое название
+
+    def rows(self, count: int, prefix: str = 'Блюдо') -> list[dict]:
+        return [
+            {'restaurant': self.restaurant.id, 'name': f'{prefix} {i}', 'description': 'Описание', 'price': '250.00'}
+            for i in range(count)
+        ]
+
+    def test_creates_and_updates_with_history(self) -> None:
+        rows = self.rows(2) + [{'restaurant': self.restaurant.id, 'name': 'Суп', 'price': '150.00'}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/products/bulk_upsert/', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['created']), 2)
+        self.assertEqual(response.data['updated'], [self.soup.id])
+
+        self.soup.refresh_from_db()
+        self.assertEqual(self.soup.price, Decimal('150.00'))
+        self.assertEqual(self.soup.history.first().history_type, '~')
+        self.assertEqual(self.soup.history.first().history_user, self.owner)
+        created = Product.objects.get(name='Блюдо 0')
+        self.assertEqual(created.history.get().history_type, '+')
+
+        stats = RestaurantStats.objects.get(restaurant=self.restaurant)
+        self.assertEqual(stats.product_count, 3)
+        self.assertEqual(stats.product_price_sum, Decimal('650.00'))
+        self.assertEqual([pid for pid, _ in search_products('блюдо')], sorted(response.data['created']))
+
+    def test_queries_are_batched(self) -> None:
+        counts = []
+        for size, prefix in ((5, 'Малое'), (MAX_IMPORT_ROWS, 'Большое')):
+            with record_queries() as recorder:
+                response = self.client.post('/api/products/bulk_upsert/', self.rows(size, prefix), format='json')
+            self.assertEqual(len(response.data['created']), size)
+            counts.append(recorder.count)
+        # Запросы на пачку, а не на строку (SQLite режет INSERT по лимиту в 999 параметров)
+        self.assertEqual(counts[0], 8)
+        self.assertLess(counts[1], 25)
+
+    def test_reports_row_errors(self) -> None:
+        rows = self.rows(1) + [
+            {'restaurant': self.restaurant.id, 'name': 'Блюдо 0', 'price': '300.00'},  # дубль в загрузке
+            {'restaurant': self.restaurant.id, 'name': 'Без цены'},
+            {'restaurant': self.restaurant.id, 'name': 'Дорогое', 'price': '200000'},
+            {'restaurant': self.foreign.id, 'name': 'Чужое', 'price': '100.00'},
+        ]
+        response = self.client.post('/api/products/bulk_upsert/', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['created']), 1)
+        errors = {error['index']: set(error['errors']) for error in response.data['errors']}
+        self.assertEqual(errors, {1: {'name'}, 2: {'price'}, 3: {'price'}, 4: {'restaurant'}})
+        self.assertFalse(Product.objects.filter(restaurant=self.foreign).exists())
+
+        response = self.client.post('/api/products/bulk_upsert/', rows[2:], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=None)
+        response = self.client.post('/api/products/bulk_upsert/', self.rows(1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BulkPriceChangeTest(APITestCase):
+    """Тест 30: Массовое изменение цен — один UPDATE, история, округление и предпросмотр"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.owner = User.objects.create_user(username='price_owner', password='pass123')
+        self.restaurant = Restaurant.objects.create(name='Цены', address='адрес', phone='+79990000000', owner=self.owner)
+        other = Restaurant.objects.create(name='Другой', address='адрес', phone='+79990000001', owner=self.owner)
+        self.products = [
+            Product.objects.create(restaurant=self.restaurant, name=f'Блюдо {i}', description='', price=price)
+            for i, price in enumerate([Decimal('99.90'), Decimal('250.00'), Decimal('333.33')])
+        ]
+        self.other = Product.objects.create(restaurant=other, name='Чужое', description='', price=Decimal('100.00'))
+        self.client.force_authenticate(user=self.owner)
+
+    def prices(self) -> list[Decimal]:
+        return [Product.objects.get(id=product.id).price for product in self.products]
+
+    def test_rules_and_rounding(self) -> None:
+        queryset = Product.objects.filter(restaurant=self.restaurant)
+        apply_price_change(queryset, PriceChange(mode='percent', value=Decimal('-10')))
+        self.assertEqual(self.prices(), [Decimal('89.91'), Decimal('225.00'), Decimal('300.00')])
+        apply_price_change(queryset, PriceChange(mode='absolute', value=Decimal('4.5'), round_to=Decimal('10')))
+        self.assertEqual(self.prices(), [Decimal('90.00'), Decimal('230.00'), Decimal('300.00')])
+        result = apply_price_change(queryset, PriceChange(mode='absolute', value=Decimal('-100')))
+        self.assertEqual(result.skipped, [self.products[0].id])  # цена стала бы 0 — не обрезается, а пропускается
+        self.assertEqual(self.prices(), [Decimal('90.00'), Decimal('130.00'), Decimal('200.00')])
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.price, Decimal('100.00'))
+
+    def test_single_update_with_history_and_stats(self) -> None:
+        change = PriceChange(mode='percent', value=Decimal('20'))
+        with record_queries() as recorder, self.captureOnCommitCallbacks(execute=True):
+            result = apply_price_change(Product.objects.filter(price__lt=300), change, self.owner)
+        self.assertEqual(result.updated, 3)  # фильтр по цене зафиксирован до UPDATE
+        self.assertEqual(len([sql for sql in recorder.queries if sql.startswith('UPDATE "app_product"')]), 1)
+
+        history = self.products[0].history.first()
+        self.assertEqual((history.history_type, history.price), ('~', Decimal('119.88')))
+        self.assertEqual(history.history_user, self.owner)
+        self.assertEqual(history.history_change_reason, change.describe())
+        stats = RestaurantStats.objects.get(restaurant=self.restaurant)
+        self.assertEqual(stats.product_price_sum, sum(self.prices()))
+
+    def test_dry_run_matches_result(self) -> None:
+        data = {'mode': 'percent', 'value': '-15', 'round_to': '0.5', 'restaurant': self.restaurant.id}
+        response = self.client.post('/api/products/bulk_price/', {**data, 'dry_run': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(self.prices()[1], Decimal('250.00'))  # ничего не изменилось
+        preview = {item['id']: item['new_price'] for item in response.data['products']}
+        total_after = response.data['total_after']
+
+        response = self.client.post('/api/products/bulk_price/', data, format='json')
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(self.prices(), [preview[product.id] for product in self.products])
+        self.assertEqual(sum(self.prices()), total_after)
+
+    def test_out_of_bounds_prices_are_listed_not_clamped(self) -> None:
+        data = {'mode': 'absolute', 'value': '-200', 'restaurant': self.restaurant.id, 'dry_run': True}
+        response = self.client.post('/api/products/bulk_price/', data, format='json')
+        self.assertEqual((response.data['count'], response.data['skipped_count']), (2, 1))
+        self.assertEqual(response.data['skipped'][0]['id'], self.products[0].id)
+        self.assertEqual(response.data['skipped'][0]['new_price'], Decimal('-100.10'))
+        self.assertEqual(response.data['total_after'], Decimal('183.33'))
+
+        response = self.client.post('/api/products/bulk_price/', {**data, 'dry_run': False}, format='json')
+        self.assertEqual((response.data['updated'], response.data['skipped']), (2, [self.products[0].id]))
+        self.assertEqual(self.prices()[0], Decimal('99.90'))
+
+    def test_validation(self) -> None:
+        for data in ({'mode': 'percent', 'value': '-100'}, {'mode': 'round'}, {'mode': 'absolute'}, {'mode': 'x'}):
+            response = self.client.post('/api/products/bulk_price/', data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post('/api/products/bulk_discount/', {
+            'restaurant_id': self.restaurant.id, 'discount_percent': 50,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.prices()[1], Decimal('125.00'))
+
+        # 100% принимается, как и раньше, но нулевые цены не сохраняются
+        response = self.client.post('/api/products/bulk_discount/', {
+            'restaurant_id': self.restaurant.id, 'discount_percent': 100,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['skipped']), 3)
+        self.assertEqual(self.prices()[1], Decimal('125.00'))
+        response = self.client.post('/api/products/bulk_discount/', {
+            'restaurant_id': self.restaurant.id, 'discount_percent': 101,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# ==========================================
+# 14. Статусы заказов
+# ==========================================
+
+class OrderStatusTransitionTest(APITestCase):
+    """Тест 31: Смена статуса — условный UPDATE, конфликты вместо потерянных обновлений"""
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser(username='status_admin', password='pass123')
+        restaurant = Restaurant.objects.create(name='Статусы', address='адрес', phone='+79990000000', owner=self.admin)
+        self.pizza = Product.objects.create(restaurant=restaurant, name='Пицца', price=Decimal('500.00'))
+        self.order = place_order(self.admin, restaurant, 'ул. Тестовая, д. 1, кв. 1', {self.pizza.id: 2})
+        self.client.force_authenticate(user=self.admin)
+
+    def buckets(self) -> dict:
+        return dict(OrderDailyStats.objects.filter(order_count__gt=0).values_list('status', 'order_count'))
+
+    @mock.patch('app.viewsets.schedule_status_notifications')
+    def test_transition_via_api(self, schedule) -> None:
+        url = f'/api/orders/{self.order.id}/change_status/'
+        with record_queries() as recorder:
+            response = self.client.post(url, {'status': 'preparing'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'preparing')
+        schedule.assert_called_once_with([self.order.id])
+
+        updates = [sql for sql in recorder.queries if sql.startswith('UPDATE "app_order"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"status" = %s', updates[0])
+        self.assertNotIn('"address"', updates[0])  # остальные колонки не перезаписываются
+        self.assertEqual(self.buckets(), {'preparing': 1})
+        history = Order.objects.get(id=self.order.id).history.first()
+        self.assertEqual((history.status, history.history_type, history.history_user), ('preparing', '~', self.admin))
+
+        response = self.client.post(url, {'status': 'pending'}, format='json')  # назад нельзя
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Повторная отправка со старым статусом (второе устройство, двойной клик)
+        response = self.client.post(url, {'status': 'preparing', 'expected_status': 'pending'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['status'], 'preparing')
+
+    def test_concurrent_change_is_a_conflict(self) -> None:
+        kitchen = Order.objects.get(id=self.order.id)
+        courier = Order.objects.get(id=self.order.id)
+        change_order_status(kitchen, 'cancelled')
+        with self.assertRaises(TransitionConflict) as ctx:
+            change_order_status(courier, 'preparing')  # видел pending, а заказ уже отменен
+        self.assertEqual(ctx.exception.current_status, 'cancelled')
+        self.assertEqual(Order.objects.get(id=self.order.id).status, 'cancelled')
+
+        with self.assertRaises(TransitionError):
+            change_order_status(kitchen, 'completed')
+        self.assertEqual(self.buckets(), {'cancelled': 1})
+        self.assertFalse(ProductDailySales.objects.filter(quantity__gt=0).exists())  # отмена снята с рейтинга
+
+        kitchen.address = 'ул. Новая, д. 2, кв. 3'
+        kitchen.save()  # после перехода сигналы видят актуальное состояние
+        self.assertEqual(self.buckets(), {'cancelled': 1})
+
+    def test_refresh_from_db_resets_stats_snapshot(self) -> None:
+        other = Order.objects.get(id=self.order.id)
+        change_order_status(self.order, 'cancelled')
+        other.refresh_from_db()  # другой экземпляр узнает о переходе из БД
+        other.address = 'ул. Новая, д. 2, кв. 3'
+        other.save()
+        self.assertEqual(self.buckets(), {'cancelled': 1})
+        self.assertEqual(ProductDailySales.objects.get().quantity, 0)
+
+        stale = Order.objects.get(id=self.order.id)
+        other.total_price = Decimal('700.00')
+        other.save()
+        stale.refresh_from_db(fields=['total_price'])  # частичное обновление снимка
+        stale.save()
+        self.assertEqual(OrderDailyStats.objects.get(status='cancelled').revenue, Decimal('700.00'))
+
+
+class BulkOrderStatusTest(APITestCase):
+    """Тест 32: Массовая смена статусов — UPDATE на исходный статус, история и уведомления пачкой"""
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser(username='bulk_admin', password='pass123', email='a@example.com')
+        restaurant = Restaurant.objects.create(name='Кухня', address='адрес', phone='+79990000000', owner=self.admin)
+        self.pizza = Product.objects.create(restaurant=restaurant, name='Пицца', price=Decimal('500.00'))
+        self.orders = [
+            place_order(self.admin, restaurant, 'ул. Тестовая, д. 1, кв. 1', {self.pizza.id: 1}) for _ in range(4)
+        ]
+        change_order_status(self.orders[3], 'preparing')
+        self.done = Order.objects.create(
+            customer=self.admin, restaurant=restaurant, address='ул. Тестовая, д. 1, кв. 1', status='completed'
+        )
+        self.client.force_authenticate(user=self.admin)
+
+    def buckets(self) -> dict:
+        return dict(OrderDailyStats.objects.filter(order_count__gt=0).values_list('status', 'order_count'))
+
+    @mock.patch('app.order_notifications._schedule')
+    def test_api_action(self, schedule) -> None:
+        ids = [order.id for order in self.orders] + [self.done.id, 999999]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/orders/bulk_change_status/', {'ids': ids, 'status': 'cancelled'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['changed'], ids[:4])
+        self.assertEqual(response.data['skipped'], {self.done.id: 'completed', 999999: None})
+        schedule.assert_called_once_with(ids[:4])
+
+        self.assertEqual(self.buckets(), {'cancelled': 4, 'completed': 1})
+        self.assertFalse(ProductDailySales.objects.filter(quantity__gt=0).exists())
+        history = Order.history.filter(id__in=ids[:4], status='cancelled')
+        self.assertEqual(history.filter(history_type='~', history_user=self.admin).count(), 4)
+
+        response = self.client.post('/api/orders/bulk_change_status/', {'ids': [], 'status': 'ready'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_one_update_per_source_status(self) -> None:
+        with record_queries() as recorder:
+            result = change_orders_status(Order.objects.all(), 'cancelled')
+        self.assertEqual(len(result.changed), 4)
+        updates = [sql for sql in recorder.queries if sql.startswith('UPDATE "app_order" ')]
+        self.assertEqual(len(updates), 2)  # pending и preparing
+
+        incremental = self.buckets()
+        rebuild_order_stats()
+        self.assertEqual(incremental, self.buckets())
+
+    def test_admin_action_and_batched_notification(self) -> None:
+        self.client.force_login(self.admin)
+        with mock.patch('app.order_notifications._schedule') as schedule, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/app/order/', {
+                'action': 'set_status_preparing', '_selected_action': [order.id for order in self.orders],
+            })
+        self.assertEqual(sorted(schedule.call_args.args[0]), [order.id for order in self.orders[:3]])
+        changes = [(order.id, 'preparing') for order in self.orders[:3]]
+
+        result = notify_order_status_changes(changes)
+        self.assertEqual(result, 'Передано на отправку 3 уведомлений о смене статуса')
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('Готовится', mail.outbox[0].body)
+
+
+class OrderEventsTest(TestCase):
+    """Тест 33: Статусы заказов приходят событиями (SSE и WebSocket) вместо опроса API"""
+
+    def setUp(self) -> None:
+        self.customer = User.objects.create_user(username='watcher', password='pass123')
+        restaurant = Restaurant.objects.create(name='Поток', address='адрес', phone='+79990000000', owner=self.customer)
+        pizza = Product.objects.create(restaurant=restaurant, name='Пицца', price=Decimal('500.00'))
+        with mock.patch.object(InProcessEventBackend, 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.order = place_order(self.customer, restaurant, 'ул. Тестовая, д. 1, кв. 1', {pizza.id: 1})
+        self.assertEqual(publish.call_args.args[0][0]['status'], 'pending')  # оформление публикует событие
+
+    def preparing_event(self) -> dict:
+        self.order.status = 'preparing'
+        return order_event(self.order)
+
+    def test_status_change_is_published_after_commit(self) -> None:
+        with mock.patch.object(InProcessEventBackend, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                change_order_status(self.order, 'preparing')
+            publish.assert_not_called()  # до коммита подписчики ничего не видят
+            callbacks[0]()
+        event = publish.call_args.args[0][0]
+        self.assertEqual((event['order_id'], event['status'], event['status_display']),
+                         (self.order.id, 'preparing', 'Готовится'))
+
+    async def test_broker_dispatches_from_other_threads(self) -> None:
+        subscription = broker.subscribe([f'user:{self.customer.id}'])
+        try:
+            thread = threading.Thread(target=broker.dispatch, args=(self.preparing_event(),))
+            thread.start()
+            event = await subscription.get(timeout=1)
+            self.assertEqual(event['status'], 'preparing')
+            self.assertIsNone(await subscription.get(timeout=0.01))
+        finally:
+            broker.unsubscribe(subscription)
+
+    async def test_server_sent_events(self) -> None:
+        client = AsyncClient()
+        response = await client.get(f'/order/{self.order.id}/events/')
+        self.assertEqual(response.status_code, 401)
+
+        await client.aforce_login(self.customer)
+        response = await client.get(f'/order/{self.order.id}/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = aiter(response.streaming_content)
+        self.assertIn('"status": "pending"', (await anext(content)).decode())  # текущий статус сразу
+        broker.dispatch(self.preparing_event())
+        chunk = (await anext(content)).decode()
+        self.assertTrue(chunk.startswith('event: status\ndata: '))
+        self.assertEqual(json.loads(chunk.split('data: ', 1)[1])['status'], 'preparing')
+        await content.aclose()
+
+        response = await client.get('/order/999999/events/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_websocket(self) -> None:
+        client = AsyncClient()
+        await client.aforce_login(self.customer)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+        async def connect(path: str, headers: list) -> tuple[asyncio.Queue, asyncio.Queue, asyncio.Task]:
+            incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+            await incoming.put({'type': 'websocket.connect'})
+            scope = {'type': 'websocket', 'path': path, 'headers': headers}
+            return incoming, outgoing, asyncio.ensure_future(websocket_application(scope, incoming.get, outgoing.put))
+
+        incoming, outgoing, task = await connect('/ws/orders/', [(b'cookie', cookie.encode())])
+        self.assertEqual((await outgoing.get())['type'], 'websocket.accept')
+        self.assertEqual(json.loads((await outgoing.get())['text'])['status'], 'pending')
+        broker.dispatch(self.preparing_event())
+        self.assertEqual(json.loads((await outgoing.get())['text'])['status'], 'preparing')
+        await incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(task, 1)
+        self.assertEqual(broker.dispatch(self.preparing_event()), 0)  # подписка снята
+
+        _, outgoing, task = await connect(f'/ws/orders/{self.order.id}/', [])  # без сессии
+        self.assertEqual(await outgoing.get(), {'type': 'websocket.close', 'code': 4403})
+        await task
+
+
+# ========================================
+# Доставка писем пачками
+# ========================================
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self) -> None:
+        server = self.server
+        server.connections += 1
+        self.reply('220 localhost')
+        lines = None  # строки письма после DATA
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if lines is not None:
+                if line != '.':
+                    lines.append(line)
+                    continue
+                if server.fail_next:
+                    server.fail_next -= 1
+                    self.reply('421 Service not available')
+                    return
+                server.messages.append('\n'.join(lines))
+                lines = None
+                self.reply('250 OK')
+                continue
+            command = line[:4].upper()
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == 'DATA':
+                lines = []
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:  # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Минимальный SMTP-сервер вместо Mailhog: считает соединения и принятые письма"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        super().__init__(('127.0.0.1', 0), SMTPStandInHandler)
+        self.connections = 0
+        self.messages: list[str] = []
+        self.fail_next = 0  # ответить 421 на столько писем подряд
+
+
+class MailDeliveryTest(TestCase):
+    """Тест 34: Письма из задач уходят пачками по одному SMTP-соединению с повторами"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.server = SMTPStandIn()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        smtp = self.settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server.server_address[1],
+            EMAIL_USE_TLS=False, EMAIL_HOST_USER='', MAIL_RETRY_BACKOFF=0,
+        )
+        smtp.enable()
+        self.addCleanup(smtp.disable)
+        self.outbox = MailOutbox()
+        self.addCleanup(self.outbox.close)
+
+    def messages(self, count: int) -> list:
+        return [mail.EmailMessage(f'Письмо {i}', 'Текст', to=[f'user{i}@test.com']) for i in range(count)]
+
+    def test_batch_reuses_one_connection(self) -> None:
+        with self.settings(MAIL_FLUSH_INTERVAL=60, MAIL_BATCH_SIZE=5):
+            self.outbox.add(self.messages(3))
+            self.assertEqual(self.server.messages, [])  # неполная пачка ждет
+            self.outbox.add(self.messages(4))  # 7 >= 5 — отправка
+        self.assertEqual(len(self.server.messages), 7)
+        self.outbox.add(self.messages(2))  # следующие письма — по тому же соединению
+        self.assertEqual(len(self.server.messages), 9)
+        self.assertEqual(self.server.connections, 1)
+
+        metrics = get_mail_metrics()
+        self.assertEqual((metrics['sent'], metrics['failed'], metrics['connections']), (9, 0, 1))
+        self.assertEqual(metrics['batches'], 3)
+
+        admin_user = User.objects.create_superuser(username='mail_admin', password='pass123')
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/')
+        self.assertEqual(response.context['mail_metrics']['sent'], 9)
+        self.assertContains(response, 'ошибок: 0, повторов: 0')
+
+    def test_transient_error_is_retried(self) -> None:
+        self.server.fail_next = 1
+        self.outbox.add(self.messages(3))
+        self.assertEqual(len(self.server.messages), 3)  # письмо повторено, без дублей
+        self.assertEqual(self.server.connections, 2)
+        metrics = get_mail_metrics()
+        self.assertEqual((metrics['sent'], metrics['retries'], metrics['failed']), (3, 1, 0))
+
+    @mock.patch('app.tasks.resend_emails.apply_async')
+    def test_unavailable_server_hands_messages_to_celery(self, apply_async) -> None:
+        """Сервер недоступен: письма не теряются и не ждут в потоке, а уходят в resend_emails"""
+        self.server.fail_next = 10
+        with self.assertLogs('app.mail', 'WARNING'):
+            self.outbox.add(self.messages(3))
+        self.assertEqual(self.server.fail_next, 8)  # одна попытка и одно переподключение
+        args = apply_async.call_args.kwargs['args'][0]
+        self.assertEqual([subject for subject, *_ in args], ['Письмо 0', 'Письмо 1', 'Письмо 2'])
+        self.assertEqual(get_mail_metrics()['failed'], 0)
+
+        # Повтор из задачи: сервер ожил — письма отправлены без дублей
+        self.server.fail_next = 0
+        with mock.patch('app.mail.outbox', self.outbox):
+            self.assertEqual(resend_emails.apply(args=[args]).get(), 'Повторно отправлено 3 писем')
+        self.assertEqual(len(self.server.messages), 3)
+
+    def test_resend_fails_after_max_retries(self) -> None:
+        self.server.fail_next = 100
+        messages = dump_messages(self.messages(2))
+        with self.settings(MAIL_MAX_RETRIES=2), mock.patch('app.mail.outbox', self.outbox):
+            result = resend_emails.apply(args=[messages])
+        self.assertTrue(result.failed())  # не успех, если письма так и не ушли
+        self.assertIsInstance(result.result, MailDeliveryError)
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(get_mail_metrics()['failed'], 2)
+
+    def test_error_classification(self) -> None:
+        self.assertTrue(is_transient(smtplib.SMTPServerDisconnected()))
+        self.assertTrue(is_transient(smtplib.SMTPDataError(421, 'try later')))
+        self.assertTrue(is_transient(ConnectionRefusedError()))
+        self.assertFalse(is_transient(smtplib.SMTPDataError(554, 'rejected')))
+        self.assertFalse(is_transient(smtplib.SMTPNotSupportedError('SMTPUTF8 not supported')))
+        self.assertFalse(is_transient(smtplib.SMTPRecipientsRefused({'a@test.com': (550, b'no user')})))
+
+    def test_tasks_deliver_through_outbox(self) -> None:
+        customer = User.objects.create_user('mailer', email='mailer@test.com', password='pass')
+        restaurant = Restaurant.objects.create(name='Почта', address='адрес', phone='+79990000000', owner=customer)
+        orders = [
+            Order.objects.create(customer=customer, restaurant=restaurant, address='ул. Ленина, д. 10, кв. 5')
+            for _ in range(3)
+        ]
+        with mock.patch('app.mail.outbox', self.outbox):
+            notify_order_status_changes([[order.id, 'ready'] for order in orders])
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.connections, 1)
+
+
+class StatusNotificationCoalescingTest(APITestCase):
+    """Тест 35: Смены статуса в пределах окна дают одну задачу и одно письмо о последнем статусе"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='notify_admin', password='pass123', email='n@example.com')
+        restaurant = Restaurant.objects.create(name='Окно', address='адрес', phone='+79990000000', owner=self.admin)
+        pizza = Product.objects.create(restaurant=restaurant, name='Пицца', price=Decimal('500.00'))
+        self.order = place_order(self.admin, restaurant, 'ул. Тестовая, д. 1, кв. 1', {pizza.id: 1})
+        self.client.force_authenticate(user=self.admin)
+
+    @mock.patch('app.tasks.flush_order_status_notifications.apply_async')
+    def test_transitions_within_window_are_coalesced(self, apply_async) -> None:
+        url = f'/api/orders/{self.order.id}/change_status/'
+        for new_status in ('preparing', 'ready', 'delivering'):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url, {'status': new_status}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        apply_async.assert_called_once_with(args=[[self.order.id]], countdown=settings.ORDER_NOTIFY_WINDOW)
+
+        result = flush_order_status_notifications([self.order.id])
+        self.assertEqual(result, 'Передано на отправку 1 уведомлений о смене статуса')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Доставляется', mail.outbox[0].body)  # только последний статус
+
+        # Задача, поставленная параллельно до снятия метки, не шлет тот же статус повторно
+        self.assertEqual(flush_order_status_notifications([self.order.id]), 'Новых статусов для уведомления нет')
+        self.assertEqual(len(mail.outbox), 1)
+
+        # После отправки окно начинается заново
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'status': 'completed'}, format='json')
+        self.assertEqual(apply_async.call_count, 2)
+
+    @mock.patch('app.tasks.flush_order_status_notifications.apply_async')
+    def test_web_and_worker_with_separate_caches(self, apply_async) -> None:
+        """Метки в БД: воркер с другим (локальным) кешем снимает метку, поставленную веб-процессом"""
+        def process_cache(name: str):
+            return self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': name,
+            }})
+
+        url = f'/api/orders/{self.order.id}/change_status/'
+        with process_cache('web'):
+            for new_status in ('preparing', 'ready'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(url, {'status': new_status}, format='json')
+        self.assertEqual(apply_async.call_count, 1)
+
+        with process_cache('worker'):
+            flush_order_status_notifications([self.order.id])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Готов', mail.outbox[0].body)
+
+        with process_cache('web'), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'status': 'delivering'}, format='json')
+        self.assertEqual(apply_async.call_count, 2)  # финальный статус не теряется
+
+    @mock.patch('app.tasks.flush_order_status_notifications.apply_async')
+    def test_scheduled_only_after_commit(self, apply_async) -> None:
+        with self.captureOnCommitCallbacks() as callbacks:
+            schedule_status_notifications([self.order.id])
+        apply_async.assert_not_called()
+        callbacks[0]()
+        apply_async.assert_called_once()
+
+
+class StatementTimeoutMiddlewareTest(TestCase):
+    """Тест 36: statement_timeout включается только на время HTTP-запроса"""
+
+    def test_timeout_scoped_to_request(self) -> None:
+        from .middleware import StatementTimeoutMiddleware
+        from django.core.exceptions import MiddlewareNotUsed
+
+        with self.assertRaises(MiddlewareNotUsed):  # SQLite
+            StatementTimeoutMiddleware(lambda request: HttpResponse())
+
+        executed = []
+        with mock.patch('app.middleware.connection') as db:
+            db.vendor = 'postgresql'
+            db.cursor.return_value.__enter__.return_value.execute.side_effect = (
+                lambda sql, params=None: executed.append(sql)
+            )
+            middleware = StatementTimeoutMiddleware(lambda request: executed.append('view') or HttpResponse())
+            middleware(RequestFactory().get('/'))
+        self.assertEqual(executed, ['SET statement_timeout = %s', 'view', 'RESET statement_timeout'])
@@ -1,81 +1,164 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth import login, authenticate
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpRequest, HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse, Http404, HttpRequest, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+)
 from django.views.decorators.http import require_POST
 from django.db import transaction
 from django.core.mail import send_mail
 from django.conf import settings
-from decimal import Decimal
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+import csv
 import requests
+from typing import Optional
 
-from .models import Restaurant, Product, Order, OrderItem
+from .models import Restaurant, Product, Order
 from .forms import RegisterForm, LoginForm, OrderForm, ProductForm
 from .tasks import send_order_confirmation_email
-
-
+from .cart import price_cart, place_order
+from .cart_backends import get_cart_backend
+from .cache import cache_catalogue_page, catalogue_context, get_restaurant_menu
+from .filters import OrderPageFilter
+from .pagination import OrderPageCursorPagination
+from .query_budget import query_budget
+from .order_events import stream_target, sse_stream
+from .exports import export_path
+
+
+@query_budget(4)
+@cache_catalogue_page
 def index(request: HttpRequest) -> HttpResponse:
     """Главная страница со списком ресторанов"""
-    restaurants = Restaurant.objects.all()
-    cart_items_count = get_cart_items_count(request)
+    restaurants = Restaurant.objects.all()  # ленивый queryset: при попадании во фрагментный кеш запроса нет
 
     return render(request, 'index.html', {
         'restaurants': restaurants,
-        'cart_items_count': cart_items_count
+        **catalogue_context()
     })
 
 
+@query_budget(6)
+@cache_catalogue_page
 def restaurant_detail(request: HttpRequest, restaurant_id: int) -> HttpResponse:
     """Детальная страница ресторана с продуктами"""
-    restaurant = get_object_or_404(Restaurant, id=restaurant_id)
-    products = Product.objects.filter(restaurant=restaurant)
-    cart_items_count = get_cart_items_count(request)
-    cart = request.session.get('cart', {})
+    restaurant, products = get_restaurant_menu(restaurant_id)
+    cart = get_cart_backend().get(request.user.id) if request.user.is_authenticated else {}
 
     # Добавляем информацию о количестве в корзине для каждого продукта
     for product in products:
-        product.in_cart = cart.get(str(product.id), 0)
+        product.in_cart = cart.get(product.id, 0)
 
     return render(request, 'restaurant.html', {
         'restaurant': restaurant,
-        'products': products,
-        'cart_items_count': cart_items_count
+        'products': products
     })
 
 
+@query_budget(6)
 @login_required
 def orders(request: HttpRequest) -> HttpResponse:
-    """Список заказов (клиент видит только свои, админ - все)"""
-    if request.user.is_superuser or request.user.is_staff:
+    """
+    Список заказов (клиент видит только свои, админ - все).
+    Фильтры status, restaurant, date_from, date_to; курсорная пагинация по 50 заказов.
+    Персоналу доступна выгрузка всего отфильтрованного диапазона: ?format=csv
+    """
+    is_staff = request.user.is_superuser or request.user.is_staff
+    if is_staff:
         orders_list = Order.objects.all()
     else:
         orders_list = Order.objects.filter(customer=request.user)
 
-    cart_items_count = get_cart_items_count(request)
+    order_filter = OrderPageFilter(request.GET, queryset=orders_list)
+    orders_list = order_filter.qs
+
+    if is_staff and request.GET.get('format') == 'csv':
+        return stream_orders_csv(orders_list)
+
+    paginator = OrderPageCursorPagination()
+    try:
+        page = paginator.paginate_queryset(orders_list.select_related('restaurant', 'customer'), Request(request))
+    except NotFound:  # поврежденный или подделанный ?cursor=
+        raise Http404('Некорректная ссылка на страницу')
+
     return render(request, 'orders.html', {
-        'orders': orders_list,
-        'cart_items_count': cart_items_count
+        'orders': page,
+        'filter': order_filter,
+        'next_page': paginator.get_next_link(),
+        'previous_page': paginator.get_previous_link(),
     })
 
 
+class Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def stream_orders_csv(orders_list) -> StreamingHttpResponse:
+    """Потоковая выгрузка заказов в CSV: строки читаются с сервера порциями, без загрузки в память"""
+    rows = orders_list.order_by('-created_at', 'id').values_list(
+        'id', 'created_at', 'status', 'restaurant__name', 'customer__username', 'address', 'total_price',
+    ).iterator(chunk_size=2000)
+    writer = csv.writer(Echo())
+    header = ['id', 'created_at', 'status', 'restaurant', 'customer', 'address', 'total_price']
+
+    def lines():
+        yield writer.writerow(header)
+        for order_id, created_at, order_status, restaurant, customer, address, total in rows:
+            yield writer.writerow([order_id, timezone.localtime(created_at).isoformat(), order_status,
+                                   restaurant, customer, address, total])
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="orders.csv"'
+    return response
+
+
+@query_budget(6)
 @login_required
 def order_detail(request: HttpRequest, order_id: int) -> HttpResponse:
     """Детальная страница заказа"""
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(
+        Order.objects.select_related('restaurant', 'customer', 'courier__user').prefetch_related('items__product'),
+        id=order_id,
+    )
 
     # Проверка прав доступа
     if not (request.user.is_superuser or request.user.is_staff or order.customer == request.user):
         messages.error(request, 'У вас нет доступа к этому заказу')
         return redirect('orders')
 
-    cart_items_count = get_cart_items_count(request)
     return render(request, 'order.html', {
-        'order': order,
-        'cart_items_count': cart_items_count
+        'order': order
     })
 
 
+async def order_events(request: HttpRequest, order_id: Optional[int] = None) -> HttpResponse:
+    """
+    Поток статусов (Server-Sent Events): одного заказа или активных заказов пользователя.
+    Соединение держится открытым, поэтому нужен ASGI-сервер (см. timqwees/asgi.py).
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Поток событий доступен только под ASGI-сервером', status=501)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    key, orders = stream_target(user, order_id)
+    if order_id is not None and not await orders.aexists():
+        return HttpResponse(status=404)
+
+    response = StreamingHttpResponse(sse_stream(key, orders), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx не буферизует поток
+    return response
+
+
 def register(request: HttpRequest) -> HttpResponse:
     """Регистрация нового клиента => задание 4 (часть 1 method)"""
     if request.method == 'POST':
@@ -88,10 +171,8 @@ def register(request: HttpRequest) -> HttpResponse:
     else:
         form = RegisterForm()
 
-    cart_items_count = get_cart_items_count(request)
     return render(request, 'register.html', {
-        'form': form,
-        'cart_items_count': cart_items_count
+        'form': form
     })
 
 
@@ -116,10 +197,8 @@ def login_view(request: HttpRequest) -> HttpResponse:
     else:
         form = LoginForm()
 
-    cart_items_count = get_cart_items_count(request)
     return render(request, 'login.html', {
-        'form': form,
-        'cart_items_count': cart_items_count
+        'form': form
     })
 
 
@@ -131,50 +210,37 @@ def logout_view(request: HttpRequest) -> HttpResponse:
     return redirect('index')
 
 
+@query_budget(5)
 @login_required
 def cart(request: HttpRequest) -> HttpResponse:
     """Корзина клиента"""
-    cart = request.session.get('cart', {})
-    cart_items = []
-    total_price = Decimal('0.00')
-
-    for product_id, quantity in cart.items():
-        try:
-            product = Product.objects.get(id=product_id)
-            item_total = product.price * quantity
-            total_price += item_total
-            cart_items.append({
-                'product': product,
-                'quantity': quantity,
-                'total': item_total
-            })
-        except Product.DoesNotExist:
-            continue
-
-    cart_items_count = get_cart_items_count(request)
+    priced = price_cart(get_cart_backend().get(request.user.id))
+
     return render(request, 'cart.html', {
-        'cart_items': cart_items,
-        'total_price': total_price,
-        'cart_items_count': cart_items_count
+        'cart_items': priced.lines,
+        'total_price': priced.total_price
     })
 
 
+def parse_quantity(value) -> Optional[int]:
+    """Количество из формы; None — не целое число"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
 @require_POST
 @login_required
 def add_to_cart(request: HttpRequest, product_id: int) -> HttpResponse:
     """Добавление товара в корзину"""
     product = get_object_or_404(Product, id=product_id)
-    quantity = int(request.POST.get('quantity', 1))
-
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
-
-    if product_id_str in cart:
-        cart[product_id_str] += quantity
-    else:
-        cart[product_id_str] = quantity
+    quantity = parse_quantity(request.POST.get('quantity', 1))
+    if quantity is None or quantity <= 0:
+        return HttpResponseBadRequest('Количество должно быть положительным целым числом')
 
-    request.session['cart'] = cart
+    # Атомарное увеличение количества одной строки корзины
+    get_cart_backend().add(request.user.id, product.id, quantity)
     messages.success(request, f'{product.name} добавлен в корзину')
 
     return redirect('restaurant_detail', restaurant_id=product.restaurant.id)
@@ -184,13 +250,8 @@ def add_to_cart(request: HttpRequest, product_id: int) -> HttpResponse:
 @login_required
 def remove_from_cart(request: HttpRequest, product_id: int) -> HttpResponse:
     """Удаление товара из корзины"""
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
-
-    if product_id_str in cart:
-        del cart[product_id_str]
-        request.session['cart'] = cart
-        messages.success(request, 'Товар удален из корзины')
+    get_cart_backend().remove(request.user.id, product_id)
+    messages.success(request, 'Товар удален из корзины')
 
     return redirect('cart')
 
@@ -199,39 +260,38 @@ def remove_from_cart(request: HttpRequest, product_id: int) -> HttpResponse:
 @login_required
 def update_cart(request: HttpRequest, product_id: int) -> HttpResponse:
     """Обновление количества товара в корзине"""
-    quantity = int(request.POST.get('quantity', 1))
-
-    cart = request.session.get('cart', {})
-    product_id_str = str(product_id)
-
-    if quantity > 0:
-        cart[product_id_str] = quantity
-    else:
-        if product_id_str in cart:
-            del cart[product_id_str]
+    product = get_object_or_404(Product, id=product_id)
+    quantity = parse_quantity(request.POST.get('quantity', 1))
+    if quantity is None:
+        return HttpResponseBadRequest('Количество должно быть целым числом')
 
-    request.session['cart'] = cart
+    # quantity <= 0 удаляет строку из корзины
+    get_cart_backend().set(request.user.id, product.id, quantity)
     return redirect('cart')
 
 
 @login_required
 def checkout(request: HttpRequest) -> HttpResponse:
     """Оформление заказа"""
-    cart = request.session.get('cart', {})
+    cart_backend = get_cart_backend()
+    cart = cart_backend.get(request.user.id)
 
     if not cart:
         messages.error(request, 'Ваша корзина пуста')
         return redirect('cart')
 
-    # Проверяем, что все товары из одного ресторана
-    products = Product.objects.filter(id__in=cart.keys())
-    restaurants = products.values_list('restaurant', flat=True).distinct()
+    # Все продукты корзины — одним запросом
+    priced = price_cart(cart)
+    if not priced:
+        messages.error(request, 'Ваша корзина пуста')
+        return redirect('cart')
 
-    if len(restaurants) > 1:
+    # Проверяем, что все товары из одного ресторана
+    if len(priced.restaurant_ids) > 1:
         messages.error(request, 'Все товары должны быть из одного ресторана')
         return redirect('cart')
 
-    restaurant = Restaurant.objects.get(id=restaurants[0])
+    restaurant = priced.lines[0].product.restaurant
 
     if request.method == 'POST':
         form = OrderForm(request.POST)
@@ -239,32 +299,16 @@ def checkout(request: HttpRequest) -> HttpResponse:
             # Транзакция: все операции выполняются атомарно (либо все, либо ничего)
             try:
                 with transaction.atomic():
-                    # Создаем заказ
-                    order = Order.objects.create(
+                    # Заказ и все позиции — фиксированное число запросов
+                    order = place_order(
                         customer=request.user,
                         restaurant=restaurant,
                         address=form.cleaned_data['address'],
-                        status='pending'
+                        cart=cart,
                     )
 
-                    # Добавляем элементы заказа
-                    total_price = Decimal('0.00')
-                    for product_id, quantity in cart.items():
-                        product = Product.objects.select_for_update().get(id=product_id)  # блокировка строки
-                        item_total = product.price * quantity
-                        total_price += item_total
-                        OrderItem.objects.create(
-                            order=order,
-                            product=product,
-                            quantity=quantity,
-                            price=product.price
-                        )
-
-                    order.total_price = total_price
-                    order.save()
-
                     # Очищаем корзину
-                    request.session['cart'] = {}
+                    cart_backend.clear(request.user.id)
 
                 # Отправка письма через Celery (асинхронно)
                 send_order_confirmation_email.delay(
@@ -282,46 +326,26 @@ def checkout(request: HttpRequest) -> HttpResponse:
     else:
         form = OrderForm()
 
-    # Подсчитываем итоговую стоимость
-    total_price = Decimal('0.00')
-    cart_items = []
-    for product_id, quantity in cart.items():
-        product = Product.objects.get(id=product_id)
-        item_total = product.price * quantity
-        total_price += item_total
-        cart_items.append({
-            'product': product,
-            'quantity': quantity,
-            'total': item_total
-        })
-
-    cart_items_count = get_cart_items_count(request)
     return render(request, 'checkout.html', {
         'form': form,
         'restaurant': restaurant,
-        'cart_items': cart_items,
-        'total_price': total_price,
-        'cart_items_count': cart_items_count
+        'cart_items': priced.lines,
+        'total_price': priced.total_price
     })
 
 
-def get_cart_items_count(request: HttpRequest) -> int:
-    """Получить количество товаров в корзине"""
-    cart = request.session.get('cart', {})
-    return sum(cart.values())
-
-
 # ========================================
 # CRUD операции для продуктов
 # ========================================
 
+@query_budget(4)
+@cache_catalogue_page
 def product_list(request: HttpRequest) -> HttpResponse:
     """Просмотр всех продуктов (READ)"""
     products = Product.objects.all().select_related('restaurant')
-    cart_items_count = get_cart_items_count(request)
     return render(request, 'product_list.html', {
         'products': products,
-        'cart_items_count': cart_items_count
+        **catalogue_context()
     })
 
 
@@ -337,11 +361,9 @@ def product_create(request: HttpRequest) -> HttpResponse:
     else:
         form = ProductForm()
 
-    cart_items_count = get_cart_items_count(request)
     return render(request, 'product_form.html', {
         'form': form,
-        'title': 'Создать продукт',
-        'cart_items_count': cart_items_count
+        'title': 'Создать продукт'
     })
 
 
@@ -359,12 +381,10 @@ def product_update(request: HttpRequest, product_id: int) -> HttpResponse:
     else:
         form = ProductForm(instance=product)
 
-    cart_items_count = get_cart_items_count(request)
     return render(request, 'product_form.html', {
         'form': form,
         'title': 'Редактировать продукт',
-        'product': product,
-        'cart_items_count': cart_items_count
+        'product': product
     })
 
 
@@ -379,13 +399,23 @@ def product_delete(request: HttpRequest, product_id: int) -> HttpResponse:
         messages.success(request, f'Продукт "{product_name}" успешно удален!')
         return redirect('product_list')
 
-    cart_items_count = get_cart_items_count(request)
     return render(request, 'product_delete.html', {
-        'product': product,
-        'cart_items_count': cart_items_count
+        'product': product
     })
 
 
+@staff_member_required
+def export_download(request: HttpRequest, name: str) -> FileResponse:
+    """Скачивание фоновой выгрузки из админки по ссылке из письма (только персонал)"""
+    try:
+        path = export_path(name)
+    except ValueError:
+        raise Http404('Выгрузка не найдена')
+    if not path.is_file():
+        raise Http404('Выгрузка не найдена')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
+
+
 # ========================================
 # Dev Tools и тестирование email
 # ========================================
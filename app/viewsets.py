@@ -5,22 +5,34 @@ from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.db.models import Q, Sum, Count, Avg, F
-from django.db import transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import timedelta
+from decimal import Decimal
 from typing import Any
 
-from .models import Restaurant, Product, Order
+from .models import Restaurant, Product, Order, RestaurantStats, OrderDailyStats
 from .serializers import (
-    RestaurantSerializer, ProductSerializer, OrderSerializer
+    RestaurantSerializer, ProductSerializer, OrderSerializer, PriceChangeSerializer
 )  # DRF
 from .filters import ProductFilter, OrderFilter, RestaurantFilter
-from .tasks import notify_order_status_change
+from .order_notifications import schedule_status_notifications
+from .cart_backends import get_cart_backend
+from .stats import top_products, POPULARITY_WINDOWS
+from .search import search_products
+from .autocomplete import autocomplete_index
+from .product_import import upsert_products, MAX_IMPORT_ROWS
+from .pricing import MIN_PRICE, PriceChange, apply_price_change, preview_price_change
+from .order_status import (
+    change_order_status, change_orders_status, TransitionError, TransitionConflict, MAX_BULK_ORDERS
+)
+from .pagination import ListActionMixin, SelectablePaginationMixin, OrderCursorPagination, ProductCursorPagination
+from .query_budget import query_budget
 
 # API RestaurantViewSet
 
 
-class RestaurantViewSet(viewsets.ModelViewSet):
+class RestaurantViewSet(ListActionMixin, viewsets.ModelViewSet):
     # ViewSet для ресторанов
     queryset = Restaurant.objects.all()  # получаем все обьекты полей с Restaurant
     serializer_class = RestaurantSerializer
@@ -29,6 +41,7 @@ class RestaurantViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'address', 'phone']
     ordering_fields = ['name', 'created_at']
     ordering = ['name']
+    query_budgets = {'list': 4, 'retrieve': 4}  # бюджет SQL-запросов, см. query_budget.py
 
     def get_queryset(self) -> Any:
         """Фильтрация по текущему пользователю (если не админ)"""
@@ -52,31 +65,30 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         return queryset.select_related('owner')
 
     @action(detail=True, methods=['get'])
+    @query_budget(4)
     def my_restaurants(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         """Получить рестораны текущего пользователя"""
         if not request.user.is_authenticated:
             return Response({'error': 'Требуется авторизация'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        restaurants = Restaurant.objects.filter(owner=request.user)
-        serializer = self.get_serializer(restaurants, many=True)
-        return Response(serializer.data)
+        return self.list_response(self.get_queryset().filter(owner=request.user))
 
     @action(detail=False, methods=['get'])
+    @query_budget(3)
     def stats(self, request: Request, *args: Any, **kwargs: Any) -> Response:
-        """Статистика ресторанов с аннотациями (Count, Avg)"""
-        restaurants = Restaurant.objects.annotate(
-            product_count=Count('product'),
-            avg_product_price=Avg('product__price'),
-            order_count=Count('order'),
-        ).order_by('-product_count')
+        """Статистика ресторанов из материализованной таблицы RestaurantStats"""
+        restaurants = Restaurant.objects.select_related('stats').order_by(
+            F('stats__product_count').desc(nulls_last=True), 'name'
+        )
         data = []
         for r in restaurants:
+            stats = getattr(r, 'stats', None) or RestaurantStats(restaurant=r)
             data.append({
                 'id': r.id,
                 'name': r.name,
-                'product_count': r.product_count,
-                'avg_product_price': round(r.avg_product_price, 2) if r.avg_product_price else 0,
-                'order_count': r.order_count,
+                'product_count': stats.product_count,
+                'avg_product_price': stats.avg_product_price,
+                'order_count': stats.order_count,
             })
         return Response(data)
 
@@ -88,10 +100,12 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         return Response({'message': f'Ресторан {restaurant.name} обновлен'})
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(SelectablePaginationMixin, viewsets.ModelViewSet):
     """ViewSet для продуктов"""
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    cursor_pagination_class = ProductCursorPagination  # ?pagination=cursor
+    query_budgets = {'list': 5, 'retrieve': 4}
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     search_fields = ['name', 'description']
@@ -104,8 +118,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         """
         context = super().get_serializer_context()
         if self.request.user.is_authenticated:
-            cart = self.request.session.get('cart', {})
-            context['cart_product_ids'] = [int(pid) for pid in cart.keys() if pid.isdigit()]
+            context['cart_product_ids'] = list(get_cart_backend().get(self.request.user.id))
         else:
             context['cart_product_ids'] = []
         return context
@@ -152,20 +165,74 @@ class ProductViewSet(viewsets.ModelViewSet):
         return queryset.select_related('restaurant', 'restaurant__owner')
 
     @action(detail=False, methods=['get'])
+    @query_budget(5)
+    def search(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        """
+        Полнотекстовый поиск по названию и описанию с ранжированием (см. search.py).
+        Параметры: q — запрос, limit — число результатов (до 50, по умолчанию 20).
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Не указан запрос q'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = request.query_params.get('limit', '20')
+        if not limit.isdigit() or not 0 < int(limit) <= 50:
+            return Response({'error': 'limit должен быть от 1 до 50'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset()
+        hits = search_products(query, int(limit), within=queryset)
+        products = queryset.in_bulk([product_id for product_id, _ in hits])
+        ranked = [(products[product_id], score) for product_id, score in hits if product_id in products]
+        data = self.get_serializer([product for product, _ in ranked], many=True).data
+        for item, (_, score) in zip(data, ranked):
+            item['score'] = round(score, 4)
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    @query_budget(5)
     def popular_products(self, request: Request, *args: Any, **kwargs: Any) -> Response:
-        """Получить популярные продукты (продукты из заказов)"""
-        # Сложный запрос с Q: продукты, которые есть в заказах и не отменены
-        products = Product.objects.filter(
-            Q(orderitem__order__status__in=['pending', 'preparing', 'ready',
-                                        'delivering', 'completed'])
-            &
-            ~Q(orderitem__order__status='cancelled')
-        ).distinct().annotate(
-            total_ordered=Sum('orderitem__quantity')
-        ).order_by('-total_ordered')[:10]
-
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        """
+        Топ-10 продуктов по продажам из дневных корзин ProductDailySales (без отмененных заказов).
+        Параметры: window (1d, 7d, 30d; по умолчанию 30d), restaurant (id).
+        """
+        window = request.query_params.get('window', '30d')
+        if window not in POPULARITY_WINDOWS:
+            return Response({'error': f'Неверный window, допустимо: {", ".join(POPULARITY_WINDOWS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        restaurant_id = request.query_params.get('restaurant')
+        if restaurant_id and not restaurant_id.isdigit():
+            return Response({'error': 'Неверный restaurant'}, status=status.HTTP_400_BAD_REQUEST)
+
+        top = top_products(window, int(restaurant_id) if restaurant_id else None)
+        products = Product.objects.select_related('restaurant').in_bulk([product_id for product_id, _ in top])
+        ranked = [(products[product_id], total) for product_id, total in top if product_id in products]
+        # Один сериализатор на весь список: контекст (корзина) читается один раз
+        data = self.get_serializer([product for product, _ in ranked], many=True).data
+        for item, (_, total) in zip(data, ranked):
+            item['total_ordered'] = total
+        return Response(data)
+
+    @action(detail=False, methods=['post'])
+    @query_budget(24)  # 8 запросов; на SQLite INSERT режется на пачки по 999 параметров
+    def bulk_upsert(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        """
+        Массовая загрузка меню: новые продукты создаются, существующие (тот же ресторан и название)
+        обновляются. Тело — список {restaurant, name, description, price} (до MAX_IMPORT_ROWS строк).
+        Запросы выполняются на всю пачку, а не на строку; ошибки возвращаются по номерам строк.
+        """
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'error': 'Ожидается непустой список продуктов'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > MAX_IMPORT_ROWS:
+            return Response({'error': f'Не больше {MAX_IMPORT_ROWS} строк за запрос'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        result = upsert_products(rows, request.user)
+        saved = result.created or result.updated
+        return Response({
+            'created': [product.pk for product in result.created],
+            'updated': [product.pk for product in result.updated],
+            'errors': result.errors,
+        }, status=status.HTTP_200_OK if saved or not result.errors else status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post'])
     def update_price(self, request: Request, pk: int = None, *args: Any, **kwargs: Any) -> Response:
@@ -190,11 +257,31 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Неверный формат цены'}, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=['post'])
-    def bulk_discount(self, request: Request, *args: Any, **kwargs: Any) -> Response:
-        """Массовая скидка с использованием F-выражений.
-        F-выражение позволяет обновлять поля на уровне БД без загрузки в Python.
-        Пример: снизить цену всех продуктов ресторана на процент.
+    @query_budget(10)
+    def bulk_price(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        """
+        Массовое изменение цен одним UPDATE с записью истории (см. pricing.py).
+        Тело: mode (percent, absolute, round), value, round_to, restaurant, dry_run.
+        Выборка — продукты пользователя с фильтрами из GET-параметров (как в списке);
+        dry_run=true возвращает предпросмотр без изменений. Продукты с новой ценой вне
+        границ не меняются и возвращаются в skipped.
         """
+        serializer = PriceChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(self.get_queryset())
+        restaurant_id = serializer.validated_data.get('restaurant')
+        if restaurant_id:
+            queryset = queryset.filter(restaurant_id=restaurant_id)
+
+        change = serializer.to_change()
+        if serializer.validated_data['dry_run']:
+            return Response(preview_price_change(queryset, change))
+        result = apply_price_change(queryset, change, request.user)
+        return Response({'updated': result.updated, 'skipped': result.skipped, 'reason': change.describe()})
+
+    @action(detail=False, methods=['post'])
+    def bulk_discount(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        """Массовая скидка на продукты ресторана (частный случай bulk_price с mode=percent)"""
         restaurant_id = request.data.get('restaurant_id')
         discount_percent = request.data.get('discount_percent', 10)
 
@@ -202,18 +289,22 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Не указан restaurant_id'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            discount_percent = float(discount_percent)
+            discount_percent = Decimal(str(discount_percent))
             if not (0 < discount_percent <= 100):
                 return Response({'error': 'Процент скидки должен быть от 0 до 100'}, status=status.HTTP_400_BAD_REQUEST)
-        except (ValueError, TypeError):
+        except (ArithmeticError, TypeError):
             return Response({'error': 'Неверный формат процента'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # F-выражение: price = price * (1 - discount/100)  — всё на уровне БД
-        multiplier = 1 - discount_percent / 100
-        updated = Product.objects.filter(restaurant_id=restaurant_id).update(
-            price=F('price') * multiplier
+        # Один UPDATE с F-выражением и округлением до копеек, история — пачкой
+        result = apply_price_change(
+            self.get_queryset().filter(restaurant_id=restaurant_id),
+            PriceChange(mode='percent', value=-discount_percent),
+            request.user,
         )
-        return Response({'message': f'Скидка {discount_percent}% применена к {updated} продуктам'})
+        message = f'Скидка {discount_percent}% применена к {result.updated} продуктам'
+        if result.skipped:
+            message += f', пропущено {len(result.skipped)} (цена стала бы меньше {MIN_PRICE})'
+        return Response({'message': message, 'skipped': result.skipped})
 
     @action(detail=False, methods=['get'])
     def price_stats(self, request: Request, *args: Any, **kwargs: Any) -> Response:
@@ -226,10 +317,12 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Response(stats)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ListActionMixin, SelectablePaginationMixin, viewsets.ModelViewSet):
     """ViewSet для заказов"""
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    cursor_pagination_class = OrderCursorPagination  # ?pagination=cursor
+    query_budgets = {'list': 7, 'retrieve': 5}  # list: +1 запрос на проверку фильтра restaurant
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = OrderFilter
     search_fields = ['address', 'customer__username', 'restaurant__name']
@@ -278,21 +371,23 @@ class OrderViewSet(viewsets.ModelViewSet):
         return queryset.select_related('customer', 'restaurant', 'courier', 'courier__user').prefetch_related('items', 'items__product')
 
     @action(detail=False, methods=['get'])
+    @query_budget(7)
     def recent_orders(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         """Получить недавние заказы (за последние 7 дней)"""
         seven_days_ago = timezone.now() - timedelta(days=7)
 
         # Сложный запрос с Q: заказы за последние 7 дней И не отменены
-        orders = Order.objects.filter(
+        orders = self.get_queryset().filter(
             Q(created_at__gte=seven_days_ago) & ~Q(status='cancelled')
-        ).order_by('-created_at')
-
-        serializer = self.get_serializer(orders, many=True)
-        return Response(serializer.data)
+        )
+        return self.list_response(orders)
 
     @action(detail=True, methods=['post'])
     def change_status(self, request: Request, pk: int = None, *args: Any, **kwargs: Any) -> Response:
-        """Изменить статус заказа"""
+        """
+        Изменить статус заказа по Order.STATUS_TRANSITIONS (compare-and-set, см. order_status.py).
+        expected_status — статус, который видел клиент; если в БД он уже другой, ответ 409.
+        """
         order = self.get_object()
         new_status = request.data.get('status', None)
 
@@ -302,39 +397,109 @@ class OrderViewSet(viewsets.ModelViewSet):
         if new_status not in [choice[0] for choice in Order.STATUS_CHOICES]:
             return Response({'error': 'Недопустимый статус'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Атомарное изменение статуса + асинхронное уведомление
-        with transaction.atomic():
-            order.status = new_status
-            order.save()
+        # Условный UPDATE по ожидаемому статусу вместо полного save(): параллельные изменения не теряются
+        try:
+            change_order_status(order, new_status, request.user, request.data.get('expected_status'))
+        except TransitionConflict as e:
+            return Response({'error': str(e), 'status': e.current_status}, status=status.HTTP_409_CONFLICT)
+        except TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Celery задача — отправить уведомление асинхронно
-        notify_order_status_change.delay(order.id, new_status)
+        # Уведомление уходит отложенной задачей: смены статуса в пределах окна объединяются
+        schedule_status_notifications([order.id])
 
         serializer = self.get_serializer(order)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    @query_budget(16)
+    def bulk_change_status(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        """
+        Перевести пачку заказов в новый статус (до MAX_BULK_ORDERS): UPDATE на каждый исходный статус,
+        история пачкой, уведомления — одной задачей. Тело: ids, status.
+        Заказы с недопустимым переходом или измененные параллельно возвращаются в skipped.
+        """
+        ids = request.data.get('ids')
+        new_status = request.data.get('status')
+        if new_status not in [choice[0] for choice in Order.STATUS_CHOICES]:
+            return Response({'error': 'Недопустимый статус'}, status=status.HTTP_400_BAD_REQUEST)
+        if (not isinstance(ids, list) or not ids or len(ids) > MAX_BULK_ORDERS
+                or not all(isinstance(order_id, int) for order_id in ids)):
+            return Response({'error': f'ids — непустой список id заказов (до {MAX_BULK_ORDERS})'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        result = change_orders_status(self.get_queryset().filter(id__in=ids), new_status, request.user)
+        schedule_status_notifications(order.id for order in result.changed)
+        skipped = {order_id: None for order_id in ids}  # None — заказ не найден
+        skipped.update(result.skipped)
+        for order in result.changed:
+            del skipped[order.id]
+        return Response({'changed': [order.id for order in result.changed], 'skipped': skipped})
+
     @action(detail=False, methods=['get'])
+    @query_budget(7)
     def my_orders(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         """Получить заказы текущего пользователя"""
         if not request.user.is_authenticated:
             return Response({'error': 'Требуется авторизация'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        orders = Order.objects.filter(customer=request.user)
-        serializer = self.get_serializer(orders, many=True)
-        return Response(serializer.data)
+        return self.list_response(self.get_queryset().filter(customer=request.user))
 
     @action(detail=False, methods=['get'])
+    @query_budget(3)
     def order_stats(self, request: Request, *args: Any, **kwargs: Any) -> Response:
-        """Статистика заказов с аннотациями и F-выражениями"""
-        stats = Order.objects.aggregate(
-            total_orders=Count('id'),
-            total_revenue=Sum('total_price'),
-            avg_order_value=Avg('total_price'),
-        )
-        # Статистика по статусам
-        status_stats = Order.objects.values('status').annotate(
-            count=Count('id'),
-            total=Sum('total_price')
-        ).order_by('-count')
-        stats['by_status'] = list(status_stats)
+        """
+        Статистика заказов из дневных агрегатов OrderDailyStats.
+        Параметры: date_from, date_to (YYYY-MM-DD, включительно), restaurant (id).
+        """
+        buckets = OrderDailyStats.objects.all()
+        for param, lookup in (('date_from', 'date__gte'), ('date_to', 'date__lte')):
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    day = parse_date(value)
+                except ValueError:  # корректный формат, но несуществующая дата
+                    day = None
+                if day is None:
+                    return Response({'error': f'Неверный формат {param}, ожидается YYYY-MM-DD'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                buckets = buckets.filter(**{lookup: day})
+        restaurant_id = request.query_params.get('restaurant')
+        if restaurant_id:
+            if not restaurant_id.isdigit():
+                return Response({'error': 'Неверный restaurant'}, status=status.HTTP_400_BAD_REQUEST)
+            buckets = buckets.filter(restaurant_id=restaurant_id)
+
+        # Статистика по статусам — группировка по небольшой таблице агрегатов
+        status_stats = list(buckets.order_by().values('status').annotate(
+            count=Sum('order_count'),
+            total=Sum('revenue'),
+        ).filter(count__gt=0).order_by('-count'))
+
+        total_orders = sum(row['count'] for row in status_stats)
+        total_revenue = sum((row['total'] for row in status_stats), Decimal('0')) if status_stats else None
+        stats = {
+            'total_orders': total_orders,
+            'total_revenue': total_revenue,
+            'avg_order_value': total_revenue / total_orders if total_orders else None,
+            'by_status': status_stats,
+        }
         return Response(stats)
+
+
+class AutocompleteViewSet(viewsets.ViewSet):
+    """
+    Автодополнение ресторанов и продуктов из индекса в памяти (см. autocomplete.py).
+    Параметры: q — введенный текст, type (restaurant, product), limit (до 20, по умолчанию 10).
+    """
+    query_budgets = {'list': 4}  # сессия и пользователь + построение индекса при первом запросе
+
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        query = request.query_params.get('q', '')
+        kind = request.query_params.get('type')
+        if kind not in (None, 'restaurant', 'product'):
+            return Response({'error': 'type: restaurant или product'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = request.query_params.get('limit', '10')
+        if not limit.isdigit() or not 0 < int(limit) <= 20:
+            return Response({'error': 'limit должен быть от 1 до 20'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(autocomplete_index.search(query, int(limit), kind))
@@ -3,6 +3,10 @@ ASGI config for timqwees project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+HTTP обслуживает Django (в том числе SSE-поток статусов заказов),
+WebSocket-соединения /ws/orders/ — app.order_events.websocket_application.
+Запуск: uvicorn timqwees.asgi:application
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -13,4 +17,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'timqwees.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from app.order_events import websocket_application  # noqa: E402  после django.setup()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -6,7 +6,7 @@ from django.urls import path, include
 from django.views.generic import RedirectView
 from rest_framework.routers import DefaultRouter
 from app import views
-from app.viewsets import RestaurantViewSet, ProductViewSet, OrderViewSet
+from app.viewsets import RestaurantViewSet, ProductViewSet, OrderViewSet, AutocompleteViewSet
 
 # регистрация маршрутов для viewSet
 router = DefaultRouter()  # чтобы интерфейс был не используем simplerouter
@@ -25,6 +25,7 @@ router.register(r'restaurants', RestaurantViewSet, basename='restaurant')
 """
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'orders', OrderViewSet, basename='order')
+router.register(r'autocomplete', AutocompleteViewSet, basename='autocomplete')
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -53,6 +54,9 @@ urlpatterns = [
     # Заказы
     path('orders/', views.orders, name='orders'),
     path('order/<int:order_id>/', views.order_detail, name='order_detail'),
+    path('orders/events/', views.order_events, name='order_events'),  # SSE: статусы активных заказов
+    path('order/<int:order_id>/events/', views.order_events, name='order_status_events'),
+    path('exports/<str:name>/', views.export_download, name='export_download'),  # фоновые выгрузки (персонал)
 
     # CRUD для продуктов
     path('products/', views.product_list, name='product_list'),